@@ -303,20 +303,14 @@ class MetadataRepo(object):
     @staticmethod
     def remove_deleted_files_meta_manifest(manifest, deleted_files):
         if manifest is not None:
-            for file in deleted_files:
-                manifest.rm_file(file)
+            manifest.rm_files(deleted_files)
             manifest.save()
 
     @staticmethod
     def remove_files_added_after_base_tag(manifest, ws_path):
-        files_added = []
         if manifest is not None:
-            for key, value in manifest.get_yaml().items():
-                for key_value in value:
-                    if not os.path.exists(os.path.join(ws_path, key_value)):
-                        files_added.append(key_value)
-            for file in files_added:
-                manifest.rm_file(file)
+            files_added = [file for file in manifest.files() if not os.path.exists(os.path.join(ws_path, file))]
+            manifest.rm_files(files_added)
             manifest.save()
 
     def get_current_tag(self):
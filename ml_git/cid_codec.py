@@ -0,0 +1,72 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import hashlib
+from functools import lru_cache
+
+'''Low level codec of the CIDs used by ml-git.
+
+ml-git only builds CIDv1 of dag-pb content with a sha2-256 multihash, rendered in base58btc:
+    'z' + base58btc(0x01 (cid version) | 0x70 (dag-pb) | 0x12 (sha2-256) | 0x20 (digest length) | digest)
+As the prefix never changes, CIDs are built and parsed directly from the raw 32 bytes digest, which gives the same
+strings as str(CIDv1('dag-pb', multihash.encode(digest, 'sha2-256'))) without building the intermediate objects.'''
+
+CID_PREFIX = bytes([0x01, 0x70, 0x12, 0x20])
+DIGEST_SIZE = 32
+MULTIBASE_BASE58BTC = 'z'
+
+_B58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+_B58_INDEX = {c: i for i, c in enumerate(_B58_ALPHABET)}
+_CID_SIZE = len(CID_PREFIX) + DIGEST_SIZE
+
+
+def _b58encode(data):
+    n = int.from_bytes(data, 'big')
+    encoded = []
+    while n:
+        n, r = divmod(n, 58)
+        encoded.append(_B58_ALPHABET[r])
+    # the first byte of the prefix is never 0, so there are no leading zeros to encode
+    return ''.join(reversed(encoded))
+
+
+def _b58decode(encoded):
+    n = 0
+    for c in encoded:
+        n = n * 58 + _B58_INDEX[c]
+    return n.to_bytes(_CID_SIZE, 'big')
+
+
+def digest_to_cid(digest):
+    return MULTIBASE_BASE58BTC + _b58encode(CID_PREFIX + digest)
+
+
+def data_to_cid(data):
+    return digest_to_cid(hashlib.sha256(data).digest())
+
+
+@lru_cache(maxsize=4096)
+def cid_to_digest(cid):
+    """Returns the raw sha2-256 digest encoded in cid. Raises ValueError if cid is not a CID built by ml-git."""
+    if not cid or cid[0] != MULTIBASE_BASE58BTC:
+        raise ValueError(cid)
+    try:
+        raw = _b58decode(cid[1:])
+    except (KeyError, OverflowError):
+        raise ValueError(cid)
+    if raw[:len(CID_PREFIX)] != CID_PREFIX:
+        raise ValueError(cid)
+    digest = raw[len(CID_PREFIX):]
+    # leading '1' digits decode to the same value, only the canonical string of a digest is its CID
+    if digest_to_cid(digest) != cid:
+        raise ValueError(cid)
+    return digest
+
+
+def cid_matches(cid, digest):
+    try:
+        return cid_to_digest(cid) == digest
+    except ValueError:
+        return False
@@ -71,6 +71,13 @@ def gc():
     repositories[PROJECT].garbage_collector()
 
 
+@repository.command('repack', help='Move the small objects to pack files and compact the packs.')
+@click.help_option(hidden=True)
+@click.option('--verbose', is_flag=True, expose_value=False, callback=set_verbose_mode, help='Debug mode')
+def repack():
+    repositories[PROJECT].repack()
+
+
 @config.command('push', help='Create a new version of the ML-Git configuration file. '
                              'This command internally runs git\'s add, commit and push commands.')
 @click.option('--message', '-m', default='Updating config file', help='Use the provided <msg> as the commit message.')
@@ -0,0 +1,284 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import itertools
+from array import array
+from collections.abc import KeysView, Mapping, Set
+
+from ml_git.cid_codec import cid_to_digest, digest_to_cid, DIGEST_SIZE
+from ml_git.utils import yaml_load
+
+'''Read-only and compact in-memory form of a MANIFEST.yaml.
+
+Loaded with yaml_load, a manifest is a dict of CIDs to sets of paths, which costs several hundreds of bytes of Python
+objects per file. CompactManifest keeps the same content in a few flat arrays instead:
+* the keys as the 32 bytes digests of their CIDs, concatenated in a bytearray;
+* the directories of the paths interned in a list, each file only holding the index of its directory;
+* the names of the files concatenated in a single string, with the offset of each name in an array.
+Keys and paths are only rebuilt as strings when they are read, and the files of a key are exposed by a FileSet view.
+
+load_manifest parses the MANIFEST.yaml files written by ml-git line by line, and only falls back to yaml_load when the
+file holds something else (double-quoted or complex keys, keys which are not CIDs of ml-git, ...).
+
+When the manifest is only iterated once or twice, ManifestReader does not even keep it in memory: iter_manifest streams
+the (key, files) of the file and count_manifest counts its keys from the lines of keys.'''
+
+_SET_SUFFIX = ': !!set'
+_EMPTY_SET_SUFFIX = ': !!set {}'
+_FILE_INDENT = '  '
+_FILE_SUFFIX = ': null'
+# characters which can't start a plain yaml scalar, the keys starting with them are quoted by the dumper
+_INDICATORS = frozenset('-?:,[]{}#&*!|>\'"%@`')
+# indicators which can start a plain scalar when they are followed by another character than a space
+_PLAIN_INDICATORS = frozenset('-?:')
+
+
+class _UnsupportedManifest(Exception):
+    pass
+
+
+class FileSet(Set):
+    """View of the files of a key of a CompactManifest."""
+
+    __slots__ = ('_manifest', '_index')
+
+    def __init__(self, manifest, index):
+        self._manifest = manifest
+        self._index = index
+
+    def __iter__(self):
+        return self._manifest._iter_files(self._index)
+
+    def __len__(self):
+        offsets = self._manifest._key_offsets
+        return offsets[self._index + 1] - offsets[self._index]
+
+    def __contains__(self, file):
+        return any(f == file for f in self)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, set(self))
+
+
+class CompactManifest(Mapping):
+
+    __slots__ = ('_digests', '_key_offsets', '_dir_ids', '_dirs', '_names', '_name_offsets', '_sorted', '_dir_index',
+                 '_name_parts')
+
+    def __init__(self, items=()):
+        self._digests = bytearray()
+        # files of the i-th key are the files _key_offsets[i] to _key_offsets[i + 1] (excluded)
+        self._key_offsets = array('I', [0])
+        self._dir_ids = array('I')
+        self._dirs = []
+        self._dir_index = {}
+        self._names = ''
+        self._name_parts = []
+        self._name_offsets = array('Q', [0])
+        self._sorted = None
+        for key, files in items:
+            self._append(key, files)
+        self._freeze()
+
+    def _append(self, key, files):
+        """Adds a key and its files. Raises ValueError if key is not a CID of ml-git."""
+        self._digests += cid_to_digest(key)
+        dir_index = self._dir_index
+        name_offset = self._name_offsets[-1]
+        for file in files:
+            directory, _, name = file.rpartition('/')
+            dir_id = dir_index.get(directory)
+            if dir_id is None:
+                dir_id = dir_index[directory] = len(self._dirs)
+                self._dirs.append(directory)
+            self._dir_ids.append(dir_id)
+            self._name_parts.append(name)
+            name_offset += len(name)
+            self._name_offsets.append(name_offset)
+        self._key_offsets.append(len(self._dir_ids))
+
+    def _freeze(self):
+        self._names = ''.join(self._name_parts)
+        self._name_parts = None
+        self._dir_index = None
+
+    def _key(self, index):
+        start = index * DIGEST_SIZE
+        return digest_to_cid(bytes(self._digests[start:start + DIGEST_SIZE]))
+
+    def _file(self, position):
+        directory = self._dirs[self._dir_ids[position]]
+        name = self._names[self._name_offsets[position]:self._name_offsets[position + 1]]
+        return directory + '/' + name if directory else name
+
+    def _iter_files(self, index):
+        for position in range(self._key_offsets[index], self._key_offsets[index + 1]):
+            yield self._file(position)
+
+    def _digest(self, index):
+        start = index * DIGEST_SIZE
+        return self._digests[start:start + DIGEST_SIZE]
+
+    def _find(self, key):
+        """Returns the position of key, or None if it is not in the manifest."""
+        try:
+            digest = cid_to_digest(key)
+        except (ValueError, TypeError):
+            return None
+        if self._sorted is None:
+            # built on the first lookup only, iterating a manifest does not need it
+            self._sorted = array('I', sorted(range(len(self)), key=self._digest))
+        lo, hi = 0, len(self._sorted)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._digest(self._sorted[mid]) < digest:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._sorted) and self._digest(self._sorted[lo]) == digest:
+            return self._sorted[lo]
+        return None
+
+    def __len__(self):
+        return len(self._digests) // DIGEST_SIZE
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._key(index)
+
+    def __getitem__(self, key):
+        index = self._find(key)
+        if index is None:
+            raise KeyError(key)
+        return FileSet(self, index)
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def items(self):
+        for index in range(len(self)):
+            yield self._key(index), FileSet(self, index)
+
+    def values(self):
+        for index in range(len(self)):
+            yield FileSet(self, index)
+
+
+def _is_plain_indicator(path):
+    return path[0] in _PLAIN_INDICATORS and len(path) > 1 and not path[1].isspace()
+
+
+def _parse_scalar(text):
+    """Returns the string written in text by the yaml dumper as a plain or single-quoted scalar."""
+    if not text or text[0].isspace() or (text[0] in _INDICATORS and not _is_plain_indicator(text)):
+        if len(text) > 1 and text[0] == text[-1] == '\'' and '\'' not in text[1:-1].replace('\'\'', ''):
+            return text[1:-1].replace('\'\'', '\'')
+        raise _UnsupportedManifest()
+    return text
+
+
+def _parse_file(line):
+    """Returns the path of a '  path: null' line."""
+    if not line.endswith(_FILE_SUFFIX):
+        raise _UnsupportedManifest()
+    return _parse_scalar(line[len(_FILE_INDENT):-len(_FILE_SUFFIX)])
+
+
+def _read_entries(manifest_file):
+    """Yields the (key, files) of the manifest written in manifest_file."""
+    key, files = None, []
+    for line in manifest_file:
+        line = line.rstrip('\n')
+        if line.startswith(_FILE_INDENT):
+            if key is None:
+                raise _UnsupportedManifest()
+            files.append(_parse_file(line))
+            continue
+        if key is not None:
+            yield key, files
+            key, files = None, []
+        if line.endswith(_EMPTY_SET_SUFFIX):
+            yield _parse_scalar(line[:-len(_EMPTY_SET_SUFFIX)]), []
+        elif line.endswith(_SET_SUFFIX):
+            key = _parse_scalar(line[:-len(_SET_SUFFIX)])
+        elif line:
+            raise _UnsupportedManifest()
+    if key is not None:
+        yield key, files
+
+
+def load_manifest(manifest_path):
+    """Loads the MANIFEST.yaml manifest_path in a CompactManifest. The plain dict given by yaml_load is returned if
+    the manifest can't be represented in a CompactManifest."""
+    try:
+        with open(manifest_path) as manifest_file:
+            return CompactManifest(_read_entries(manifest_file))
+    except (_UnsupportedManifest, ValueError):
+        pass
+    except OSError:
+        return {}
+    manifest = yaml_load(manifest_path)
+    try:
+        return CompactManifest(manifest.items())
+    except (ValueError, TypeError, AttributeError):
+        return manifest
+
+
+def iter_manifest(manifest_path):
+    """Yields the (key, files) of the MANIFEST.yaml manifest_path, in the order of the file, without loading it."""
+    read = 0
+    try:
+        with open(manifest_path) as manifest_file:
+            for entry in _read_entries(manifest_file):
+                yield entry
+                read += 1
+        return
+    except (_UnsupportedManifest, ValueError):
+        pass
+    except OSError:
+        return
+    # the entries already yielded come first in the file
+    manifest = yaml_load(manifest_path) or {}
+    yield from itertools.islice(manifest.items(), read, None)
+
+
+def count_manifest(manifest_path):
+    """Returns the number of keys of the MANIFEST.yaml manifest_path, counting its lines of keys."""
+    count = 0
+    try:
+        with open(manifest_path, 'rb') as manifest_file:
+            for line in manifest_file:
+                if line.startswith(b' ') or line == b'\n':
+                    continue
+                if not line.rstrip(b'\n').endswith((_SET_SUFFIX.encode(), _EMPTY_SET_SUFFIX.encode())):
+                    return len(yaml_load(manifest_path) or {})
+                count += 1
+    except OSError:
+        return 0
+    return count
+
+
+class ManifestReader(object):
+    """Gives the keys and files of a MANIFEST.yaml as a dict would, reading the file each time they are iterated.
+    Only the number of keys is kept in memory."""
+
+    def __init__(self, manifest_path):
+        self._manifest_path = manifest_path
+        self._len = None
+
+    def __len__(self):
+        if self._len is None:
+            self._len = count_manifest(self._manifest_path)
+        return self._len
+
+    def __iter__(self):
+        for key, _ in iter_manifest(self._manifest_path):
+            yield key
+
+    def keys(self):
+        return KeysView(self)
+
+    def items(self):
+        return iter_manifest(self._manifest_path)
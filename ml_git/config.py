@@ -11,7 +11,9 @@ from halo import Halo
 
 from ml_git import spec
 from ml_git.constants import FAKE_STORAGE, BATCH_SIZE_VALUE, BATCH_SIZE, StorageType, GLOBAL_ML_GIT_CONFIG, \
-    PUSH_THREADS_COUNT, SPEC_EXTENSION, EntityType, STORAGE_CONFIG_KEY, STORAGE_SPEC_KEY, DATASET_SPEC_KEY
+    PUSH_THREADS_COUNT, SPEC_EXTENSION, EntityType, STORAGE_CONFIG_KEY, STORAGE_SPEC_KEY, DATASET_SPEC_KEY, \
+    DESCRIPTOR_FORMAT, DescriptorFormat, CHUNK_VERIFICATION, ChunkVerification, OBJECTS_INDEX, \
+    PACK_THRESHOLD, INDEX_FORMAT, IndexFormat, SCAN_CACHE, HASHING_MODE, HashingMode
 from ml_git.ml_git_message import output_messages
 from ml_git.spec import get_spec_key
 from ml_git.utils import getOrElse, yaml_load, yaml_save, get_root_path, yaml_load_str, RootPathException
@@ -51,7 +53,15 @@ mlgit_config = {
     'cache_path': '',
     'metadata_path': '',
 
-    PUSH_THREADS_COUNT: push_threads
+    PUSH_THREADS_COUNT: push_threads,
+
+    DESCRIPTOR_FORMAT: DescriptorFormat.JSON.value,
+    CHUNK_VERIFICATION: ChunkVerification.ALWAYS.value,
+    OBJECTS_INDEX: False,
+    PACK_THRESHOLD: 0,
+    INDEX_FORMAT: IndexFormat.YAML.value,
+    SCAN_CACHE: False,
+    HASHING_MODE: HashingMode.AUTO.value
 
 }
 
@@ -449,6 +459,55 @@ def get_push_threads_count(config):
     return push_threads_count
 
 
+def get_descriptor_format(config):
+    descriptor_format = config.get(DESCRIPTOR_FORMAT, DescriptorFormat.JSON.value)
+    if descriptor_format not in DescriptorFormat.to_list():
+        raise RuntimeError(output_messages['ERROR_INVALID_OPTION_IN_CONFIG'] % (DESCRIPTOR_FORMAT, DescriptorFormat.to_list()))
+    return descriptor_format
+
+
+def get_chunk_verification(config):
+    chunk_verification = config.get(CHUNK_VERIFICATION, ChunkVerification.ALWAYS.value)
+    if chunk_verification not in ChunkVerification.to_list():
+        raise RuntimeError(output_messages['ERROR_INVALID_OPTION_IN_CONFIG'] % (CHUNK_VERIFICATION, ChunkVerification.to_list()))
+    return chunk_verification
+
+
+def get_hashing_mode(config):
+    hashing_mode = config.get(HASHING_MODE, HashingMode.AUTO.value)
+    if hashing_mode not in HashingMode.to_list():
+        raise RuntimeError(output_messages['ERROR_INVALID_OPTION_IN_CONFIG'] % (HASHING_MODE, HashingMode.to_list()))
+    return hashing_mode
+
+
+def get_objects_index(config):
+    objects_index = config.get(OBJECTS_INDEX, False)
+    if not isinstance(objects_index, bool):
+        raise RuntimeError(output_messages['ERROR_INVALID_OPTION_IN_CONFIG'] % (OBJECTS_INDEX, [True, False]))
+    return objects_index
+
+
+def get_scan_cache(config):
+    scan_cache = config.get(SCAN_CACHE, False)
+    if not isinstance(scan_cache, bool):
+        raise RuntimeError(output_messages['ERROR_INVALID_OPTION_IN_CONFIG'] % (SCAN_CACHE, [True, False]))
+    return scan_cache
+
+
+def get_index_format(config):
+    index_format = config.get(INDEX_FORMAT, IndexFormat.YAML.value)
+    if index_format not in IndexFormat.to_list():
+        raise RuntimeError(output_messages['ERROR_INVALID_OPTION_IN_CONFIG'] % (INDEX_FORMAT, IndexFormat.to_list()))
+    return index_format
+
+
+def get_pack_threshold(config):
+    pack_threshold = config.get(PACK_THRESHOLD, 0)
+    if isinstance(pack_threshold, bool) or not isinstance(pack_threshold, int) or pack_threshold < 0:
+        raise RuntimeError(output_messages['ERROR_INVALID_OPTION_IN_CONFIG'] % (PACK_THRESHOLD, 'a number of bytes >= 0'))
+    return pack_threshold
+
+
 def merged_config_load():
     try:
         get_root_path()
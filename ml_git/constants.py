@@ -38,6 +38,25 @@ FAKE_TYPE = 's3h'
 BATCH_SIZE = 'batch_size'
 PUSH_THREADS_COUNT = 'push_threads_count'
 BATCH_SIZE_VALUE = 20
+DESCRIPTOR_FORMAT = 'descriptor_format'
+CHUNK_VERIFICATION = 'chunk_verification'
+VERIFIED_CHUNKS_FILE = 'verified_chunks'
+OBJECTS_INDEX = 'objects_index'
+OBJECTS_INDEX_FILE = 'objects_index.db'
+SCAN_CACHE = 'scan_cache'
+SCAN_CACHE_FILE = 'SCAN_CACHE.json'
+ADDED_LINKS_FILE = 'ADDED_LINKS.json'
+HASHING_MODE = 'hashing_mode'
+PACK_THRESHOLD = 'pack_threshold'
+INDEX_FORMAT = 'index_format'
+PACKS_DIR = 'packs'
+MAX_PACK_SIZE = 256 * 1024 * 1024
+PARALLEL_HASHING_THRESHOLD = 64 * 1024 * 1024
+# content-defined chunking runs in Python (a few MB/s), bigger files are sliced at fixed offsets
+FASTCDC_MAX_FILE_SIZE = 128 * 1024 * 1024
+# a file (or directory) modified less than this before its stat was cached could change again without changing its stat
+RACY_CLEAN_WINDOW_NS = 2 * 10 ** 9
+PARALLEL_HASHING_TASK_SIZE = 16 * 1024 * 1024
 RGX_ADDED_FILES = r'[+]\s+(.*)[:]\s+null'
 RGX_DELETED_FILES = r'[-]\s+(.*)[:]\s+null'
 RGX_SIZE_FILES = r'[+]\s+size:\s+(\d+(?:[.]\d+)*\s+.+)'
@@ -74,6 +93,7 @@ MODEL_SPEC_KEY = 'model'
 STORAGE_SPEC_KEY = 'storage'
 STORAGE_CONFIG_KEY = 'storages'
 MLGIT_IGNORE_FILE_NAME = '.mlgitignore'
+CHUNKER_SPEC_KEY = 'chunker'
 GIT_CLIENT_CLASS_NAME = 'GitClient'
 RELATIONSHIP_GRAPH_FILENAME = 'entities_relationships'
 
@@ -88,6 +108,58 @@ class MutabilityType(Enum):
         return [mutability.value for mutability in MutabilityType]
 
 
+@unique
+class DescriptorFormat(Enum):
+    JSON = 'json'
+    BINARY = 'binary'
+
+    @staticmethod
+    def to_list():
+        return [descriptor_format.value for descriptor_format in DescriptorFormat]
+
+
+@unique
+class IndexFormat(Enum):
+    YAML = 'yaml'
+    SQLITE = 'sqlite'
+
+    @staticmethod
+    def to_list():
+        return [index_format.value for index_format in IndexFormat]
+
+
+@unique
+class ChunkVerification(Enum):
+    ALWAYS = 'always'
+    FIRST_TOUCH = 'first_touch'
+    NEVER = 'never'
+
+    @staticmethod
+    def to_list():
+        return [verification.value for verification in ChunkVerification]
+
+
+@unique
+class HashingMode(Enum):
+    AUTO = 'auto'
+    THREADS = 'threads'
+    PROCESSES = 'processes'
+
+    @staticmethod
+    def to_list():
+        return [mode.value for mode in HashingMode]
+
+
+@unique
+class ChunkerType(Enum):
+    FIXED = 'fixed'
+    FASTCDC = 'fastcdc'
+
+    @staticmethod
+    def to_list():
+        return [chunker.value for chunker in ChunkerType]
+
+
 @unique
 class StorageType(Enum):
     S3 = 's3'
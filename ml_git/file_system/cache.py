@@ -19,16 +19,15 @@ class Cache(HashFS):
         self.__manifest = manifest
 
     def update(self):
-        objfiles = yaml_load(self.__manifest)
-        for key in objfiles:
-            files = objfiles[key]
-
-            for file in files:
-                srcfile = os.path.join(self.__datapath, file)
-                try:
-                    self.link(key, srcfile)
-                except FileNotFoundError:
-                    pass
+        """Links the files of the manifest into the cache. The manifest is either the path of a MANIFEST.yaml or an
+        already loaded Manifest (or dict) of the keys to their files. Returns the files linked (relative to the data
+        path), whose stat changed."""
+        objfiles = self.__manifest
+        if isinstance(objfiles, str):
+            objfiles = yaml_load(objfiles)
+        linked = self.link_files((key, os.path.join(self.__datapath, file))
+                                 for key, files in objfiles.items() for file in files)
+        return [os.path.relpath(srcfile, self.__datapath) for srcfile in linked]
 
     def garbage_collector(self, blobs_hashes):
         count_removed_cache, reclaimed_cache_space = remove_unnecessary_files(blobs_hashes, self._path)
@@ -0,0 +1,127 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import errno
+import os
+import struct
+import sys
+
+from ml_git import log
+from ml_git.constants import HASH_FS_CLASS_NAME
+from ml_git.ml_git_message import output_messages
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+'''Concatenation of chunk files without going through user space buffers.
+
+Chunks are appended to the destination with the cheapest mechanism available, in order:
+* FICLONERANGE ioctl: the destination shares the extents of the chunk (reflink on btrfs, XFS, ...).
+* os.copy_file_range: in kernel copy (which some filesystems also turn into a reflink).
+* os.sendfile: in kernel copy.
+* read/write loop through a buffer.
+A mechanism which is not supported by the platform or the filesystems is disabled and the next one is used for the
+remaining bytes.'''
+
+FICLONERANGE = 0x4020940d
+_FILE_CLONE_RANGE = struct.Struct('qQQQ')
+_UNSUPPORTED_ERRORS = (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF,
+                       errno.ETXTBSY, errno.EPERM)
+
+
+class ChunkCopier(object):
+
+    def __init__(self, blocksize):
+        self._blk_size = blocksize
+        is_linux = sys.platform.startswith('linux')
+        self._use_reflink = is_linux and fcntl is not None
+        self._use_copy_file_range = hasattr(os, 'copy_file_range')
+        self._use_sendfile = is_linux and hasattr(os, 'sendfile')
+
+    def append(self, src_path, dst_file, offset=0, length=None):
+        """Appends length bytes of src_path read from offset (up to the end of the file if length is None) at the
+        current position of dst_file. Returns the number of bytes copied."""
+        dst_file.flush()
+        dst_fd = dst_file.fileno()
+        with open(src_path, 'rb') as src_file:
+            src_fd = src_file.fileno()
+            size = os.fstat(src_fd).st_size - offset if length is None else length
+            copied = 0
+            if self._use_reflink:
+                copied = self._reflink(src_fd, dst_fd, offset, size)
+            if copied < size and self._use_copy_file_range:
+                copied = self._copy_file_range(src_fd, dst_fd, offset, copied, size)
+            if copied < size and self._use_sendfile:
+                copied = self._sendfile(src_fd, dst_fd, offset, copied, size)
+            if copied < size:
+                copied = self._buffered_copy(src_file, dst_fd, offset, copied, size)
+        return copied
+
+    def reflink(self, src_path, dst_file, offset=0, length=None):
+        """Appends length bytes of src_path read from offset at the current position of dst_file as append does, but
+        only with a reflink. Returns whether they were reflinked, nothing is copied otherwise."""
+        if not self._use_reflink:
+            return False
+        dst_file.flush()
+        with open(src_path, 'rb') as src_file:
+            src_fd = src_file.fileno()
+            size = os.fstat(src_fd).st_size - offset if length is None else length
+            return self._reflink(src_fd, dst_file.fileno(), offset, size) == size
+
+    def _reflink(self, src_fd, dst_fd, offset, size):
+        dst_offset = os.lseek(dst_fd, 0, os.SEEK_CUR)
+        try:
+            fcntl.ioctl(dst_fd, FICLONERANGE, _FILE_CLONE_RANGE.pack(src_fd, offset, size, dst_offset))
+        except OSError as e:
+            # offsets not aligned on the filesystem block size are refused, keep reflinks for the next chunks
+            if e.errno != errno.EINVAL:
+                self._use_reflink = False
+                log.debug(output_messages['DEBUG_CHUNK_COPY_UNSUPPORTED'] % ('FICLONERANGE', e), class_name=HASH_FS_CLASS_NAME)
+            return 0
+        os.lseek(dst_fd, dst_offset + size, os.SEEK_SET)
+        return size
+
+    def _copy_file_range(self, src_fd, dst_fd, offset, copied, size):
+        try:
+            while copied < size:
+                sent = os.copy_file_range(src_fd, dst_fd, size - copied, offset + copied)
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRORS:
+                raise e
+            self._use_copy_file_range = False
+            log.debug(output_messages['DEBUG_CHUNK_COPY_UNSUPPORTED'] % ('copy_file_range', e), class_name=HASH_FS_CLASS_NAME)
+        return copied
+
+    def _sendfile(self, src_fd, dst_fd, offset, copied, size):
+        try:
+            while copied < size:
+                sent = os.sendfile(dst_fd, src_fd, offset + copied, size - copied)
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRORS:
+                raise e
+            self._use_sendfile = False
+            log.debug(output_messages['DEBUG_CHUNK_COPY_UNSUPPORTED'] % ('sendfile', e), class_name=HASH_FS_CLASS_NAME)
+        return copied
+
+    def _buffered_copy(self, src_file, dst_fd, offset, copied, size):
+        src_file.seek(offset + copied)
+        while copied < size:
+            data = src_file.read(min(self._blk_size, size - copied))
+            if not data:
+                break
+            view = memoryview(data)
+            while view:
+                written = os.write(dst_fd, view)
+                view = view[written:]
+            copied += len(data)
+        return copied
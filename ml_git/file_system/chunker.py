@@ -0,0 +1,110 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import hashlib
+
+from ml_git.constants import ChunkerType
+from ml_git.ml_git_message import output_messages
+
+'''Strategies used by MultihashFS to split a file in chunks.
+
+The fixed chunker cuts the file every blocksize bytes. It is the default one and the one used by every descriptor
+created before chunkers could be chosen.
+
+The fastcdc chunker cuts the file where a rolling (gear) hash of the last bytes read matches a mask (FastCDC,
+normalized chunking). As boundaries depend on the content and not on offsets, inserting or removing bytes in a file
+only changes the chunks around the edit, and the other chunks are deduplicated. Chunks are never bigger than the
+blocksize so they can still be read and verified in a single block by MultihashFS.
+
+The gear hash is computed byte by byte in Python, at a few MB/s, so MultihashFS only uses the fastcdc chunker for
+files up to FASTCDC_MAX_FILE_SIZE.'''
+
+_MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+# The gear table must never change: chunk boundaries, hence the CIDs, depend on it.
+_GEAR = tuple(int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'little') for i in range(256))
+
+
+class FixedSizeChunker(object):
+
+    def __init__(self, blocksize):
+        self._blk_size = blocksize
+
+    @property
+    def name(self):
+        return ChunkerType.FIXED.value
+
+    def chunks(self, file):
+        while True:
+            data = file.read(self._blk_size)
+            if not data:
+                break
+            yield data
+
+
+class FastCDCChunker(object):
+
+    def __init__(self, blocksize):
+        self._max_size = blocksize
+        self._avg_size = blocksize // 2
+        self._min_size = blocksize // 8
+        bits = self._avg_size.bit_length() - 1
+        # gear hash high bits depend on more input bytes than the low ones, so masks select the high bits
+        self._mask_s = self._high_bits_mask(bits + 2)
+        self._mask_l = self._high_bits_mask(bits - 2)
+        self._read_size = blocksize * 4
+
+    @property
+    def name(self):
+        return ChunkerType.FASTCDC.value
+
+    @staticmethod
+    def _high_bits_mask(bits):
+        return ((1 << bits) - 1) << (64 - bits)
+
+    def _find_cut(self, data, start, end):
+        if end - start <= self._min_size:
+            return end
+        normal_size = min(start + self._avg_size, end)
+        limit = min(start + self._max_size, end)
+        gear = _GEAR
+        mask_64 = _MASK_64
+        h = 0
+        # the bytes are iterated from slices and the locals bound once, this loop runs for every byte of the file
+        mask = self._mask_s
+        for i, byte in enumerate(data[start + self._min_size:normal_size], start + self._min_size + 1):
+            h = (h + h + gear[byte]) & mask_64
+            if not h & mask:
+                return i
+        mask = self._mask_l
+        for i, byte in enumerate(data[normal_size:limit], normal_size + 1):
+            h = (h + h + gear[byte]) & mask_64
+            if not h & mask:
+                return i
+        return limit
+
+    def chunks(self, file):
+        data = b''
+        pos = 0
+        eof = False
+        while True:
+            if not eof and len(data) - pos < self._max_size:
+                block = file.read(self._read_size)
+                eof = len(block) < self._read_size
+                data = data[pos:] + block
+                pos = 0
+            if pos >= len(data):
+                break
+            cut = self._find_cut(data, pos, len(data))
+            yield data[pos:cut]
+            pos = cut
+
+
+def get_chunker(chunker_type, blocksize):
+    if chunker_type is None or chunker_type == ChunkerType.FIXED.value:
+        return FixedSizeChunker(blocksize)
+    if chunker_type == ChunkerType.FASTCDC.value:
+        return FastCDCChunker(blocksize)
+    raise RuntimeError(output_messages['ERROR_INVALID_CHUNKER_TYPE'] % (chunker_type, ChunkerType.to_list()))
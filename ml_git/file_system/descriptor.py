@@ -0,0 +1,59 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import mmap
+import os
+import struct
+import threading
+
+from ml_git.cid_codec import cid_to_digest, digest_to_cid
+from ml_git.ml_git_message import output_messages
+
+'''Compact encoding of MultihashFS descriptors.
+
+A descriptor lists the chunks of a file. The canonical form stays the JSON {'Links': [...]} document, which is the
+one hashed to build the object CID and pushed to storages. The compact form is a local, fixed-width copy of the
+same links that can be read through mmap without parsing JSON:
+
+    header: magic (4 bytes) | version (1 byte) | padding (3 bytes) | number of links (8 bytes)
+    link:   sha2-256 digest of the chunk (32 bytes) | size of the chunk (8 bytes)
+'''
+
+COMPACT_MAGIC = b'MLGD'
+COMPACT_VERSION = 1
+HEADER = struct.Struct('<4sB3xQ')
+LINK = struct.Struct('<32sQ')
+
+
+class CompactDescriptorError(Exception):
+
+    def __init__(self, msg):
+        super().__init__(msg)
+
+
+def encode_links(links):
+    data = bytearray(HEADER.pack(COMPACT_MAGIC, COMPACT_VERSION, len(links)))
+    for chunk_hash, size in links:
+        data += LINK.pack(cid_to_digest(chunk_hash), size)
+    return bytes(data)
+
+
+def save_compact(links, path):
+    tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'wb') as f:
+        f.write(encode_links(links))
+    os.replace(tmp_path, path)
+
+
+def load_compact(path):
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER.size:
+            raise CompactDescriptorError(output_messages['ERROR_INVALID_COMPACT_DESCRIPTOR'] % path)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, version, count = HEADER.unpack_from(mm)
+            if magic != COMPACT_MAGIC or version != COMPACT_VERSION or size != HEADER.size + count * LINK.size:
+                raise CompactDescriptorError(output_messages['ERROR_INVALID_COMPACT_DESCRIPTOR'] % path)
+            return [(digest_to_cid(digest), chunk_size) for digest, chunk_size in LINK.iter_unpack(mm[HEADER.size:])]
@@ -6,20 +6,53 @@ SPDX-License-Identifier: GPL-2.0-only
 import hashlib
 import json
 import os
+import tempfile
+import threading
+from concurrent import futures
+from contextlib import contextmanager
 
-import multihash
-from cid import CIDv1
 from tqdm import tqdm
 
 from ml_git import log
-from ml_git.constants import HASH_FS_CLASS_NAME, LOCAL_REPOSITORY_CLASS_NAME, STORAGE_LOG
+from ml_git.cid_codec import cid_matches, data_to_cid, digest_to_cid
+from ml_git.constants import HASH_FS_CLASS_NAME, LOCAL_REPOSITORY_CLASS_NAME, STORAGE_LOG, DescriptorFormat, \
+    ChunkerType, PARALLEL_HASHING_THRESHOLD, PARALLEL_HASHING_TASK_SIZE, ChunkVerification, VERIFIED_CHUNKS_FILE, \
+    OBJECTS_INDEX_FILE, PACKS_DIR, HashingMode, FASTCDC_MAX_FILE_SIZE
+from ml_git.file_system.chunk_io import ChunkCopier
+from ml_git.file_system.chunker import get_chunker
+from ml_git.file_system.descriptor import CompactDescriptorError, load_compact, save_compact
+from ml_git.file_system.objects_index import ObjectsIndex
+from ml_git.file_system.packfile import PackStore
 from ml_git.ml_git_message import output_messages
-from ml_git.utils import json_load, ensure_path_exists, get_root_path, set_write_read
+from ml_git.pool import pool_factory, use_process_pool
+from ml_git.utils import json_load, ensure_path_exists, get_root_path, set_write_read, run_function_per_group
 
 '''implementation of a "hashdir" based filesystem
 Lack a few desirable properties of MultihashFS.
 Although good enough for ml-git cache implementation.'''
 
+FSCK_BATCH_SIZE = 1000
+# threads linking the files of an add into the cache
+LINK_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+# threads hashing the ranges of the big files, shared by all the files hashed at the same time (see _range_executor)
+PARALLEL_HASHING_WORKERS = os.cpu_count() or 1
+
+_range_executor = None
+_range_executor_pid = None
+_range_executor_lock = threading.Lock()
+
+
+def _get_range_executor():
+    """Returns the pool of threads hashing the ranges of big files in this process. A single pool bounds the threads
+    doing pread to PARALLEL_HASHING_WORKERS while the workers of an add hash several big files at once. It is created
+    again in a forked process, which does not inherit the threads of its parent."""
+    global _range_executor, _range_executor_pid
+    with _range_executor_lock:
+        if _range_executor is None or _range_executor_pid != os.getpid():
+            _range_executor = futures.ThreadPoolExecutor(max_workers=PARALLEL_HASHING_WORKERS)
+            _range_executor_pid = os.getpid()
+        return _range_executor
+
 
 class HashFS(object):
 
@@ -66,18 +99,53 @@ class HashFS(object):
         dstkey = self._get_hashpath(key)
         ensure_path_exists(os.path.dirname(dstkey))
         log.debug(output_messages['DEBUG_LINK_FROM_TO'] % (srcfile, key), class_name=HASH_FS_CLASS_NAME)
-        if os.path.exists(dstkey) is True:
-            if force is True:
-                try:
-                    set_write_read(srcfile)
-                    os.unlink(srcfile)
-                    os.link(dstkey, srcfile)
-                except FileNotFoundError as e:
-                    log.debug(str(e), class_name=HASH_FS_CLASS_NAME)
-                    raise e
+        self._link_to(dstkey, srcfile, force)
 
-            return
-        os.link(srcfile, dstkey)
+    def _link_to(self, dstkey, srcfile, force):
+        """Returns whether srcfile was linked, which changes its stat (ctime, or inode once replaced by dstkey)."""
+        try:
+            os.link(srcfile, dstkey)
+            return True
+        except FileExistsError:
+            if force is not True:
+                return False
+        try:
+            if os.path.samestat(os.stat(srcfile), os.stat(dstkey)):
+                # already linked by a previous add
+                return False
+            set_write_read(srcfile)
+            os.unlink(srcfile)
+            os.link(dstkey, srcfile)
+        except FileNotFoundError as e:
+            log.debug(str(e), class_name=HASH_FS_CLASS_NAME)
+            raise e
+        return True
+
+    def link_files(self, links, force=True, nworkers=LINK_WORKERS):
+        """Links each (key, srcfile) of links as link does, skipping the srcfiles which no longer exist. Returns the
+        srcfiles linked, whose stat changed.
+
+        The directories of the keys are created once, before linking, and the links of each directory are made by a
+        thread of a pool, so that the latency of the links overlaps on network filesystems."""
+        groups = {}
+        for key, srcfile in links:
+            dstkey = self._get_hashpath(key)
+            groups.setdefault(os.path.dirname(dstkey), []).append((dstkey, srcfile))
+        for directory in groups:
+            ensure_path_exists(directory)
+        with futures.ThreadPoolExecutor(max_workers=nworkers) as executor:
+            linked = executor.map(lambda group: self._link_group(group, force), groups.values())
+            return [srcfile for group_linked in linked for srcfile in group_linked]
+
+    def _link_group(self, group, force):
+        linked = []
+        for dstkey, srcfile in group:
+            try:
+                if self._link_to(dstkey, srcfile, force):
+                    linked.append(srcfile)
+            except FileNotFoundError:
+                pass
+        return linked
 
     def _get_hashpath(self, filename):
         hfilename = self._hash_filename(filename)
@@ -122,8 +190,7 @@ class HashFS(object):
     def _log(self, objkey, links=[], log_file=None):
         log.debug(output_messages['DEBUG_UPDATE_LOG_KEY'] % objkey, class_name=HASH_FS_CLASS_NAME)
         log_file.write("%s\n" % (objkey))
-        for link in links:
-            h = link['Hash']
+        for h, _ in links:
             log_file.write("%s\n" % (h))
 
     def get_log(self):
@@ -190,14 +257,82 @@ This filesystem guarantees by design:
 '''
 
 
+class VerifiedChunks(object):
+    '''Set of the keys whose integrity was already verified in a MultihashFS.
+    It is persisted as an append-only file with one key per line, loaded on first use.'''
+
+    def __init__(self, path):
+        self._path = path
+        self._keys = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._keys is None:
+            self._keys = set()
+            if os.path.exists(self._path):
+                with open(self._path, 'r') as f:
+                    self._keys.update(line.strip() for line in f if line.strip())
+        return self._keys
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._load()
+
+    def add(self, key):
+        with self._lock:
+            keys = self._load()
+            if key in keys:
+                return
+            keys.add(key)
+            with open(self._path, 'a') as f:
+                f.write('%s\n' % key)
+
+    def discard(self, keys):
+        with self._lock:
+            if not os.path.exists(self._path):
+                return
+            self._save(self._load() - set(keys))
+
+    def reset(self, keys):
+        with self._lock:
+            self._save(set(keys))
+
+    def _save(self, keys):
+        tmp_path = '%s.%d.tmp' % (self._path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            for key in keys:
+                f.write('%s\n' % key)
+        os.replace(tmp_path, self._path)
+        self._keys = keys
+
+
 class MultihashFS(HashFS):
-    def __init__(self, path, blocksize=256 * 1024, levels=2):
+    def __init__(self, path, blocksize=256 * 1024, levels=2, descriptor_format=DescriptorFormat.JSON.value,
+                 chunker=ChunkerType.FIXED.value, parallel_threshold=PARALLEL_HASHING_THRESHOLD,
+                 chunk_verification=ChunkVerification.ALWAYS.value, objects_index=False, pack_threshold=0):
         super(MultihashFS, self).__init__(path, blocksize, levels)
+        self._init_args = (path, blocksize, levels, descriptor_format, chunker, parallel_threshold, chunk_verification,
+                           objects_index, pack_threshold)
         self._levels = levels
         if levels < 1:
             self._levels = 1
         if levels > 22:
             self.levels = 22
+        self._descriptor_format = descriptor_format
+        self._descriptors_path = os.path.join(path, 'descriptors')
+        self._chunker = get_chunker(chunker, self._blk_size)
+        self._parallel_threshold = parallel_threshold
+        self._chunk_verification = chunk_verification
+        self._verified_chunks = VerifiedChunks(os.path.join(path, VERIFIED_CHUNKS_FILE))
+        self._chunk_copier = ChunkCopier(self._blk_size)
+        self._objects_index_path = os.path.join(path, OBJECTS_INDEX_FILE)
+        self._objects_index = ObjectsIndex(self._objects_index_path) if objects_index else None
+        self._pack_threshold = pack_threshold
+        self._packs = PackStore(os.path.join(path, PACKS_DIR), self._objects_index_path)
+
+    def __reduce__(self):
+        # sent to the processes of a process pool by its arguments
+        return _shared_hashfs, (self._init_args,)
 
     def _get_hashpath(self, filename, path=None):
         hpath = self._path
@@ -208,64 +343,170 @@ class MultihashFS(HashFS):
         return os.path.join(hpath, h, filename)
 
     def _store_chunk(self, filename, data):
-        fullpath = self._get_hashpath(filename)
-        ensure_path_exists(os.path.dirname(fullpath))
-
-        if os.path.isfile(fullpath) is True:
+        # the objects index may list a key whose file was removed, only the disk tells that a write can be skipped
+        if self._is_stored(filename):
+            self._index_key(filename)
             log.debug(output_messages['DEBUG_CHUNK_ALREADY_EXISTS'] % (filename, len(data)), class_name=HASH_FS_CLASS_NAME)
             return False
 
+        if data is not None and 0 < len(data) <= self._pack_threshold:
+            pack = self._packs.put(filename, data)
+            if pack is None:
+                return False
+            log.debug(output_messages['DEBUG_ADDING_PACKED_CHUNK'] % (filename, len(data), pack), class_name=HASH_FS_CLASS_NAME)
+            self._index_key(filename)
+            return True
+
+        fullpath = self._get_hashpath(filename)
+        ensure_path_exists(os.path.dirname(fullpath))
         if data is not None:
             log.debug(output_messages['DEBUG_ADDING_CHUNK'] % (filename, len(data)), class_name=HASH_FS_CLASS_NAME)
             with open(fullpath, 'wb') as f:
                 f.write(data)
+            self._index_key(filename)
             return True
 
     def _check_integrity(self, cid, data):
-        cid0 = self._digest(data)
-        if cid == cid0:
+        digest = hashlib.sha256(data).digest()
+        if cid_matches(cid, digest):
             log.debug(output_messages['DEBUG_CHECKSUM_VERIFIED'] % cid, class_name=HASH_FS_CLASS_NAME)
             return True
-        log.error(output_messages['ERROR_CORRPUTION_DETECTED'] % (cid, cid0), class_name=HASH_FS_CLASS_NAME)
+        log.error(output_messages['ERROR_CORRPUTION_DETECTED'] % (cid, digest_to_cid(digest)), class_name=HASH_FS_CLASS_NAME)
         return False
 
     def _digest(self, data):
-        m = hashlib.sha256()
-        m.update(data)
-        h = m.hexdigest()
-        mh = multihash.encode(bytes.fromhex(h), 'sha2-256')
-        cid = CIDv1('dag-pb', mh)
-        return str(cid)
+        return data_to_cid(data)
 
     def put(self, srcfile):
-        links = []
-        with open(srcfile, 'rb') as f:
-            while True:
-                d = f.read(self._blk_size)
-                if not d:
-                    break
-                scid = self._digest(d)
-                self._store_chunk(scid, d)
-                links.append({'Hash': scid, 'Size': len(d)})
+        scid, _ = self.put_if_changed(srcfile)
+        return scid
 
-        ls = json.dumps({'Links': links})
-        scid = self._digest(ls.encode())
-        self._store_chunk(scid, ls.encode())
+    def put_if_changed(self, srcfile, previous_key=None):
+        """Hashes and stores srcfile reading it only once.
+
+        Chunks already present in the hashfs are not written again (see _store_chunk), so a file which did not
+        change costs a single read pass. The descriptor is only stored if its CID differs from previous_key.
+
+        Like get_scid, the file is first chunked with the chunker recorded in previous_key, so that add and status
+        agree on whether it changed. Once changed, it is chunked with the chunker of the spec, which costs a second
+        read pass when the spec chunker changed since previous_key was added.
+
+        Returns the CID of the file descriptor and its list of chunk links."""
+        chunker = self._get_file_chunker(srcfile, previous_key)
+        spec_chunker = self._get_file_chunker(srcfile)
+        if chunker.name != spec_chunker.name:
+            links = self._hash_file(srcfile, chunker, store=False)
+            if self._digest(self._dump_descriptor(links, chunker)) == previous_key:
+                return previous_key, links
+            chunker = spec_chunker
+        links = self._hash_file(srcfile, chunker, store=True)
+
+        ls = self._dump_descriptor(links, chunker)
+        scid = self._digest(ls)
+        if scid != previous_key:
+            self._store_chunk(scid, ls)
+            self._save_compact_links(scid, [(link['Hash'], link['Size']) for link in links])
+        return scid, links
+
+    def get_scid(self, srcfile, previous_key=None):
+        """Computes the CID srcfile would have once added, without storing anything.
+
+        If previous_key is given, the file is chunked with the chunker recorded in that descriptor, so the returned
+        CID only differs from previous_key when the content of the file changed."""
+        chunker = self._get_file_chunker(srcfile, previous_key)
+        links = self._hash_file(srcfile, chunker, store=False)
+        scid = self._digest(self._dump_descriptor(links, chunker))
         return scid
 
-    def get_scid(self, srcfile):
+    def _hash_file(self, srcfile, chunker, store):
+        file_size = os.path.getsize(srcfile)
+        if self._can_hash_in_parallel(chunker, file_size):
+            return self._hash_file_in_parallel(srcfile, file_size, store)
         links = []
         with open(srcfile, 'rb') as f:
-            while True:
-                d = f.read(self._blk_size)
-                if not d:
-                    break
+            for d in chunker.chunks(f):
                 scid = self._digest(d)
+                if store:
+                    self._store_chunk(scid, d)
                 links.append({'Hash': scid, 'Size': len(d)})
-
-        ls = json.dumps({'Links': links})
-        scid = self._digest(ls.encode())
-        return scid
+        return links
+
+    def _can_hash_in_parallel(self, chunker, file_size):
+        # with fixed size chunks, boundaries are known before reading the file
+        return file_size >= self._parallel_threshold and chunker.name == ChunkerType.FIXED.value \
+            and hasattr(os, 'pread')
+
+    def _hash_file_in_parallel(self, srcfile, file_size, store):
+        """Splits srcfile in ranges of blocks hashed by the pool of threads of the process (hashlib releases the GIL
+        while hashing).
+
+        Each worker reads its own range with os.pread, so no file offset is shared between threads.
+        The links are then assembled in the order of the ranges."""
+        task_size = max(1, PARALLEL_HASHING_TASK_SIZE // self._blk_size) * self._blk_size
+        executor = _get_range_executor()
+        fd = os.open(srcfile, os.O_RDONLY)
+        ranges = []
+        try:
+            ranges = [executor.submit(self._hash_range, fd, offset, min(task_size, file_size - offset), store)
+                      for offset in range(0, file_size, task_size)]
+            links = []
+            for hashed_range in ranges:
+                links.extend(hashed_range.result())
+        finally:
+            # fd is only closed once no range can read it any more
+            futures.wait(ranges)
+            os.close(fd)
+        return links
+
+    def _hash_range(self, fd, offset, length, store):
+        links = []
+        end = offset + length
+        while offset < end:
+            d = self._pread_block(fd, min(self._blk_size, end - offset), offset)
+            if not d:
+                break
+            scid = self._digest(d)
+            if store:
+                self._store_chunk(scid, d)
+            links.append({'Hash': scid, 'Size': len(d)})
+            offset += len(d)
+        return links
+
+    @staticmethod
+    def _pread_block(fd, size, offset):
+        data = b''
+        while len(data) < size:
+            d = os.pread(fd, size - len(data), offset + len(data))
+            if not d:
+                break
+            data += d
+        return data
+
+    @staticmethod
+    def _dump_descriptor(links, chunker):
+        descriptor = {'Links': links}
+        # the default chunker is not recorded to keep the CIDs of existing descriptors
+        if chunker.name != ChunkerType.FIXED.value:
+            descriptor['Chunker'] = chunker.name
+        return json.dumps(descriptor).encode()
+
+    def _get_file_chunker(self, srcfile, previous_key=None):
+        """Returns the chunker recorded in previous_key if given, the chunker of the spec otherwise. A file bigger than
+        FASTCDC_MAX_FILE_SIZE is always sliced at fixed offsets: content-defined chunking runs in Python and would
+        take minutes. A file chunked with fastcdc was not bigger, so a bigger file changed whichever the chunker."""
+        chunker = self._get_descriptor_chunker(previous_key)
+        if chunker.name != ChunkerType.FIXED.value and os.path.getsize(srcfile) > FASTCDC_MAX_FILE_SIZE:
+            return get_chunker(ChunkerType.FIXED.value, self._blk_size)
+        return chunker
+
+    def _get_descriptor_chunker(self, key):
+        if key is None or not self._exists(key):
+            return self._chunker
+        try:
+            return get_chunker(self.load(key).get('Chunker', ChunkerType.FIXED.value), self._blk_size)
+        except Exception as e:
+            log.debug(str(e), class_name=HASH_FS_CLASS_NAME)
+            return self._chunker
 
     def _copy(self, objectkey, dstfile):
         corruption_found = False
@@ -285,20 +526,45 @@ class MultihashFS(HashFS):
             os.unlink(dstfile)
         return not corruption_found
 
-    def get(self, object_key, dst_file_path):
+    def get(self, object_key, dst_file_path, clone_single_chunk=False):
+        """Rebuilds the file described by object_key in dst_file_path and returns its size (0 if corrupted).
+
+        If clone_single_chunk is True and the file has a single chunk, dst_file_path is a reflink of the chunk where the
+        filesystem supports it (the chunk is then read once to be verified, if it must be), and a copy of the chunk
+        verified while copied otherwise: only reflinks avoid a second copy of the chunk on disk.
+        dst_file_path is never a hard link to the chunk, which would share its mode (the chmods of the workspace files
+        linked to the cache would then change the objects, e.g. remove the group access of a shared objects path) and
+        its content (a write in place, not prevented for root by the read-only mode, would corrupt the object)."""
         size = 0
-        descriptor = json_load(self._get_hashpath(object_key))
-        json_objects = json.dumps(descriptor).encode()
-        is_corrupted = not self._check_integrity(object_key, json_objects)
-        if is_corrupted:
-            return size
+        links = self._load_compact_links(object_key)
+        if links is not None:
+            # the compact copy does not replace the check of the descriptor, whose bytes are hashed without parsing them
+            if self._should_verify(object_key) and not self._verify_descriptor_file(object_key):
+                log.error(output_messages['ERROR_CORRPUTION_DETECTED_FOR'] % object_key, class_name=HASH_FS_CLASS_NAME)
+                return size
+        else:
+            descriptor = self.load(object_key)
+            should_verify = self._should_verify(object_key)
+            if should_verify:
+                json_objects = json.dumps(descriptor).encode()
+                is_corrupted = not self._check_integrity(object_key, json_objects)
+                if is_corrupted:
+                    return size
+                self._mark_verified(object_key)
+            if 'Links' not in descriptor:
+                log.error(output_messages['ERROR_CORRPUTION_DETECTED_FOR'] % object_key, class_name=HASH_FS_CLASS_NAME)
+                return size
+            links = [(chunk['Hash'], chunk['Size']) for chunk in descriptor['Links']]
+            if should_verify:
+                # only a verified descriptor gets a compact copy, get trusts it as much as the descriptor itself
+                self._save_compact_links(object_key, links)
+        if clone_single_chunk and len(links) == 1 and self._reflink_chunk(links[0][0], dst_file_path):
+            return int(links[0][1]) if self._verify_reflinked_chunk(links[0][0], dst_file_path) else size
         successfully_wrote = True
         # concat all chunks to dstfile
         try:
             with open(dst_file_path, 'wb') as dst_file:
-                for chunk in descriptor['Links']:
-                    chunk_hash = chunk['Hash']
-                    blob_size = chunk['Size']
+                for chunk_hash, blob_size in links:
                     log.debug(output_messages['DEBUG_GET_CHUNK'] % (chunk_hash, blob_size), class_name=HASH_FS_CLASS_NAME)
                     size += int(blob_size)
 
@@ -315,34 +581,215 @@ class MultihashFS(HashFS):
             os.unlink(dst_file_path)
         return size
 
+    def _should_verify(self, key):
+        if self._chunk_verification == ChunkVerification.NEVER.value:
+            return False
+        if self._chunk_verification == ChunkVerification.FIRST_TOUCH.value:
+            return key not in self._verified_chunks
+        return True
+
+    def _mark_verified(self, key):
+        if self._chunk_verification == ChunkVerification.FIRST_TOUCH.value:
+            self._verified_chunks.add(key)
+
+    def _reflink_chunk(self, chunk_hash, dst_file_path):
+        chunk_path, offset, length = self._locate(chunk_hash)
+        with open(dst_file_path, 'wb') as dst_file:
+            if not self._chunk_copier.reflink(chunk_path, dst_file, offset, length):
+                return False
+        log.debug(output_messages['DEBUG_REFLINK_CHUNK'] % (chunk_hash, dst_file_path), class_name=HASH_FS_CLASS_NAME)
+        return True
+
+    def _verify_reflinked_chunk(self, chunk_hash, dst_file_path):
+        # nothing was read by the reflink, the chunk is read once here if it must be verified
+        if not self._should_verify(chunk_hash) or self._verify_chunk_file(chunk_hash):
+            return True
+        log.error(output_messages['ERROR_CORRPUTION_DETECTED_FOR'] % chunk_hash, class_name=HASH_FS_CLASS_NAME)
+        os.unlink(dst_file_path)
+        return False
+
+    def _verify_chunk_file(self, chunk_hash):
+        m = hashlib.sha256()
+        for chunk_bytes in self._read_blocks(*self._locate(chunk_hash)):
+            m.update(chunk_bytes)
+        if not cid_matches(chunk_hash, m.digest()):
+            return False
+        self._mark_verified(chunk_hash)
+        return True
+
+    def _verify_descriptor_file(self, key):
+        try:
+            return self._verify_chunk_file(key)
+        except FileNotFoundError:
+            return False
+
     def _write_chunk_in_file(self, chunk_hash, dst_file):
-        with open(self._get_hashpath(chunk_hash), 'rb') as chunk_file:
-            while True:
-                chunk_bytes = chunk_file.read(self._blk_size)
-                if not chunk_bytes:
-                    break
-                if self._check_integrity(chunk_hash, chunk_bytes) is False:
-                    return False
-                dst_file.write(chunk_bytes)
+        if not self._should_verify(chunk_hash):
+            # nothing to hash, the chunk can be copied without reading it in user space
+            chunk_path, offset, length = self._locate(chunk_hash)
+            self._chunk_copier.append(chunk_path, dst_file, offset, length)
+            return True
+        m = hashlib.sha256()
+        for chunk_bytes in self._read_blocks(*self._locate(chunk_hash)):
+            m.update(chunk_bytes)
+            dst_file.write(chunk_bytes)
+        # the whole chunk is hashed while copied, the caller removes dst_file if it is corrupted
+        digest = m.digest()
+        if not cid_matches(chunk_hash, digest):
+            log.error(output_messages['ERROR_CORRPUTION_DETECTED'] % (chunk_hash, digest_to_cid(digest)),
+                      class_name=HASH_FS_CLASS_NAME)
+            return False
+        log.debug(output_messages['DEBUG_CHECKSUM_VERIFIED'] % chunk_hash, class_name=HASH_FS_CLASS_NAME)
+        self._mark_verified(chunk_hash)
         return True
 
+    def _locate(self, key):
+        """Returns the (path, offset, length) of the bytes of key. length is None for a loose object, which is
+        the whole file at path."""
+        keypath = self._get_hashpath(key)
+        if not os.path.exists(keypath) and self._packs.active:
+            location = self._packs.locate(key)
+            if location is not None:
+                return location
+        return keypath, 0, None
+
+    def _read_blocks(self, path, offset, length):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            remaining = length
+            while remaining is None or remaining > 0:
+                data = f.read(self._blk_size if remaining is None else min(self._blk_size, remaining))
+                if not data:
+                    break
+                if remaining is not None:
+                    remaining -= len(data)
+                yield data
+
+    @contextmanager
+    def readable_keypath(self, key):
+        """Yields the path of a file holding the object key, for the consumers which need a path (e.g. storages).
+        A packed object is extracted to a temporary file removed on exit."""
+        path, offset, length = self._locate(key)
+        if length is None:
+            yield path
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self._packs_tmp_path())
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for data in self._read_blocks(path, offset, length):
+                    f.write(data)
+            yield tmp_path
+        finally:
+            os.unlink(tmp_path)
+
+    def _packs_tmp_path(self):
+        tmp_path = os.path.join(os.path.dirname(self._path), PACKS_DIR, 'tmp')
+        ensure_path_exists(tmp_path)
+        return tmp_path
+
     def load(self, key):
         srckey = self._get_hashpath(key)
+        if not os.path.exists(srckey) and self._packs.active:
+            data = self._packs.read(key)
+            if data is not None:
+                try:
+                    return json.loads(data)
+                except ValueError as e:
+                    log.debug(str(e), class_name=HASH_FS_CLASS_NAME)
+                    return {}
         return json_load(srckey)
 
+    def load_links(self, key):
+        """Returns the (hash, size) of every chunk listed by the descriptor key.
+
+        With the binary descriptor format, the links are read from the compact copy of the descriptor when there is one.
+        Otherwise the JSON descriptor is parsed and, once its integrity verified, saved in the compact format."""
+        links = self._load_compact_links(key)
+        if links is None:
+            descriptor = self.load(key)
+            links = [(link['Hash'], link['Size']) for link in descriptor['Links']]
+            if self._is_compact_enabled() and self._digest(json.dumps(descriptor).encode()) == key:
+                self._save_compact_links(key, links)
+        return links
+
+    def _is_compact_enabled(self):
+        return self._descriptor_format == DescriptorFormat.BINARY.value
+
+    def _get_compact_path(self, key):
+        return self._get_hashpath(key, self._descriptors_path)
+
+    def _load_compact_links(self, key):
+        if not self._is_compact_enabled():
+            return None
+        try:
+            return load_compact(self._get_compact_path(key))
+        except FileNotFoundError:
+            return None
+        except CompactDescriptorError as e:
+            log.debug(str(e), class_name=HASH_FS_CLASS_NAME)
+            return None
+
+    def _save_compact_links(self, key, links):
+        if not self._is_compact_enabled():
+            return
+        compact_path = self._get_compact_path(key)
+        ensure_path_exists(os.path.dirname(compact_path))
+        save_compact(links, compact_path)
+
     def fetch_scid(self, key, log_file=None):
         log.debug(output_messages['DEBUG_BUILDING_STORAGE_LOG'], class_name=HASH_FS_CLASS_NAME)
         if self._exists(key):
-            links = self.load(key)
-            self._log(key, links['Links'], log_file)
+            links = self.load_links(key)
+            self._log(key, links, log_file)
         else:
             log.debug(output_messages['DEBUG_BLOB_ALREADY_COMMITED'] % key, class_name=HASH_FS_CLASS_NAME)
 
     '''test existence of CIDv1 key in hash dir implementation'''
 
     def _exists(self, key):
-        keypath = self._get_hashpath(key)
-        return os.path.exists(keypath)
+        if self._objects_index is not None and key in self._objects_index:
+            return True
+        exists = self._is_stored(key)
+        if exists:
+            self._index_key(key)
+        return exists
+
+    def _is_stored(self, key):
+        return os.path.exists(self._get_hashpath(key)) or key in self._packs
+
+    def _stored_objects_index(self):
+        """Returns the objects index to update after objects were removed: the one in use, or the one left by a previous
+        use of the option, which would otherwise list the removed objects once the option is enabled again."""
+        if self._objects_index is not None:
+            return self._objects_index
+        if not os.path.exists(self._objects_index_path):
+            return None
+        return ObjectsIndex(self._objects_index_path)
+
+    def missing(self, keys):
+        """Returns the keys which are not stored in the hashfs, in the order they were given.
+
+        With the objects index, the presence of all the keys is tested with a few queries, and only the keys unknown
+        to the index are checked on disk."""
+        candidates = list(keys) if self._objects_index is None else self._objects_index.missing(keys)
+        missing_keys = []
+        found_keys = []
+        for key in candidates:
+            if os.path.exists(self._get_hashpath(key)):
+                found_keys.append(key)
+            else:
+                missing_keys.append(key)
+        if self._packs.active and missing_keys:
+            not_packed = self._packs.missing(missing_keys)
+            found_keys.extend(set(missing_keys) - set(not_packed))
+            missing_keys = not_packed
+        if self._objects_index is not None and found_keys:
+            self._objects_index.add_many(found_keys)
+        return missing_keys
+
+    def _index_key(self, key):
+        if self._objects_index is not None:
+            self._objects_index.add(key)
 
     '''test existence of filename in system always returns False.
     no easy way to test if a file exists based on its name only because it's a CAS.'''
@@ -352,14 +799,72 @@ class MultihashFS(HashFS):
 
     '''Checks integrity of all files under .ml-git/.../hashfs/'''
 
-    def fsck(self, exclude=['log', 'metadata'], remove_corrupted=False):
+    def fsck(self, exclude=['log', 'metadata'], remove_corrupted=False, hashing_mode=HashingMode.AUTO.value):
         log.info(output_messages['INFO_STARTING_INTEGRITY_CHECK'] % self._path, class_name=HASH_FS_CLASS_NAME)
         corrupted_files = []
         corrupted_files_fullpaths = []
-        self._check_files_integrity(corrupted_files, corrupted_files_fullpaths)
+        checked_files = self._check_files_integrity(corrupted_files, corrupted_files_fullpaths, hashing_mode)
         self._remove_corrupted_files(corrupted_files_fullpaths, remove_corrupted)
+        checked_files.extend(self._check_packs_integrity(corrupted_files, remove_corrupted))
+        self._update_verified_chunks(checked_files, corrupted_files)
+        objects_index = self._stored_objects_index()
+        if objects_index is not None:
+            removed_files = corrupted_files if remove_corrupted else []
+            objects_index.rebuild(set(checked_files) - set(removed_files))
         return corrupted_files
 
+    def _check_packs_integrity(self, corrupted_files, remove_corrupted):
+        """Verifies every entry of the packs and rebuilds the table of packed objects from them."""
+        if not self._packs.active:
+            return []
+        checked_files = []
+        valid_entries = []
+        corrupted_entries = []
+        for key, location, data in self._packs.scan():
+            checked_files.append(key)
+            digest = hashlib.sha256(data).digest()
+            if cid_matches(key, digest):
+                log.debug(output_messages['DEBUG_CHECKSUM_VERIFIED'] % key, class_name=HASH_FS_CLASS_NAME)
+                valid_entries.append((key, location))
+            else:
+                log.error(output_messages['ERROR_CORRPUTION_DETECTED'] % (key, digest_to_cid(digest)),
+                          class_name=HASH_FS_CLASS_NAME)
+                corrupted_entries.append((key, location))
+        valid_keys = {key for key, _ in valid_entries}
+        corrupted_files.extend(key for key, _ in corrupted_entries if key not in valid_keys)
+        # a corrupted entry is only kept when there is no valid copy of its key
+        self._packs.rebuild(valid_entries + ([] if remove_corrupted else corrupted_entries))
+        return checked_files
+
+    def repack(self):
+        """Moves the loose objects not bigger than the pack threshold to packs and rewrites the packs with dead space.
+
+        Returns the number of loose objects packed and the number of bytes reclaimed in the packs."""
+        packed_files = 0
+        if self._pack_threshold > 0:
+            for root, dirs, files in os.walk(self._path):
+                if 'log' in root:
+                    continue
+                for file in files:
+                    fullpath = os.path.join(root, file)
+                    if os.path.getsize(fullpath) > self._pack_threshold:
+                        continue
+                    with open(fullpath, 'rb') as f:
+                        data = f.read()
+                    # corrupted objects are left for fsck
+                    if not cid_matches(file, hashlib.sha256(data).digest()):
+                        continue
+                    self._packs.put(file, data)
+                    os.unlink(fullpath)
+                    packed_files += 1
+        return packed_files, self._packs.compact()
+
+    def _update_verified_chunks(self, checked_files, corrupted_files):
+        if self._chunk_verification == ChunkVerification.FIRST_TOUCH.value:
+            self._verified_chunks.reset(set(checked_files) - set(corrupted_files))
+        else:
+            self._verified_chunks.discard(corrupted_files)
+
     def _remove_corrupted_files(self, corrupted_files_fullpaths, remove_corrupted):
         if remove_corrupted and len(corrupted_files_fullpaths) > 0:
             log.info(output_messages['INFO_REMOVING_CORRUPTED_FILES'] % len(corrupted_files_fullpaths), class_name=HASH_FS_CLASS_NAME)
@@ -371,40 +876,49 @@ class MultihashFS(HashFS):
                 self.__progress_bar.update(1)
             self.__progress_bar.close()
 
-    def _check_files_integrity(self, corrupted_files, corrupted_files_fullpaths):
-        self.__progress_bar = tqdm(total=len(os.listdir(self._path)), desc='directories', unit='directories',
-                                   unit_scale=True, mininterval=1.0)
-        last_path = ''
+    def _iter_objects(self):
         for root, dirs, files in os.walk(self._path):
             if 'log' in root:
                 continue
             for file in files:
-                fullpath = os.path.join(root, file)
-                with open(fullpath, 'rb') as c:
-                    m = hashlib.sha256()
-                    while True:
-                        d = c.read(self._blk_size)
-                        if not d:
-                            break
-                        m.update(d)
-                    self._verify_chunk_integrity(corrupted_files, corrupted_files_fullpaths, file, fullpath, m, root)
-                if root[:-2] != last_path:
-                    last_path = root[:-2]
-                    self.__progress_bar.update(1)
+                yield root, file
+
+    def _check_files_integrity(self, corrupted_files, corrupted_files_fullpaths, hashing_mode=HashingMode.AUTO.value):
+        self.__progress_bar = tqdm(total=len(os.listdir(self._path)), desc='directories', unit='directories',
+                                   unit_scale=True, mininterval=1.0)
+        processes, objects = use_process_pool(hashing_mode, self._iter_objects())
+        wp = pool_factory(nworkers=os.cpu_count() or 1, retry=0, processes=processes)
+        args = {'wp': wp, 'corrupted_files': corrupted_files, 'corrupted_files_fullpaths': corrupted_files_fullpaths,
+                'checked_files': [], 'last_path': ''}
+        try:
+            run_function_per_group(objects, FSCK_BATCH_SIZE, function=self._check_objects_integrity, arguments=args)
+        finally:
+            wp.shutdown()
         self.__progress_bar.close()
+        return args['checked_files']
+
+    def _check_objects_integrity(self, objects, args):
+        wp = args['wp']
+        for root, file in objects:
+            wp.submit(file_digest, os.path.join(root, file), self._blk_size)
+        for (root, file), future in zip(objects, wp.wait()):
+            args['checked_files'].append(file)
+            self._verify_chunk_integrity(args['corrupted_files'], args['corrupted_files_fullpaths'], file,
+                                         os.path.join(root, file), future.result(), root)
+            if root[:-2] != args['last_path']:
+                args['last_path'] = root[:-2]
+                self.__progress_bar.update(1)
+        wp.reset_futures()
+        return True
 
-    def _verify_chunk_integrity(self, corrupted_files, corrupted_files_fullpaths, file, fullpath, m, root):
-        chuck_hex = m.hexdigest()
-        multi_hash = multihash.encode(bytes.fromhex(chuck_hex), 'sha2-256')
-        cid = CIDv1('dag-pb', multi_hash)
-        ncid = str(cid)
-        if ncid != file:
-            log.error(output_messages['ERROR_CORRPUTION_DETECTED'] % (file, ncid),
+    def _verify_chunk_integrity(self, corrupted_files, corrupted_files_fullpaths, file, fullpath, digest, root):
+        if not cid_matches(file, digest):
+            log.error(output_messages['ERROR_CORRPUTION_DETECTED'] % (file, digest_to_cid(digest)),
                       class_name=HASH_FS_CLASS_NAME)
             corrupted_files.append(file)
             corrupted_files_fullpaths.append(fullpath)
         else:
-            log.debug(output_messages['DEBUG_CHECKSUM_VERIFIED'] % cid, class_name=HASH_FS_CLASS_NAME)
+            log.debug(output_messages['DEBUG_CHECKSUM_VERIFIED'] % file, class_name=HASH_FS_CLASS_NAME)
             if not self._is_valid_hashpath(root, file):
                 corrupted_files.append(file)
                 corrupted_files_fullpaths.append(fullpath)
@@ -421,3 +935,27 @@ class MultihashFS(HashFS):
                       class_name=HASH_FS_CLASS_NAME)
 
         return is_valid
+
+
+_shared_instances = {}
+
+
+def _shared_hashfs(init_args):
+    """Unpickles a MultihashFS sent to the process of a process pool: the process creates a single MultihashFS for
+    the same arguments, on its first task."""
+    hfs = _shared_instances.get(init_args)
+    if hfs is None:
+        hfs = _shared_instances[init_args] = MultihashFS(*init_args)
+    return hfs
+
+
+def file_digest(path, blocksize):
+    """Returns the sha256 digest of the content of path, read by blocks of blocksize."""
+    m = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            d = f.read(blocksize)
+            if not d:
+                break
+            m.update(d)
+    return m.digest()
@@ -3,32 +3,71 @@
 SPDX-License-Identifier: GPL-2.0-only
 """
 
+import json
 import os
+import queue
 import shutil
+import threading
 import time
-from builtins import FileNotFoundError
+from collections import namedtuple
 from enum import Enum
 
 from ml_git import log
-from ml_git.constants import MULTI_HASH_CLASS_NAME, MutabilityType, SPEC_EXTENSION, INDEX_FILE, MLGIT_IGNORE_FILE_NAME
+from ml_git.constants import MULTI_HASH_CLASS_NAME, MutabilityType, SPEC_EXTENSION, INDEX_FILE, MLGIT_IGNORE_FILE_NAME, \
+    DescriptorFormat, ChunkerType, RACY_CLEAN_WINDOW_NS, SCAN_CACHE_FILE, HashingMode, ADDED_LINKS_FILE
 from ml_git.file_system.cache import Cache
 from ml_git.file_system.hashfs import MultihashFS
+from ml_git.file_system.scanner import scan_files, ScanCache
 from ml_git.manifest import Manifest
+from ml_git.manifest_storage import remove_manifest_storage
 from ml_git.ml_git_message import output_messages
-from ml_git.pool import pool_factory
-from ml_git.utils import ensure_path_exists, yaml_load, posix_path, set_read_only, get_file_size, \
-    run_function_per_group, get_ignore_rules, should_ignore_file
+from ml_git.pool import pool_factory, use_process_pool
+from ml_git.utils import ensure_path_exists, yaml_load, posix_path, set_read_only, \
+    get_ignore_rules, should_ignore_file, compile_ignore_rules
+
+'''The entries of the full index keep a stat cache of the files: the size, mtime and ctime in nanoseconds, inode and
+device of the file when it was indexed. A file is only hashed again when its stat changed, and a file whose size
+changed is known to be modified without hashing it. As in git, the stat of a file modified just before it was
+indexed (racily clean) is not recorded, since the file could change again without changing its stat.
+
+An add streams the files of the scan to the workers hashing them, and the results to a single thread writing the
+manifest, which saves both indexes every ADD_CHECKPOINT_INTERVAL seconds: an interrupted add keeps the files recorded so
+far. The workers update the full index themselves, so its changes and saves are serialized by a lock.
+
+In a process pool (hashing_mode), the workers only run hash_file and the writer updates the full index from their
+results.
+
+The writer also keeps the chunks of each object added, appended at each save to the ADDED_LINKS_FILE of the index
+(one JSON record per object), so that the commit writes them to the storage log without reading the descriptors
+again. The chunks of an object only depend on its key, so a record stays valid after a reset or a later add.'''
+
+STAT_KEY = 'stat'
+# files hashed (or being hashed) and not yet recorded by the writer of an add
+ADD_PIPELINE_DEPTH = 10000
+# seconds between two saves of the indexes during an add
+ADD_CHECKPOINT_INTERVAL = 30
+
+_EndOfFiles = namedtuple('_EndOfFiles', 'count')
+# a file hashed by a worker process, recorded in the full index by the writer
+_PendingHash = namedtuple('_PendingHash', 'filepath fullpath value st')
 
 
 class MultihashIndex(object):
 
-    def __init__(self, spec, index_path, object_path, mutability=MutabilityType.STRICT.value, cache_path=None):
+    def __init__(self, spec, index_path, object_path, mutability=MutabilityType.STRICT.value, cache_path=None,
+                 descriptor_format=DescriptorFormat.JSON.value, chunker=ChunkerType.FIXED.value, objects_index=False,
+                 pack_threshold=0, index_format=None, scan_cache=False, hashing_mode=HashingMode.AUTO.value):
         self._spec = spec
         self._path = index_path
-        self._hfs = MultihashFS(object_path)
+        self._hfs = MultihashFS(object_path, descriptor_format=descriptor_format, chunker=chunker,
+                                objects_index=objects_index, pack_threshold=pack_threshold)
         self._mf = self._get_index(index_path)
-        self._full_idx = FullIndex(spec, index_path, mutability)
+        self._full_idx = FullIndex(spec, index_path, mutability, index_format)
         self._cache = cache_path
+        self._scan_cache = scan_cache
+        self._pack_threshold = pack_threshold
+        self._hashing_mode = hashing_mode
+        self._added_links = []
 
     def _get_index(self, idxpath):
         metadatapath = os.path.join(idxpath, 'metadata', self._spec)
@@ -37,31 +76,41 @@ class MultihashIndex(object):
         mfpath = os.path.join(metadatapath, 'MANIFEST.yaml')
         return Manifest(mfpath)
 
+    def _get_scan_cache(self, path):
+        if not self._scan_cache:
+            return None
+        return ScanCache(os.path.join(self._path, 'metadata', self._spec, SCAN_CACHE_FILE), path)
+
     def _add_dir(self, dir_path, manifest_path, file_path='', ignore_rules=None):
         self.manifestfiles = yaml_load(manifest_path)
-        f_index_file = self._full_idx.get_index()
-        all_files = []
-        for root, dirs, files in os.walk(os.path.join(dir_path, file_path)):
-            base_path = root[:len(dir_path) + 1:]
-            relative_path = root[len(dir_path) + 1:]
-            if '.' == root[0] or should_ignore_file(ignore_rules, '{}/'.format(relative_path)):
-                continue
-            for file in files:
-                file_path = os.path.join(relative_path, file)
-                if ignore_rules is None or not should_ignore_file(ignore_rules, file_path):
-                    all_files.append(file_path)
-            self.wp.progress_bar_total_inc(len(all_files))
-            args = {'wp': self.wp, 'base_path': base_path, 'f_index_file': f_index_file, 'all_files': all_files, 'dir_path': dir_path}
-            result = run_function_per_group(range(len(all_files)), 10000, function=self._adding_dir_work, arguments=args)
-            if not result:
-                return False
-        self._full_idx.save_manifest_index()
-        self._mf.save()
+        # a Manifest, read by lookups: its dict would make every save rewrite the whole full index
+        f_index_file = self._full_idx.get_manifest_index()
+        files = ()
+        if '.' != os.path.join(dir_path, file_path)[0]:
+            ignore = ignore_rules.ignores if ignore_rules else None
+            cache = self._get_scan_cache(dir_path)
+            files = (path for path, _ in scan_files(dir_path, file_path, ignore, cache=cache))
+        processes = False
+        if not self._pack_threshold:
+            # the packs are appended by a single process
+            processes, files = use_process_pool(self._hashing_mode, files)
+        process_pool = pool_factory(nworkers=os.cpu_count() or 1, processes=True) if processes else None
+        try:
+            self._add_files(dir_path, files, f_index_file, process_pool)
+        except Exception as e:
+            log.error(output_messages['ERROR_ADDING_DIR'] % (dir_path, e), class_name=MULTI_HASH_CLASS_NAME)
+            return False
+        finally:
+            # save the manifest of files added to index so far
+            self._checkpoint()
+            if process_pool is not None:
+                process_pool.shutdown()
 
     def add(self, path, manifestpath, files=[]):
         self.wp = pool_factory(pb_elts=0, pb_desc='files')
-        ignore_rules = get_ignore_rules(path)
+        ignore_rules = compile_ignore_rules(get_ignore_rules(path))
         if len(files) > 0:
+            files = _remove_nested_paths(files)
             single_files = filter(lambda x: os.path.isfile(os.path.join(path, x)), files)
             self.wp.progress_bar_total_inc(len(list(single_files)))
             for f in files:
@@ -69,7 +118,7 @@ class MultihashIndex(object):
                 if os.path.isdir(fullpath):
                     self._add_dir(path, manifestpath, f, ignore_rules=ignore_rules)
                 elif os.path.isfile(fullpath):
-                    if not should_ignore_file(ignore_rules, path):
+                    if not should_ignore_file(ignore_rules, f):
                         self._add_single_file(path, manifestpath, f)
                 else:
                     log.warn(output_messages['WARN_NOT_FOUND'] % fullpath, class_name=MULTI_HASH_CLASS_NAME)
@@ -78,34 +127,126 @@ class MultihashIndex(object):
                 self._add_dir(path, manifestpath, ignore_rules=ignore_rules)
         self.wp.progress_bar_close()
 
-    def _adding_dir_work_future_process(self, futures, wp):
-        for future in futures:
-            scid, filepath, previous_hash = future.result()
-            self.update_index(scid, filepath, previous_hash) if scid is not None else None
-        wp.reset_futures()
-
-    def _adding_dir_work(self, files, args):
-        for k in files:
-            file_path = args['all_files'][k]
-            if (SPEC_EXTENSION in file_path) or (file_path == 'README.md') or (file_path == MLGIT_IGNORE_FILE_NAME):
-                args['wp'].progress_bar_total_inc(-1)
-                self.add_metadata(args['base_path'], file_path)
-            else:
-                args['wp'].submit(self._add_file, args['base_path'], file_path, args['f_index_file'])
-        futures = self.wp.wait()
+    def _add_files(self, base_path, files, f_index_file, process_pool=None):
+        """Adds the files of base_path as a pipeline: each file is hashed by the workers of the pool (process_pool if
+        given) as soon as it is scanned, and a single writer thread records the results in the manifest. At most
+        ADD_PIPELINE_DEPTH files are waiting for the writer, the scan is held back beyond that.
+
+        Raises the first error of a worker, once the files already submitted are done."""
+        slots = threading.BoundedSemaphore(ADD_PIPELINE_DEPTH)
+        results = queue.Queue()
+        errors = []
+        writer = threading.Thread(target=self._write_results, args=(results, slots, errors), daemon=True)
+        writer.start()
+        submitted = 0
         try:
-            self._adding_dir_work_future_process(futures, self.wp)
-        except Exception as e:
-            self._full_idx.save_manifest_index()
-            self._mf.save()
-            log.error(output_messages['ERROR_ADDING_DIR'] % (args['dir_path'], e), class_name=MULTI_HASH_CLASS_NAME)
+            for file_path in files:
+                if errors:
+                    break
+                if (SPEC_EXTENSION in file_path) or (file_path == 'README.md') or (file_path == MLGIT_IGNORE_FILE_NAME):
+                    self.add_metadata(base_path, file_path)
+                    continue
+                slots.acquire()
+                if process_pool is None:
+                    self.wp.submit_notify(_put_result(results), self._add_file, base_path, file_path, f_index_file)
+                elif not self._submit_hash(process_pool, results, base_path, file_path, f_index_file):
+                    slots.release()
+                    continue
+                self.wp.progress_bar_total_inc(1)
+                submitted += 1
+        finally:
+            results.put(_EndOfFiles(submitted))
+            writer.join()
+        if errors:
+            raise errors[0]
+
+    def _write_results(self, results, slots, errors):
+        """Records the results of the workers until all the files submitted are done. After an error, the results are
+        still taken from the queue (and their slots released, so that the scan is not held back) but not recorded."""
+        expected = None
+        written = 0
+        last_checkpoint = time.monotonic()
+        while expected is None or written < expected:
+            for result in _get_available(results):
+                if isinstance(result, _EndOfFiles):
+                    expected = result.count
+                    continue
+                written += 1
+                slots.release()
+                future, pending = result
+                try:
+                    self._write_result(future, pending, errors)
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    if pending is not None:
+                        self.wp.progress_bar_update(1)
+            if not errors and time.monotonic() - last_checkpoint >= ADD_CHECKPOINT_INTERVAL:
+                try:
+                    self._checkpoint()
+                except Exception as e:
+                    errors.append(e)
+                last_checkpoint = time.monotonic()
+
+    def _write_result(self, future, pending, errors):
+        hashed = future.result()
+        if errors:
+            # the results after an error are not recorded, as when the files were added by groups
+            return
+        scid, filepath, previous_hash, chunks = hashed if pending is None else self._record_hash(hashed, pending)
+        if scid is not None:
+            self.update_index(scid, filepath, previous_hash)
+            self._log_links(scid, chunks)
+
+    def _submit_hash(self, process_pool, results, base_path, file_path, f_index_file):
+        """Submits the hash of a file to process_pool, as _add_file would do it in a thread. Returns False if the
+        file did not change since it was indexed, nothing is submitted then."""
+        fullpath = os.path.join(base_path, file_path)
+        value = f_index_file.find(posix_path(file_path))
+        if value is None:
+            pending = _PendingHash(file_path, fullpath, None, None)
+            process_pool.submit_notify(_put_result(results, pending), hash_file, self._hfs, fullpath)
+            return True
+        checked = self._full_idx.check_stat(value, posix_path(file_path), fullpath)
+        if checked is None:
             return False
+        st, verify_only = checked
+        pending = _PendingHash(file_path, fullpath, value, st)
+        process_pool.submit_notify(_put_result(results, pending), hash_file, self._hfs, fullpath, value['hash'],
+                                   verify_only)
         return True
 
+    def _record_hash(self, hashed, pending):
+        """Updates the full index with the CID of a file hashed by a worker process."""
+        scid, chunks = hashed
+        filepath = posix_path(pending.filepath)
+        if pending.value is None:
+            self._full_idx.update_full_index(filepath, pending.fullpath, Status.a.name, scid)
+            return scid, pending.filepath, None, chunks
+        scid = self._full_idx.record_hash(pending.value, scid, filepath, pending.fullpath, pending.st, self._cache)
+        return scid, pending.filepath, self._full_idx.get_manifest_index().lookup(filepath).get('previous_hash'), chunks
+
+    def _log_links(self, scid, chunks):
+        if chunks is not None:
+            self._added_links.append(json.dumps([scid, chunks]))
+
+    def _save_links(self):
+        if not self._added_links:
+            return
+        links_path = os.path.join(self._path, 'metadata', self._spec, ADDED_LINKS_FILE)
+        with open(links_path, 'a') as links_file:
+            links_file.write('\n'.join(self._added_links) + '\n')
+        self._added_links = []
+
+    def _checkpoint(self):
+        self._save_links()
+        self._full_idx.save_manifest_index()
+        self._mf.save()
+
     def _add_single_file(self, base_path, manifestpath, file_path):
         self.manifestfiles = yaml_load(manifestpath)
 
-        f_index_file = self._full_idx.get_index()
+        f_index_file = self._full_idx.get_manifest_index()
         if (SPEC_EXTENSION in file_path) or ('README' in file_path) or (MLGIT_IGNORE_FILE_NAME in file_path):
             self.wp.progress_bar_total_inc(-1)
             self.add_metadata(base_path, file_path)
@@ -114,17 +255,17 @@ class MultihashIndex(object):
             futures = self.wp.wait()
             for future in futures:
                 try:
-                    scid, filepath, previous_hash = future.result()
-                    self.update_index(scid, filepath, previous_hash) if scid is not None else None
+                    scid, filepath, previous_hash, chunks = future.result()
+                    if scid is not None:
+                        self.update_index(scid, filepath, previous_hash)
+                        self._log_links(scid, chunks)
                 except Exception as e:
                     # save the manifest of files added to index so far
-                    self._full_idx.save_manifest_index()
-                    self._mf.save()
+                    self._checkpoint()
                     log.error(output_messages['ERROR_ADDING_DIR'] % (base_path, e), class_name=MULTI_HASH_CLASS_NAME)
                     return
             self.wp.reset_futures()
-        self._full_idx.save_manifest_index()
-        self._mf.save()
+        self._checkpoint()
 
     def add_metadata(self, basepath, filepath):
         log.debug(output_messages['DEBUG_ADD_FILE'] % filepath, class_name=MULTI_HASH_CLASS_NAME)
@@ -147,10 +288,7 @@ class MultihashIndex(object):
 
     def remove_manifest(self):
         index_metadata_path = os.path.join(self._path, 'metadata', self._spec)
-        try:
-            os.unlink(os.path.join(index_metadata_path, 'MANIFEST.yaml'))
-        except FileNotFoundError:
-            pass
+        remove_manifest_storage(os.path.join(index_metadata_path, 'MANIFEST.yaml'))
 
     def _save_index(self):
         self._mf.save()
@@ -164,20 +302,20 @@ class MultihashIndex(object):
         ensure_path_exists(metadatapath)
 
         scid = None
-        check_file = f_index_file.get(posix_path(filepath))
+        check_file = f_index_file.find(posix_path(filepath))
         previous_hash = None
         if check_file is not None:
-            if self._full_idx.check_and_update(filepath, check_file, self._hfs, posix_path(filepath), fullpath, self._cache):
-                scid = self._hfs.put(fullpath)
+            scid, chunks = self._full_idx.check_and_update(filepath, check_file, self._hfs, posix_path(filepath), fullpath,
+                                                           self._cache)
 
-            updated_check = f_index_file.get(posix_path(filepath))
+            updated_check = f_index_file.find(posix_path(filepath))
             if 'previous_hash' in updated_check:
                 previous_hash = updated_check['previous_hash']
         else:
-            scid = self._hfs.put(fullpath)
+            scid, chunks = hash_file(self._hfs, fullpath)
             self._full_idx.update_full_index(posix_path(filepath), fullpath, Status.a.name, scid)
 
-        return scid, filepath, previous_hash
+        return scid, filepath, previous_hash, chunks
 
     def get(self, objectkey, path, file):
         log.info(output_messages['INFO_GETTING_FILE'] % file, class_name=MULTI_HASH_CLASS_NAME)
@@ -192,8 +330,8 @@ class MultihashIndex(object):
         shutil.rmtree(self._path)
         os.mkdir(self._path)
 
-    def fsck(self):
-        return self._hfs.fsck()
+    def fsck(self, hashing_mode=HashingMode.AUTO.value):
+        return self._hfs.fsck(hashing_mode=hashing_mode)
 
     def update_index_manifest(self, hash_files):
         for key in hash_files:
@@ -207,8 +345,7 @@ class MultihashIndex(object):
 
     def remove_deleted_files_index_manifest(self, deleted_files):
         manifest = self.get_index()
-        for file in deleted_files:
-            manifest.rm_file(file)
+        manifest.rm_files(deleted_files)
         manifest.save()
 
     def get_hashes_list(self):
@@ -219,44 +356,129 @@ class MultihashIndex(object):
         return hashes_list
 
 
+def hash_file(hfs, fullpath, indexed_hash=None, verify_only=False):
+    """Returns the CID of fullpath and the hashes of its chunks, storing it in hfs unless verify_only (the chunks are
+    None then). indexed_hash is the CID of the file in the index, if it is indexed. A module function, so that it can
+    run in the processes of a pool."""
+    if verify_only:
+        return hfs.get_scid(fullpath, indexed_hash), None
+    # hash and store in a single pass, chunks are only written if the file content changed
+    scid, links = hfs.put_if_changed(fullpath, indexed_hash)
+    return scid, [link['Hash'] for link in links]
+
+
+def load_added_links(links_path):
+    """Returns the hashes of the chunks of each object recorded in the ADDED_LINKS_FILE links_path, by object key."""
+    links = {}
+    try:
+        with open(links_path) as links_file:
+            for line in links_file:
+                try:
+                    key, chunks = json.loads(line)
+                except ValueError:
+                    # record partially written by an interrupted add
+                    continue
+                links[key] = chunks
+    except FileNotFoundError:
+        pass
+    return links
+
+
+def _put_result(results, pending=None):
+    return lambda future: results.put((future, pending))
+
+
+def _remove_nested_paths(files):
+    """Returns the paths of files, in their order, without the duplicates and the paths inside another one of files,
+    so that each file is only added once."""
+    normalized = [os.path.normpath(file) for file in files]
+    roots = set(normalized)
+    kept = []
+    seen = set()
+    for file, path in zip(files, normalized):
+        if path in seen:
+            continue
+        seen.add(path)
+        parent = os.path.dirname(path)
+        nested = path != '.' and '.' in roots
+        while parent and not nested:
+            nested = parent in roots
+            parent = os.path.dirname(parent)
+        if not nested:
+            kept.append(file)
+    return kept
+
+
+def _get_available(results):
+    """Waits for a result of the queue results and returns it with all the results already available."""
+    available = [results.get()]
+    try:
+        while True:
+            available.append(results.get_nowait())
+    except queue.Empty:
+        return available
+
+
 class FullIndex(object):
-    def __init__(self, spec, index_path, mutability=MutabilityType.STRICT.value):
+    def __init__(self, spec, index_path, mutability=MutabilityType.STRICT.value, index_format=None):
         self._spec = spec
         self._path = index_path
-        self._fidx = self._get_index(index_path)
+        self._fidx = self._get_index(index_path, index_format)
         self._mutability = mutability
+        self._lock = threading.RLock()
 
-    def _get_index(self, idxpath):
+    def _get_index(self, idxpath, index_format=None):
         metadatapath = os.path.join(idxpath, 'metadata', self._spec)
         ensure_path_exists(metadatapath)
         fidxpath = os.path.join(metadatapath, INDEX_FILE)
-        return Manifest(fidxpath)
+        return Manifest(fidxpath, index_format, journaled=True)
 
     def update_full_index(self, filename, fullpath, status, key, previous_hash=None):
-        self._fidx.add(filename, self._full_index_format(fullpath, status, key, previous_hash))
+        value = self._full_index_format(fullpath, status, key, previous_hash)
+        with self._lock:
+            self._fidx.add(filename, value)
 
     def _full_index_format(self, fullpath, status, new_key, previous_hash=None):
+        # the stat is taken after the change of mode, which changes the ctime
+        if self._mutability != MutabilityType.MUTABLE.value and os.path.isfile(fullpath):
+            set_read_only(fullpath)
         st = os.stat(fullpath)
         obj = {'ctime': st.st_ctime, 'mtime': st.st_mtime, 'status': status, 'hash': new_key,
-               'size': get_file_size(fullpath)}
+               'size': st.st_size, STAT_KEY: stat_fingerprint(st)}
 
         if previous_hash:
             obj['previous_hash'] = previous_hash
-
-        if self._mutability != MutabilityType.MUTABLE.value and os.path.isfile(fullpath):
-            set_read_only(fullpath)
         return obj
 
+    def refresh_stat(self, filename, st):
+        """Records st as the stat of filename, whose content was checked to be the one indexed."""
+        with self._lock:
+            value = dict(self._fidx.lookup(filename))
+            value.update({'ctime': st.st_ctime, 'mtime': st.st_mtime, 'size': st.st_size, STAT_KEY: stat_fingerprint(st)})
+            self._fidx.set(filename, value)
+
+    def refresh_stats(self, base_path, files):
+        """Records the current stat of the indexed files of base_path in files, whose content did not change but whose
+        stat did (e.g. once linked to the cache, which changes their ctime or inode)."""
+        for file in files:
+            filename = posix_path(file)
+            if self._fidx.find(filename) is None:
+                continue
+            try:
+                st = os.stat(os.path.join(base_path, file))
+            except OSError:
+                continue
+            self.refresh_stat(filename, st)
+        self.save_manifest_index()
+
     def update_index_status(self, filenames, status):
-        findex = self.get_index()
         for file in filenames:
-            findex[file]['status'] = status
+            self._fidx[file]['status'] = status
         self._fidx.save()
 
     def update_index_unlock(self, filename):
-        findex = self.get_index()
         try:
-            findex[filename]['untime'] = time.time()
+            self._fidx[filename]['untime'] = time.time()
         except Exception:
             log.debug(output_messages['DEBUG_FILE_NOT_INDEX'].format(filename), class_name=MULTI_HASH_CLASS_NAME)
         self._fidx.save()
@@ -283,7 +505,8 @@ class FullIndex(object):
         return self._fidx
 
     def save_manifest_index(self):
-        return self._fidx.save()
+        with self._lock:
+            return self._fidx.save()
 
     def remove_deleted_files(self, deleted_files):
         for file in deleted_files:
@@ -291,27 +514,46 @@ class FullIndex(object):
         self._fidx.save()
 
     def check_and_update(self, key, value, hfs, filepath, fullpath, cache):
+        """Hashes fullpath again if its stat changed since it was indexed in value. Returns the CID to record in the
+        manifest (None if there is none) and the chunks of the file if it was stored."""
+        checked = self.check_stat(value, filepath, fullpath)
+        if checked is None:
+            return None, None
+        st, verify_only = checked
+        scid, chunks = hash_file(hfs, fullpath, value['hash'], verify_only)
+        return self.record_hash(value, scid, filepath, fullpath, st, cache), chunks
+
+    def check_stat(self, value, filepath, fullpath):
+        """Returns None if the stat of fullpath did not change since it was indexed in value. Otherwise returns its
+        stat and whether the file must only be verified (a change of a strict or flexible file is a corruption)."""
         st = os.stat(fullpath)
-        if key == filepath and value['ctime'] == st.st_ctime and value['mtime'] == st.st_mtime:
+        if compare_stat(value, st) == StatChange.UNCHANGED:
             log.debug(output_messages['DEBUG_FILE_ALREADY_EXISTS_REPOSITORY'] % filepath, class_name=MULTI_HASH_CLASS_NAME)
             return None
-        elif key == filepath and value['ctime'] != st.st_ctime or value['mtime'] != st.st_mtime:
-            log.debug(output_messages['DEBUG_FILE_WAS_MODIFIED'] % filepath, class_name=MULTI_HASH_CLASS_NAME)
-            scid = hfs.get_scid(fullpath)
-            if value['hash'] != scid:
-                scid_ret = self._update_file_status(cache, filepath, fullpath, scid, st, value)
-                return scid_ret
+        log.debug(output_messages['DEBUG_FILE_WAS_MODIFIED'] % filepath, class_name=MULTI_HASH_CLASS_NAME)
+        return st, self._is_corrupted_change(st, value)
+
+    def record_hash(self, value, scid, filepath, fullpath, st, cache):
+        """Updates the entry value of filepath, whose stat changed to st, once the file was hashed to scid."""
+        if value['hash'] != scid:
+            scid_ret = self._update_file_status(cache, filepath, fullpath, scid, st, value)
+            return scid_ret
+        # only the stat changed (touch, copy, restore...), the file is not hashed again while it does not change
+        self.refresh_stat(filepath, st)
         return None
 
+    def _is_corrupted_change(self, st, value):
+        is_flexible = self._mutability == MutabilityType.FLEXIBLE.value
+        is_strict = self._mutability == MutabilityType.STRICT.value
+        not_unlocked = value['mtime'] != st.st_mtime and 'untime' not in value
+        return (is_flexible and not_unlocked) or is_strict
+
     def _update_file_status(self, cache, filepath, fullpath, scid, st, value):
         status = Status.a.name
         prev_hash = value['hash']
         scid_ret = scid
-        is_flexible = self._mutability == MutabilityType.FLEXIBLE.value
-        is_strict = self._mutability == MutabilityType.STRICT.value
-        not_unlocked = value['mtime'] != st.st_mtime and 'untime' not in value
         bare_mode = os.path.exists(os.path.join(self._path, 'metadata', self._spec, 'bare'))
-        if (is_flexible and not_unlocked) or is_strict:
+        if self._is_corrupted_change(st, value):
             status = Status.c.name
             prev_hash = None
             scid_ret = None
@@ -336,6 +578,36 @@ class FullIndex(object):
         return len(self.get_index())
 
 
+def stat_fingerprint(st, now_ns=None):
+    """Returns the fingerprint of the stat st of a file, or None if the file is racily clean: it was modified less than
+    RACY_CLEAN_WINDOW_NS before now_ns, so it may still change without changing its stat."""
+    now_ns = time.time_ns() if now_ns is None else now_ns
+    if now_ns - st.st_mtime_ns < RACY_CLEAN_WINDOW_NS:
+        return None
+    return [st.st_mtime_ns, st.st_ctime_ns, st.st_ino, st.st_dev]
+
+
+def compare_stat(value, st):
+    """Compares the stat st of a file to the stat recorded in its entry value of the index."""
+    if 'size' in value and value['size'] != st.st_size:
+        return StatChange.MODIFIED
+    if STAT_KEY in value:
+        fingerprint = value[STAT_KEY]
+        if fingerprint is not None and list(fingerprint) == [st.st_mtime_ns, st.st_ctime_ns, st.st_ino, st.st_dev]:
+            return StatChange.UNCHANGED
+        return StatChange.UNKNOWN
+    # entries written before the stat cache
+    if value.get('ctime') == st.st_ctime and value.get('mtime') == st.st_mtime:
+        return StatChange.UNCHANGED
+    return StatChange.UNKNOWN
+
+
+class StatChange(Enum):
+    UNCHANGED = 1
+    MODIFIED = 2
+    UNKNOWN = 3
+
+
 class Status(Enum):
     u = 1
     a = 2
@@ -3,9 +3,9 @@
 SPDX-License-Identifier: GPL-2.0-only
 """
 
-import bisect
 import csv
 import filecmp
+import itertools
 import json
 import os
 import shutil
@@ -18,14 +18,19 @@ from tqdm import tqdm
 
 from ml_git import log
 from ml_git.config import get_index_path, get_objects_path, get_refs_path, get_index_metadata_path, \
-    get_metadata_path, get_batch_size, get_push_threads_count
+    get_metadata_path, get_batch_size, get_push_threads_count, get_descriptor_format, get_chunk_verification, \
+    get_objects_index, get_index_format, get_scan_cache
 from ml_git.constants import LOCAL_REPOSITORY_CLASS_NAME, STORAGE_FACTORY_CLASS_NAME, REPOSITORY_CLASS_NAME, \
     MutabilityType, StorageType, SPEC_EXTENSION, MANIFEST_FILE, INDEX_FILE, EntityType, PERFORMANCE_KEY, \
-    STORAGE_SPEC_KEY, STORAGE_CONFIG_KEY, MLGIT_IGNORE_FILE_NAME
+    STORAGE_SPEC_KEY, STORAGE_CONFIG_KEY, MLGIT_IGNORE_FILE_NAME, SCAN_CACHE_FILE
+from ml_git.compact_manifest import load_manifest, ManifestReader
 from ml_git.error_handler import error_handler
 from ml_git.file_system.cache import Cache
 from ml_git.file_system.hashfs import MultihashFS
-from ml_git.file_system.index import MultihashIndex, FullIndex, Status
+from ml_git.file_system.index import MultihashIndex, FullIndex, Status, StatChange, compare_stat
+from ml_git.file_system.objects_index import QUERY_BATCH_SIZE
+from ml_git.file_system.scanner import scan_files, ScanCache
+from ml_git.manifest_storage import remove_manifest_storage
 from ml_git.metadata import Metadata
 from ml_git.ml_git_message import output_messages
 from ml_git.pool import pool_factory, process_futures
@@ -35,7 +40,7 @@ from ml_git.spec import spec_parse, search_spec_file, get_entity_dir, get_spec_k
 from ml_git.storages.store_utils import storage_factory
 from ml_git.utils import yaml_load, ensure_path_exists, convert_path, normalize_path, \
     posix_path, set_write_read, change_mask_for_routine, run_function_per_group, get_root_path, yaml_save, \
-    get_ignore_rules, should_ignore_file
+    get_ignore_rules, compile_ignore_rules
 
 
 class LocalRepository(MultihashFS):
@@ -43,15 +48,18 @@ class LocalRepository(MultihashFS):
     def __init__(self, config, objects_path, repo_type=EntityType.DATASETS.value, block_size=256 * 1024, levels=2):
         self.is_shared_objects = repo_type in config and 'objects_path' in config[repo_type]
         with change_mask_for_routine(self.is_shared_objects):
-            super(LocalRepository, self).__init__(objects_path, block_size, levels)
+            super(LocalRepository, self).__init__(objects_path, block_size, levels, get_descriptor_format(config),
+                                                  chunk_verification=get_chunk_verification(config),
+                                                  objects_index=get_objects_index(config))
         self.__config = config
         self.__repo_type = repo_type
         self.__progress_bar = None
 
-    def _pool_push(self, ctx, obj, obj_path):
+    def _pool_push(self, ctx, obj):
         storage = ctx
         log.debug(output_messages['DEBUG_PUSH_BLOB_TO_STORAGE'] % obj, class_name=LOCAL_REPOSITORY_CLASS_NAME)
-        ret = storage.file_store(obj, obj_path)
+        with self.readable_keypath(obj) as obj_path:
+            ret = storage.file_store(obj, obj_path)
         return ret
 
     def _create_pool(self, config, storage_str, retry, pb_elts=None, pb_desc='blobs', nworkers=os.cpu_count() * 5, fail_limit=None):
@@ -85,9 +93,7 @@ class LocalRepository(MultihashFS):
 
         wp = self._create_pool(self.__config, manifest[STORAGE_SPEC_KEY], retry, len(objs), 'files', nworkers, fail_limit)
         for obj in objs:
-            # Get obj from filesystem
-            obj_path = self.get_keypath(obj)
-            wp.submit(self._pool_push, obj, obj_path)
+            wp.submit(self._pool_push, obj)
 
         futures = wp.wait()
         uploaded_files = []
@@ -159,6 +165,7 @@ class LocalRepository(MultihashFS):
         if self._exists(key) is False:
             key_path = self.get_keypath(key)
             self._fetch_ipld_remote(ctx, key, key_path)
+            self._index_key(key)
         return key
 
     def _fetch_ipld_remote(self, ctx, key, key_path):
@@ -180,20 +187,18 @@ class LocalRepository(MultihashFS):
         return key
 
     def _fetch_blob(self, ctx, key):
-        links = self.load(key)
-        for olink in links['Links']:
-            key = olink['Hash']
+        links = self.load_links(key)
+        for key in self.missing([chunk_hash for chunk_hash, _ in links]):
             log.debug(output_messages['DEBUG_GETTING_BLOB'] % key, class_name=LOCAL_REPOSITORY_CLASS_NAME)
-            if self._exists(key) is False:
-                key_path = self.get_keypath(key)
-                self._fetch_blob_remote(ctx, key, key_path)
+            key_path = self.get_keypath(key)
+            self._fetch_blob_remote(ctx, key, key_path)
+            self._index_key(key)
         return True
 
     def _fetch_blob_to_path(self, ctx, key, hash_fs):
         try:
-            links = hash_fs.load(key)
-            for olink in links['Links']:
-                key = olink['Hash']
+            links = hash_fs.load_links(key)
+            for key, _ in links:
                 log.debug(output_messages['DEBUG_GETTING_BLOB'] % key, class_name=LOCAL_REPOSITORY_CLASS_NAME)
                 if hash_fs._exists(key) is False:
                     key_path = hash_fs.get_keypath(key)
@@ -284,13 +289,14 @@ class LocalRepository(MultihashFS):
         #   2) multiple data chunks/blobs from multiple IPLD files at a time.
 
         wp_ipld = self._create_pool(self.__config, manifest[STORAGE_SPEC_KEY], retries, len(files))
-        # TODO: is that the more efficient in case the list is very large?
-        lkeys = list(files.keys())
+        lkeys = files.keys()
         with change_mask_for_routine(self.is_shared_objects):
             args = {'wp': wp_ipld}
             args['error_msg'] = 'Error to fetch ipld -- [%s]'
             args['function'] = self._fetch_ipld
-            result = run_function_per_group(lkeys, 20, function=self._fetch_batch, arguments=args)
+            ipld_keys = self._iter_missing(lkeys, wp_ipld)
+            result = run_function_per_group(ipld_keys, 20, function=self._fetch_batch, arguments=args)
+            # _fetch_ipld skips the keys fetched before the error
             if not result and self._handle_fetch_error(lkeys, result, args) != 0:
                 return False
             wp_ipld.progress_bar_close()
@@ -309,12 +315,22 @@ class LocalRepository(MultihashFS):
 
         return True
 
+    def _iter_missing(self, keys, wp):
+        """Yields the keys which are not in the objects, checking them by batches, and removes the other keys from the
+        progress bar total of wp."""
+        keys = iter(keys)
+        for batch in iter(lambda: list(itertools.islice(keys, QUERY_BATCH_SIZE)), []):
+            missing = self.missing(batch)
+            wp.progress_bar_total_inc(len(missing) - len(batch))
+            yield from missing
+
     def _update_cache(self, cache, key):
         # determine whether file is already in cache, if not, get it
         if cache.exists(key) is False:
             cfile = cache.get_keypath(key)
             ensure_path_exists(os.path.dirname(cfile))
-            super().get(key, cfile)
+            # single chunk files are cloned from the objects, without copying their data where reflinks are supported
+            super().get(key, cfile, clone_single_chunk=True)
 
     def _update_links_wspace(self, key, status, args):
         # for all concrete files specified in manifest, create a hard link into workspace
@@ -333,19 +349,17 @@ class LocalRepository(MultihashFS):
             args['fidx'].update_full_index(file, file_path, status, key)
 
     def _remove_unused_links_wspace(self, ws_path, mfiles):
-        for root, dirs, files in os.walk(ws_path):
-            relative_path = root[len(ws_path) + 1:]
-
-            for file in files:
-                if 'README.md' in file:
-                    continue
-                if SPEC_EXTENSION in file:
-                    continue
-                full_posix_path = Path(relative_path, file).as_posix()
-                if full_posix_path not in mfiles:
-                    set_write_read(os.path.join(root, file))
-                    os.unlink(os.path.join(root, file))
-                    log.debug(output_messages['DEBUG_REMOVING_FILE'] % full_posix_path, class_name=LOCAL_REPOSITORY_CLASS_NAME)
+        for file_path, _ in scan_files(ws_path):
+            file = os.path.basename(file_path)
+            if 'README.md' in file:
+                continue
+            if SPEC_EXTENSION in file:
+                continue
+            full_posix_path = Path(file_path).as_posix()
+            if full_posix_path not in mfiles:
+                set_write_read(os.path.join(ws_path, file_path))
+                os.unlink(os.path.join(ws_path, file_path))
+                log.debug(output_messages['DEBUG_REMOVING_FILE'] % full_posix_path, class_name=LOCAL_REPOSITORY_CLASS_NAME)
 
     @staticmethod
     def _update_metadata(full_md_path, ws_path, spec_name):
@@ -357,11 +371,12 @@ class LocalRepository(MultihashFS):
             shutil.copy2(md_path, md_dst)
 
     def adding_files_into_cache(self, lkeys, args):
+        # check files are in objects ; otherwise critical error (should have been fetched at step before)
+        missing_keys = self.missing(lkeys)
+        if missing_keys:
+            log.error(output_messages['ERROR_BLOB_NOT_FOUND_EXITING'] % missing_keys[0], class_name=LOCAL_REPOSITORY_CLASS_NAME)
+            return False
         for key in lkeys:
-            # check file is in objects ; otherwise critical error (should have been fetched at step before)
-            if self._exists(key) is False:
-                log.error(output_messages['ERROR_BLOB_NOT_FOUND_EXITING'] % key, class_name=LOCAL_REPOSITORY_CLASS_NAME)
-                return False
             args['wp'].submit(self._update_cache, args['cache'], key)
         futures = args['wp'].wait()
         try:
@@ -372,13 +387,14 @@ class LocalRepository(MultihashFS):
             return False
         return True
 
-    def adding_files_into_workspace(self, lkeys, args):
-        for key in lkeys:
+    def adding_files_into_workspace(self, entries, args):
+        batch_args = dict(args, obj_files=dict(entries))
+        for key in batch_args['obj_files']:
             # check file is in objects ; otherwise critical error (should have been fetched at step before)
             if self._exists(key) is False:
                 log.error(output_messages['ERROR_BLOB_NOT_FOUND_EXITING'], class_name=LOCAL_REPOSITORY_CLASS_NAME)
                 return False
-            args['wps'].submit(self._update_links_wspace, key, Status.u.name, args)
+            args['wps'].submit(self._update_links_wspace, key, Status.u.name, batch_args)
         futures = args['wps'].wait()
         try:
             process_futures(futures, args['wps'])
@@ -389,23 +405,23 @@ class LocalRepository(MultihashFS):
         return True
 
     def _load_obj_files(self, samples, manifest_path, sampling_flag='', is_checkout=False):
-        obj_files = yaml_load(manifest_path)
         try:
             if samples is not None:
-                set_files = SampleValidate.process_samples(samples, obj_files)
+                set_files = SampleValidate.process_samples(samples, load_manifest(manifest_path))
                 if set_files is None or len(set_files) == 0:
                     return None
-                obj_files = set_files
                 if is_checkout:
                     open(sampling_flag, 'a').close()
                     log.debug(output_messages['DEBUG_FLAG_WAS_CREATED'],
                               class_name=LOCAL_REPOSITORY_CLASS_NAME)
+                return set_files
             elif os.path.exists(sampling_flag) and is_checkout:
                 os.unlink(sampling_flag)
         except Exception as e:
             log.error(e, class_name=LOCAL_REPOSITORY_CLASS_NAME)
             return None
-        return obj_files
+        # the whole manifest is used, it is read by batches as it is iterated instead of being loaded
+        return ManifestReader(manifest_path)
 
     def checkout(self, cache_path, metadata_path, ws_path, tag, samples, bare=False, entity_dir=None, fail_limit=None):
         _, spec_name, version = spec_parse(tag)
@@ -416,11 +432,8 @@ class LocalRepository(MultihashFS):
         mutability, _ = self.get_mutability_from_spec(spec_name, self.__repo_type, entity_dir)
         index_manifest_path = os.path.join(index_path, 'metadata', spec_name)
         fidx_path = os.path.join(index_manifest_path, INDEX_FILE)
-        try:
-            os.unlink(fidx_path)
-        except FileNotFoundError:
-            pass
-        fidx = FullIndex(spec_name, index_path, mutability)
+        remove_manifest_storage(fidx_path)
+        fidx = FullIndex(spec_name, index_path, mutability, get_index_format(self.__config))
         # copy all files defined in manifest from objects to cache (if not there yet) then hard links to workspace
         mfiles = {}
 
@@ -428,7 +441,7 @@ class LocalRepository(MultihashFS):
         obj_files = self._load_obj_files(samples, manifest_path, sampling_flag, True)
         if obj_files is None:
             return False
-        lkey = list(obj_files)
+        lkey = obj_files.keys()
 
         if not bare:
             cache = None
@@ -445,12 +458,12 @@ class LocalRepository(MultihashFS):
             wps = pool_factory(pb_elts=len(lkey), pb_desc='files into workspace', fail_limit=fail_limit)
             args = {'wps': wps, 'cache': cache, 'fidx': fidx, 'ws_path': ws_path, 'mfiles': mfiles,
                     'obj_files': obj_files, 'mutability': mutability}
-            if not run_function_per_group(lkey, 20, function=self.adding_files_into_workspace, arguments=args):
+            if not run_function_per_group(obj_files.items(), 20, function=self.adding_files_into_workspace, arguments=args):
                 return
             wps.progress_bar_close()
         else:
-            args = {'fidx': fidx, 'ws_path': ws_path, 'obj_files': obj_files}
-            run_function_per_group(lkey, 20, function=self._update_index_bare_mode, arguments=args)
+            args = {'fidx': fidx, 'ws_path': ws_path}
+            run_function_per_group(obj_files.items(), 20, function=self._update_index_bare_mode, arguments=args)
 
         fidx.save_manifest_index()
         # Check files that have been removed (present in wskpace and not in MANIFEST)
@@ -468,16 +481,15 @@ class LocalRepository(MultihashFS):
         elif os.path.exists(bare_path):
             os.unlink(bare_path)
 
-    def _update_index_bare_mode(self, lkeys, args):
-        for key in lkeys:
-            [args['fidx'].update_full_index(file, args['ws_path'], Status.u.name, key) for file in
-             args['obj_files'][key]]
+    def _update_index_bare_mode(self, entries, args):
+        for key, files in entries:
+            [args['fidx'].update_full_index(file, args['ws_path'], Status.u.name, key) for file in files]
 
     def _pool_remote_fsck_ipld(self, ctx, obj):
         storage = ctx
         log.debug(output_messages['DEBUG_CHECK_IPLD'] % obj, class_name=LOCAL_REPOSITORY_CLASS_NAME)
-        obj_path = self.get_keypath(obj)
-        ret = storage.file_store(obj, obj_path)
+        with self.readable_keypath(obj) as obj_path:
+            ret = storage.file_store(obj, obj_path)
         return ret
 
     def _pool_remote_fsck_blob(self, ctx, obj):
@@ -486,12 +498,11 @@ class LocalRepository(MultihashFS):
             return {None: None}
 
         rets = []
-        links = self.load(obj)
-        for olink in links['Links']:
-            key = olink['Hash']
+        links = self.load_links(obj)
+        for key, _ in links:
             storage = ctx
-            obj_path = self.get_keypath(key)
-            ret = storage.file_store(key, obj_path)
+            with self.readable_keypath(key) as obj_path:
+                ret = storage.file_store(key, obj_path)
             rets.append(ret)
         return rets
 
@@ -523,13 +534,12 @@ class LocalRepository(MultihashFS):
         log.info(output_messages['INFO_PARANOID_MODE_ACTIVE'], class_name=STORAGE_FACTORY_CLASS_NAME)
         total_corrupted_files = 0
 
-        for i in range(0, len(lkeys), batch_size):
+        keys = iter(lkeys)
+        for batch in iter(lambda: list(itertools.islice(keys, batch_size)), []):
             with tempfile.TemporaryDirectory() as tmp_dir:
                 temp_hash_fs = MultihashFS(tmp_dir)
-                self._work_pool_to_submit_file(manifest, retries, lkeys[i:batch_size + i], self._fetch_ipld_to_path,
-                                               temp_hash_fs)
-                self._work_pool_to_submit_file(manifest, retries, lkeys[i:batch_size + i], self._fetch_blob_to_path,
-                                               temp_hash_fs)
+                self._work_pool_to_submit_file(manifest, retries, batch, self._fetch_ipld_to_path, temp_hash_fs)
+                self._work_pool_to_submit_file(manifest, retries, batch, self._fetch_blob_to_path, temp_hash_fs)
                 corrupted_files = self._remote_fsck_check_integrity(tmp_dir)
                 len_corrupted_files = len(corrupted_files)
                 if len_corrupted_files > 0:
@@ -606,15 +616,14 @@ class LocalRepository(MultihashFS):
         # get all files for specific tag
         entity_dir = get_entity_dir(self.__repo_type, spec_name, root_path=metadata_path)
         manifest_path = os.path.join(metadata_path, entity_dir, MANIFEST_FILE)
-        obj_files = yaml_load(manifest_path)
+        obj_files = ManifestReader(manifest_path)
 
         storage = storage_factory(self.__config, manifest[STORAGE_SPEC_KEY])
         if storage is None:
             log.error(output_messages['ERROR_WITHOUT_STORAGE'] % (manifest[STORAGE_SPEC_KEY]), class_name=LOCAL_REPOSITORY_CLASS_NAME)
             return -2
 
-        # TODO: is that the more efficient in case the list is very large?
-        lkeys = list(obj_files.keys())
+        lkeys = obj_files.keys()
 
         if paranoid:
             try:
@@ -696,7 +705,7 @@ class LocalRepository(MultihashFS):
             log.error(e, class_name=REPOSITORY_CLASS_NAME)
             return
 
-        idx = MultihashIndex(spec, index_path, objects_path)
+        idx = MultihashIndex(spec, index_path, objects_path, index_format=get_index_format(self.__config))
         idx_yaml = idx.get_index_yaml()
         corrupted_files = []
         idx_yaml_mf = idx_yaml.get_manifest_index()
@@ -704,12 +713,12 @@ class LocalRepository(MultihashFS):
         self.__progress_bar = tqdm(total=len(idx_yaml_mf.load()), desc='files', unit='files', unit_scale=True,
                                    mininterval=1.0)
         for key in idx_yaml_mf:
-            if idx_yaml_mf[key]['status'] == Status.c.name:
-                bisect.insort(corrupted_files, normalize_path(key))
+            if idx_yaml_mf.lookup(key)['status'] == Status.c.name:
+                corrupted_files.append(normalize_path(key))
             self.__progress_bar.update(1)
         self.__progress_bar.close()
 
-        return corrupted_files
+        return sorted(corrupted_files)
 
     def status(self, spec, status_directory='', log_errors=True):
         try:
@@ -743,7 +752,7 @@ class LocalRepository(MultihashFS):
             return
 
         # All files in MANIFEST.yaml in the index AND all files in datapath which stats links == 1
-        idx = MultihashIndex(spec, index_path, objects_path)
+        idx = MultihashIndex(spec, index_path, objects_path, index_format=get_index_format(self.__config))
         idx_yaml = idx.get_index_yaml()
         untracked_files = []
         changed_files = []
@@ -755,50 +764,56 @@ class LocalRepository(MultihashFS):
 
         if path is not None:
             changed_files, untracked_files = \
-                self._get_workspace_files_status(all_files, full_metadata_path, idx_yaml_mf,
+                self._get_workspace_files_status(all_files, full_metadata_path, idx_yaml,
                                                  index_metadata_entity_path,
                                                  path, new_files, status_directory)
         if tag:
             metadata.checkout()
-        return new_files, deleted_files, untracked_files, corrupted_files, changed_files
+        # the files are collected unsorted, they are only sorted once here
+        return sorted(new_files), sorted(deleted_files), sorted(untracked_files), sorted(corrupted_files), \
+            sorted(changed_files)
 
-    def _get_workspace_files_status(self, all_files, full_metadata_path, idx_yaml_mf,
+    def _get_workspace_files_status(self, all_files, full_metadata_path, idx_yaml,
                                     index_metadata_entity_path, path,
                                     new_files, status_directory=''):
         changed_files = []
         untracked_files = []
-        ignore_rules = get_ignore_rules(path)
-        for root, dirs, files in os.walk(path):
-            base_path = root[len(path) + 1:]
-            base_path_with_separator = base_path + os.path.sep
-
-            if (status_directory and not base_path_with_separator.startswith(status_directory + os.path.sep)) \
-                    or should_ignore_file(ignore_rules, '{}/'.format(base_path)):
-                continue
+        refreshed = False
+        idx_yaml_mf = idx_yaml.get_manifest_index()
+        ignore_rules = compile_ignore_rules(get_ignore_rules(path))
+        ignore = ignore_rules.ignores if ignore_rules else None
+        cache = None
+        if get_scan_cache(self.__config):
+            cache = ScanCache(os.path.join(index_metadata_entity_path, SCAN_CACHE_FILE), path)
+        for file_path, stat in scan_files(path, status_directory, ignore, with_stat=True, cache=cache):
+            file = os.path.basename(file_path)
+            if file_path in all_files:
+                full_file_path = os.path.join(path, file_path)
+                file_in_index = idx_yaml_mf.lookup(posix_path(file_path))
+                change = compare_stat(file_in_index, stat)
+                if change == StatChange.MODIFIED:
+                    changed_files.append(file_path)
+                elif change == StatChange.UNKNOWN:
+                    if self.get_scid(full_file_path, file_in_index['hash']) != file_in_index['hash']:
+                        changed_files.append(file_path)
+                    else:
+                        # the file is not hashed again by the next status while it does not change
+                        idx_yaml.refresh_stat(posix_path(file_path), stat)
+                        refreshed = True
+            else:
+                is_metadata_file = SPEC_EXTENSION in file or file_path == 'README.md' or file_path == MLGIT_IGNORE_FILE_NAME
 
-            for file in files:
-                file_path = convert_path(base_path, file)
-                if should_ignore_file(ignore_rules, file_path):
-                    continue
-
-                if file_path in all_files:
-                    full_file_path = os.path.join(root, file)
-                    stat = os.stat(full_file_path)
-                    file_in_index = idx_yaml_mf[posix_path(file_path)]
-                    if file_in_index['mtime'] != stat.st_mtime and self.get_scid(full_file_path) != \
-                            file_in_index['hash']:
-                        bisect.insort(changed_files, file_path)
+                if not is_metadata_file:
+                    untracked_files.append(file_path)
                 else:
-                    is_metadata_file = SPEC_EXTENSION in file or file_path == 'README.md' or file_path == MLGIT_IGNORE_FILE_NAME
-
-                    if not is_metadata_file:
-                        bisect.insort(untracked_files, file_path)
-                    else:
-                        file_path_metadata = os.path.join(full_metadata_path, file)
-                        file_index_path = os.path.join(index_metadata_entity_path, file)
-                        full_base_path = os.path.join(root, file_path)
-                        self._compare_metadata_file(file_path, file_index_path, file_path_metadata, full_base_path,
-                                                    new_files, untracked_files)
+                    root = os.path.join(path, os.path.dirname(file_path))
+                    file_path_metadata = os.path.join(full_metadata_path, file)
+                    file_index_path = os.path.join(index_metadata_entity_path, file)
+                    full_base_path = os.path.join(root, file_path)
+                    self._compare_metadata_file(file_path, file_index_path, file_path_metadata, full_base_path,
+                                                new_files, untracked_files)
+        if refreshed:
+            idx_yaml.save_manifest_index()
         return changed_files, untracked_files
 
     def _compare_metadata_file(self, bpath, file_index_exists, file_path_metadata, full_base_path, new_files,
@@ -806,36 +821,40 @@ class LocalRepository(MultihashFS):
         if os.path.isfile(file_index_exists) and os.path.isfile(file_path_metadata):
             if self._compare_matadata(full_base_path, file_index_exists) and \
                     not self._compare_matadata(full_base_path, file_path_metadata):
-                bisect.insort(new_files, bpath)
+                new_files.append(bpath)
             elif not self._compare_matadata(full_base_path, file_index_exists):
-                bisect.insort(untracked_files, bpath)
+                untracked_files.append(bpath)
         elif os.path.isfile(file_index_exists):
             if not self._compare_matadata(full_base_path, file_index_exists):
-                bisect.insort(untracked_files, bpath)
+                untracked_files.append(bpath)
             else:
-                bisect.insort(new_files, bpath)
+                new_files.append(bpath)
         elif os.path.isfile(file_path_metadata):
             if not self._compare_matadata(full_base_path, file_path_metadata):
-                bisect.insort(untracked_files, bpath)
+                untracked_files.append(bpath)
         else:
-            bisect.insort(untracked_files, bpath)
+            untracked_files.append(bpath)
 
     def _get_index_files_status(self, bare_mode, idx_yaml_mf, path, status_directory=''):
         new_files = []
         deleted_files = []
-        all_files = []
+        all_files = set()
         corrupted_files = []
         for key in idx_yaml_mf:
+            all_files.add(normalize_path(key))
             if status_directory and not key.startswith(status_directory + '/'):
-                bisect.insort(all_files, normalize_path(key))
                 continue
             if not bare_mode and not os.path.exists(convert_path(path, key)):
-                bisect.insort(deleted_files, normalize_path(key))
-            elif idx_yaml_mf[key]['status'] == 'a' and os.path.exists(convert_path(path, key)):
-                bisect.insort(new_files, key)
-            elif idx_yaml_mf[key]['status'] == 'c' and os.path.exists(convert_path(path, key)):
-                bisect.insort(corrupted_files, normalize_path(key))
-            bisect.insort(all_files, normalize_path(key))
+                deleted_files.append(normalize_path(key))
+                continue
+            status = idx_yaml_mf.lookup(key)['status']
+            # the file is known to exist unless in bare mode
+            if status not in ('a', 'c') or (bare_mode and not os.path.exists(convert_path(path, key))):
+                continue
+            if status == 'a':
+                new_files.append(key)
+            else:
+                corrupted_files.append(normalize_path(key))
         return new_files, deleted_files, all_files, corrupted_files
 
     def import_files(self, file_object, path, directory, retry, storage_string):
@@ -880,13 +899,12 @@ class LocalRepository(MultihashFS):
 
     def unlock_file(self, path, file, index_path, objects_path, spec, cache_path):
         file_path = os.path.join(path, file)
-        idx = MultihashIndex(spec, index_path, objects_path)
+        idx = MultihashIndex(spec, index_path, objects_path, index_format=get_index_format(self.__config))
         idx_yaml = idx.get_index_yaml()
-        hash_file = idx_yaml.get_index()
         idxfs = Cache(cache_path)
 
         try:
-            cache_file = idxfs._get_hashpath(hash_file[file]['hash'])
+            cache_file = idxfs._get_hashpath(idx_yaml.get_manifest_index()[file]['hash'])
             if os.path.isfile(cache_file):
                 os.unlink(file_path)
                 shutil.copy2(cache_file, file_path)
@@ -911,9 +929,9 @@ class LocalRepository(MultihashFS):
 
         self.__config[STORAGE_CONFIG_KEY][storage_type] = {bucket_name: bucket}
 
-    def export_file(self, lkeys, args):
-        for key in lkeys:
-            args['wp'].submit(self._upload_file, args['store_dst'], key, args['files'][key])
+    def export_file(self, entries, args):
+        for key, files in entries:
+            args['wp'].submit(self._upload_file, args['store_dst'], key, files)
         export_futures = args['wp'].wait()
         try:
             process_futures(export_futures, args['wp'])
@@ -949,14 +967,13 @@ class LocalRepository(MultihashFS):
             return
         manifest_file = MANIFEST_FILE
         manifest_path = os.path.join(metadata_path, entity_dir, manifest_file)
-        files = yaml_load(manifest_path)
+        files = ManifestReader(manifest_path)
         log.info(output_messages['INFO_EXPORTING_TAG'] % (tag, manifest[STORAGE_SPEC_KEY], storage_dst_type),
                  class_name=LOCAL_REPOSITORY_CLASS_NAME)
         wp_export_file = pool_factory(ctx_factory=lambda: storage, retry=retry, pb_elts=len(files), pb_desc='files')
 
-        lkeys = list(files.keys())
-        args = {'wp': wp_export_file, 'store_dst': storage_dst, 'files': files}
-        result = run_function_per_group(lkeys, 20, function=self.export_file, arguments=args)
+        args = {'wp': wp_export_file, 'store_dst': storage_dst}
+        result = run_function_per_group(files.items(), 20, function=self.export_file, arguments=args)
         if not result:
             return
         wp_export_file.progress_bar_close()
@@ -8,49 +8,73 @@ import humanize
 from halo import Halo
 
 from ml_git import log
-from ml_git.constants import HASH_FS_CLASS_NAME, STORAGE_LOG
+from ml_git.constants import HASH_FS_CLASS_NAME, STORAGE_LOG, DescriptorFormat, ChunkVerification, ADDED_LINKS_FILE
 from ml_git.file_system.hashfs import MultihashFS
-from ml_git.file_system.index import FullIndex, Status
+from ml_git.file_system.index import FullIndex, Status, load_added_links
 from ml_git.ml_git_message import output_messages
-from ml_git.utils import yaml_load, remove_unnecessary_files
+from ml_git.utils import remove_unnecessary_files
+
+# the storage log of a commit is written by large sequential writes
+STORAGE_LOG_BUFFER_SIZE = 1024 * 1024
 
 
 class Objects(MultihashFS):
-    def __init__(self, spec, objects_path, blocksize=256*1024, levels=2):
+    def __init__(self, spec, objects_path, blocksize=256*1024, levels=2, descriptor_format=DescriptorFormat.JSON.value,
+                 chunk_verification=ChunkVerification.ALWAYS.value, objects_index=False, pack_threshold=0):
         self.__spec = spec
         self._objects_path = objects_path
-        super(Objects, self).__init__(objects_path, blocksize, levels)
+        super(Objects, self).__init__(objects_path, blocksize, levels, descriptor_format,
+                                      chunk_verification=chunk_verification, objects_index=objects_index,
+                                      pack_threshold=pack_threshold)
 
     def commit_index(self, index_path, ws_path=None):
         return self.commit_objects(index_path, ws_path)
 
     @Halo(text='Updating index', spinner='dots')
     def commit_objects(self, index_path, ws_path):
+        """Marks the files added to the index as committed and writes their objects to the storage log. The chunks of
+        the objects are the ones recorded by the add in ADDED_LINKS_FILE, only the objects missing from it are read."""
         added_files = []
         deleted_files = []
-        idx = MultihashFS(self._objects_path)
         fidx = FullIndex(self.__spec, index_path)
         findex = fidx.get_index()
+        links_path = os.path.join(index_path, 'metadata', self.__spec, ADDED_LINKS_FILE)
+        added_links = load_added_links(links_path)
+        logged_keys = set()
         log_path = os.path.join(self._logpath, STORAGE_LOG)
-        with open(log_path, 'a') as log_file:
+        with open(log_path, 'a', buffering=STORAGE_LOG_BUFFER_SIZE) as log_file:
             for k, v in findex.items():
                 if not os.path.exists(os.path.join(ws_path, k)):
                     deleted_files.append(k)
                 elif v['status'] == Status.a.name:
-                    idx.fetch_scid(v['hash'], log_file)
+                    self._log_added(v['hash'], added_links, logged_keys, log_file)
                     v['status'] = Status.u.name
                     if 'previous_hash' in v:
                         added_files.append((v['previous_hash'], k))
         fidx.get_manifest_index().save()
+        try:
+            os.unlink(links_path)
+        except FileNotFoundError:
+            pass
         return added_files, deleted_files
 
+    def _log_added(self, key, added_links, logged_keys, log_file):
+        # an object shared by several files is logged once
+        if key in logged_keys:
+            return
+        logged_keys.add(key)
+        chunks = added_links.get(key)
+        if chunks is None or not self._exists(key):
+            self.fetch_scid(key, log_file)
+            return
+        log_file.write('%s\n' % key)
+        log_file.writelines('%s\n' % chunk for chunk in chunks)
+
     def _get_used_blobs(self, descriptor_hashes):
         used_blobs = []
         for file in descriptor_hashes:
-            descriptor_path = self._get_hashpath(file)
-            descriptor = yaml_load(descriptor_path)
-            for hash in descriptor['Links']:
-                used_blobs.append(hash['Hash'])
+            for chunk_hash, _ in self.load_links(file):
+                used_blobs.append(chunk_hash)
         used_blobs.extend(descriptor_hashes)
         return used_blobs
 
@@ -58,5 +82,12 @@ class Objects(MultihashFS):
         used_blobs = self._get_used_blobs(blobs_hashes)
         count_removed_objects, reclaimed_objects_space = remove_unnecessary_files(used_blobs,
                                                                                   os.path.join(self._objects_path, HASH_FS_CLASS_NAME.lower()))
+        if os.path.exists(self._descriptors_path):
+            remove_unnecessary_files(blobs_hashes, self._descriptors_path)
+        objects_index = self._stored_objects_index()
+        if objects_index is not None:
+            objects_index.retain(used_blobs)
+        # the space of the packed objects removed is reclaimed by repack
+        count_removed_objects += self._packs.retain(used_blobs)
         log.debug(output_messages['INFO_REMOVED_FILES'] % (humanize.intword(count_removed_objects), self._objects_path))
         return count_removed_objects, reclaimed_objects_space
@@ -0,0 +1,106 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import sqlite3
+import threading
+
+from ml_git import log
+from ml_git.constants import HASH_FS_CLASS_NAME
+from ml_git.ml_git_message import output_messages
+
+'''Existence index of the keys stored in a MultihashFS.
+
+The index is a SQLite table of the keys written to the hashfs, so that the presence of many keys can be tested with
+a few queries instead of a stat per key. It is a cache: MultihashFS still checks the filesystem for the keys the
+index does not know, and fsck rebuilds it from the files found on disk. A key wrongly listed by the index is only
+trusted by the read-only queries (a missing object is then reported present): the writes of the hashfs check the disk,
+and gc and fsck prune the index whenever it exists, even when it is disabled in the config.'''
+
+QUERY_BATCH_SIZE = 500
+
+
+def connect_objects_db(db_path):
+    conn = sqlite3.connect(db_path, timeout=60)
+    # the database can be rebuilt from the objects at any time, durability is not needed
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+    return conn
+
+
+class ObjectsIndex(object):
+
+    def __init__(self, db_path):
+        self._db_path = db_path
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect_objects_db(self._db_path)
+            conn.execute('CREATE TABLE IF NOT EXISTS objects (key TEXT PRIMARY KEY) WITHOUT ROWID')
+            self._local.conn = conn
+        return conn
+
+    def __contains__(self, key):
+        try:
+            return self._connection().execute('SELECT 1 FROM objects WHERE key = ?', (key,)).fetchone() is not None
+        except sqlite3.Error as e:
+            log.debug(output_messages['DEBUG_OBJECTS_INDEX_ERROR'] % e, class_name=HASH_FS_CLASS_NAME)
+            return False
+
+    def add(self, key):
+        self.add_many([key])
+
+    def add_many(self, keys):
+        try:
+            conn = self._connection()
+            with conn:
+                conn.executemany('INSERT OR IGNORE INTO objects (key) VALUES (?)', ((key,) for key in keys))
+        except sqlite3.Error as e:
+            log.debug(output_messages['DEBUG_OBJECTS_INDEX_ERROR'] % e, class_name=HASH_FS_CLASS_NAME)
+
+    def missing(self, keys):
+        """Returns the keys which are not in the index, in the order they were given."""
+        keys = list(keys)
+        found = set()
+        try:
+            conn = self._connection()
+            for i in range(0, len(keys), QUERY_BATCH_SIZE):
+                batch = keys[i:i + QUERY_BATCH_SIZE]
+                query = 'SELECT key FROM objects WHERE key IN (%s)' % ','.join('?' * len(batch))
+                found.update(row[0] for row in conn.execute(query, batch))
+        except sqlite3.Error as e:
+            log.debug(output_messages['DEBUG_OBJECTS_INDEX_ERROR'] % e, class_name=HASH_FS_CLASS_NAME)
+        return [key for key in keys if key not in found]
+
+    def remove_many(self, keys):
+        try:
+            conn = self._connection()
+            with conn:
+                conn.executemany('DELETE FROM objects WHERE key = ?', ((key,) for key in keys))
+        except sqlite3.Error as e:
+            log.debug(output_messages['DEBUG_OBJECTS_INDEX_ERROR'] % e, class_name=HASH_FS_CLASS_NAME)
+
+    def retain(self, keys):
+        """Removes from the index all the keys which are not in keys."""
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute('CREATE TEMP TABLE IF NOT EXISTS retained (key TEXT PRIMARY KEY) WITHOUT ROWID')
+                conn.execute('DELETE FROM retained')
+                conn.executemany('INSERT OR IGNORE INTO retained (key) VALUES (?)', ((key,) for key in keys))
+                conn.execute('DELETE FROM objects WHERE key NOT IN (SELECT key FROM retained)')
+                conn.execute('DELETE FROM retained')
+        except sqlite3.Error as e:
+            log.warn(output_messages['WARN_OBJECTS_INDEX_NOT_UPDATED'] % e, class_name=HASH_FS_CLASS_NAME)
+
+    def rebuild(self, keys):
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute('DELETE FROM objects')
+                conn.executemany('INSERT OR IGNORE INTO objects (key) VALUES (?)', ((key,) for key in keys))
+        except sqlite3.Error as e:
+            log.warn(output_messages['WARN_OBJECTS_INDEX_NOT_UPDATED'] % e, class_name=HASH_FS_CLASS_NAME)
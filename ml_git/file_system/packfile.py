@@ -0,0 +1,271 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import os
+import re
+import struct
+import threading
+
+from ml_git import log
+from ml_git.constants import HASH_FS_CLASS_NAME, MAX_PACK_SIZE
+from ml_git.file_system.objects_index import connect_objects_db, QUERY_BATCH_SIZE
+from ml_git.ml_git_message import output_messages
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+'''Append-only pack files holding the small objects of a MultihashFS.
+
+Storing each small chunk or descriptor in its own file costs an inode, a directory entry and a full filesystem block.
+Objects below the pack threshold are instead appended to pack files, and a table of the objects database maps each
+key to the pack, offset and length of its bytes:
+
+    pack:  magic (4 bytes) | version (1 byte) | padding (3 bytes) | entry | entry | ...
+    entry: key length (2 bytes) | data length (8 bytes) | key | data
+
+Entries carry their key, so the table can always be rebuilt by scanning the packs (see MultihashFS.fsck).
+Packs are never modified in place: removing an object drops its row and records the location of its entry as
+removed, so that a rebuild does not bring it back, and repack rewrites the live entries of the packs which have dead
+space in a new pack.'''
+
+PACK_MAGIC = b'MLGP'
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct('<4sB3x')
+ENTRY = struct.Struct('<HQ')
+_PACK_NAME = re.compile(r'^pack-(\d+)\.pack$')
+
+
+class PackStore(object):
+
+    def __init__(self, path, db_path, max_pack_size=MAX_PACK_SIZE):
+        self._path = path
+        self._db_path = db_path
+        self._max_pack_size = max_pack_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._current_pack = None
+        self._active = os.path.isdir(path)
+
+    @property
+    def active(self):
+        """True once a pack was written, until then the store is never queried. The packs directory is looked for
+        again while inactive, another instance or process may have written the first pack since."""
+        if not self._active:
+            self._active = os.path.isdir(self._path)
+        return self._active
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect_objects_db(self._db_path)
+            conn.execute('CREATE TABLE IF NOT EXISTS packed (key TEXT PRIMARY KEY, pack TEXT NOT NULL, '
+                         'offset INTEGER NOT NULL, length INTEGER NOT NULL) WITHOUT ROWID')
+            conn.execute('CREATE TABLE IF NOT EXISTS removed_packed (pack TEXT NOT NULL, offset INTEGER NOT NULL, '
+                         'PRIMARY KEY (pack, offset)) WITHOUT ROWID')
+            self._local.conn = conn
+        return conn
+
+    def _pack_path(self, pack):
+        return os.path.join(self._path, pack)
+
+    def _pack_names(self):
+        if not os.path.isdir(self._path):
+            return []
+        packs = [name for name in os.listdir(self._path) if _PACK_NAME.match(name)]
+        return sorted(packs, key=lambda name: int(_PACK_NAME.match(name).group(1)))
+
+    def _new_pack(self):
+        packs = self._pack_names()
+        number = int(_PACK_NAME.match(packs[-1]).group(1)) + 1 if packs else 0
+        pack = 'pack-%08d.pack' % number
+        with open(self._pack_path(pack), 'ab') as f:
+            f.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION))
+        return pack
+
+    def _writable_pack(self):
+        if self._current_pack is None:
+            packs = self._pack_names()
+            self._current_pack = packs[-1] if packs else None
+        if self._current_pack is None or os.path.getsize(self._pack_path(self._current_pack)) >= self._max_pack_size:
+            self._current_pack = self._new_pack()
+        return self._current_pack
+
+    def _append(self, key, data):
+        """Appends an entry to the current pack and returns the pack and offset of its data."""
+        pack = self._writable_pack()
+        encoded_key = key.encode()
+        with open(self._pack_path(pack), 'ab') as f:
+            if fcntl is not None:
+                # several processes may append to the same pack
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            offset = f.seek(0, os.SEEK_END)
+            f.write(ENTRY.pack(len(encoded_key), len(data)))
+            f.write(encoded_key)
+            f.write(data)
+        return pack, offset + ENTRY.size + len(encoded_key)
+
+    def put(self, key, data):
+        """Stores data under key. Returns the pack it was appended to, or None if key was already packed."""
+        with self._lock:
+            if not self.active:
+                os.makedirs(self._path, exist_ok=True)
+                self._active = True
+            elif self.locate(key) is not None:
+                return None
+            pack, offset = self._append(key, data)
+            conn = self._connection()
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO packed (key, pack, offset, length) VALUES (?, ?, ?, ?)',
+                             (key, pack, offset, len(data)))
+        return pack
+
+    def locate(self, key):
+        """Returns the (pack path, offset, length) of the bytes of key, or None if key is not packed."""
+        if not self.active:
+            return None
+        row = self._connection().execute('SELECT pack, offset, length FROM packed WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return self._pack_path(row[0]), row[1], row[2]
+
+    def __contains__(self, key):
+        return self.locate(key) is not None
+
+    def read(self, key):
+        location = self.locate(key)
+        if location is None:
+            return None
+        pack_path, offset, length = location
+        with open(pack_path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def keys(self):
+        if not self.active:
+            return []
+        return [row[0] for row in self._connection().execute('SELECT key FROM packed')]
+
+    def missing(self, keys):
+        """Returns the keys which are not packed, in the order they were given."""
+        keys = list(keys)
+        if not self.active:
+            return keys
+        found = set()
+        conn = self._connection()
+        for i in range(0, len(keys), QUERY_BATCH_SIZE):
+            batch = keys[i:i + QUERY_BATCH_SIZE]
+            query = 'SELECT key FROM packed WHERE key IN (%s)' % ','.join('?' * len(batch))
+            found.update(row[0] for row in conn.execute(query, batch))
+        return [key for key in keys if key not in found]
+
+    def remove_many(self, keys):
+        if not self.active:
+            return
+        conn = self._connection()
+        with conn:
+            keys = [(key,) for key in keys]
+            conn.executemany('INSERT OR IGNORE INTO removed_packed (pack, offset) '
+                             'SELECT pack, offset FROM packed WHERE key = ?', keys)
+            conn.executemany('DELETE FROM packed WHERE key = ?', keys)
+
+    def retain(self, keys):
+        """Removes all the packed objects whose key is not in keys. Returns the number of objects removed.
+        The space they use in the packs is only reclaimed by compact."""
+        if not self.active:
+            return 0
+        conn = self._connection()
+        with conn:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS retained_packed (key TEXT PRIMARY KEY) WITHOUT ROWID')
+            conn.execute('DELETE FROM retained_packed')
+            conn.executemany('INSERT OR IGNORE INTO retained_packed (key) VALUES (?)', ((key,) for key in keys))
+            conn.execute('INSERT OR IGNORE INTO removed_packed (pack, offset) SELECT pack, offset FROM packed '
+                         'WHERE key NOT IN (SELECT key FROM retained_packed)')
+            removed = conn.execute('DELETE FROM packed WHERE key NOT IN (SELECT key FROM retained_packed)').rowcount
+            conn.execute('DELETE FROM retained_packed')
+        return removed
+
+    def scan(self):
+        """Yields the (key, (pack, offset, length), data) of every entry found in the pack files, except the entries
+        of the removed objects. The entries left behind by an interrupted or duplicated put are included."""
+        removed = set(self._connection().execute('SELECT pack, offset FROM removed_packed')) if self.active else set()
+        for pack in self._pack_names():
+            with open(self._pack_path(pack), 'rb') as f:
+                header = f.read(PACK_HEADER.size)
+                if len(header) < PACK_HEADER.size or PACK_HEADER.unpack(header) != (PACK_MAGIC, PACK_VERSION):
+                    log.debug(output_messages['DEBUG_INVALID_PACK'] % pack, class_name=HASH_FS_CLASS_NAME)
+                    continue
+                offset = PACK_HEADER.size
+                while True:
+                    entry = f.read(ENTRY.size)
+                    if len(entry) < ENTRY.size:
+                        break
+                    key_length, length = ENTRY.unpack(entry)
+                    key = f.read(key_length)
+                    data = f.read(length)
+                    # an append interrupted before its end leaves a truncated entry at the end of the pack
+                    if len(key) < key_length or len(data) < length:
+                        break
+                    data_offset = offset + ENTRY.size + key_length
+                    if (pack, data_offset) not in removed:
+                        yield key.decode(errors='replace'), (pack, data_offset, length), data
+                    offset = data_offset + length
+
+    def rebuild(self, entries):
+        """Replaces the table of packed objects by entries, a list of (key, (pack, offset, length)).
+        The first entry of a key wins."""
+        if not self.active:
+            return
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM packed')
+            conn.executemany('INSERT OR IGNORE INTO packed (key, pack, offset, length) VALUES (?, ?, ?, ?)',
+                             ((key,) + location for key, location in entries))
+
+    def compact(self):
+        """Rewrites the live entries of the packs which have dead space in new packs and removes the old packs.
+        Returns the number of bytes reclaimed."""
+        if not self.active:
+            return 0
+        with self._lock:
+            conn = self._connection()
+            live_sizes = dict(conn.execute('SELECT pack, SUM(length + LENGTH(CAST(key AS BLOB)) + ?) FROM packed '
+                                           'GROUP BY pack', (ENTRY.size,)))
+            candidates = []
+            for pack in self._pack_names():
+                size = os.path.getsize(self._pack_path(pack))
+                if live_sizes.get(pack, 0) + PACK_HEADER.size < size:
+                    candidates.append((pack, size))
+            if not candidates:
+                return 0
+            # live entries never go back to a pack being compacted
+            self._current_pack = self._new_pack()
+            reclaimed = 0
+            for pack, size in candidates:
+                written = self._rewrite_live_entries(conn, pack)
+                os.remove(self._pack_path(pack))
+                with conn:
+                    conn.execute('DELETE FROM removed_packed WHERE pack = ?', (pack,))
+                reclaimed += size - written
+            return reclaimed
+
+    def _rewrite_live_entries(self, conn, pack):
+        rows = conn.execute('SELECT key, offset, length FROM packed WHERE pack = ? ORDER BY offset', (pack,)).fetchall()
+        moved = []
+        written = 0
+        with open(self._pack_path(pack), 'rb') as f:
+            for key, offset, length in rows:
+                f.seek(offset)
+                data = f.read(length)
+                new_pack, new_offset = self._append(key, data)
+                moved.append((new_pack, new_offset, key))
+                written += ENTRY.size + len(key.encode()) + length
+        for new_pack in {new_pack for new_pack, _, _ in moved}:
+            with open(self._pack_path(new_pack), 'rb') as f:
+                os.fsync(f.fileno())
+        with conn:
+            conn.executemany('UPDATE packed SET pack = ?, offset = ? WHERE key = ?', moved)
+        return written
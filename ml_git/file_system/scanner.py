@@ -0,0 +1,205 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent import futures
+
+from ml_git.constants import RACY_CLEAN_WINDOW_NS
+
+'''Parallel scan of the files of a directory tree.
+
+Each directory is listed with os.scandir by a thread of a pool, and its subdirectories are submitted to the pool as
+soon as they are found, so that the latency of the listings (and of the stats, when they are needed) overlaps on network
+filesystems. The type of the entries comes from the listing itself, no stat is done to tell files from directories.
+
+As with os.walk, symbolic links to directories are not followed and directories which can't be listed are skipped.
+
+A ScanCache keeps the listing of each directory along with its mtime between two scans (and two runs of ml-git), so
+that a directory whose mtime did not change costs a stat instead of a listing. The mtime of a directory only tells
+whether entries were added, removed or renamed in it: the files themselves are still stat'ed when with_stat is set,
+and every directory of the tree is still visited. The cache is only used while its token, the path, device and inode
+of the scanned directory, matches; any other token (or a missing or unreadable cache) means a full scan.'''
+
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+SCAN_CACHE_VERSION = 1
+
+
+def _scan_token(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [SCAN_CACHE_VERSION, os.path.abspath(path), st.st_dev, st.st_ino]
+
+
+class ScanCache(object):
+    """Listings of the directories of the tree of path, persisted in the json file cache_path."""
+
+    def __init__(self, cache_path, path):
+        self._cache_path = cache_path
+        self._path = path
+        self._token = _scan_token(path)
+        self._lock = threading.Lock()
+        self._changed = False
+        self._dirs = self._load()
+
+    def _load(self):
+        try:
+            with open(self._cache_path) as cache_file:
+                cache = json.load(cache_file)
+            if self._token is not None and cache['token'] == self._token:
+                return cache['dirs']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        self._changed = True
+        return {}
+
+    def listing(self, relative_dir, mtime_ns):
+        """Returns the (file names, directory names) of relative_dir if its mtime is still mtime_ns, None otherwise."""
+        entry = self._dirs.get(relative_dir)
+        if entry is None or entry[0] != mtime_ns:
+            return None
+        return entry[1], entry[2]
+
+    def record(self, relative_dir, mtime_ns, files, dirs, now_ns=None):
+        """Keeps the listing of relative_dir, read when its mtime was mtime_ns. As for the stat of a racily clean
+        file, the listing of a directory modified just before it was read is not kept."""
+        now_ns = time.time_ns() if now_ns is None else now_ns
+        with self._lock:
+            if now_ns - mtime_ns < RACY_CLEAN_WINDOW_NS:
+                if self._dirs.pop(relative_dir, None) is not None:
+                    self._changed = True
+                return
+            self._dirs[relative_dir] = [mtime_ns, files, dirs]
+            self._changed = True
+
+    def _roots(self):
+        """Returns the directories whose parent is not cached: the root of the tree, and the subdirectories scanned
+        without it (e.g. by a status of a directory) which are still in the tree."""
+        roots = []
+        for relative_dir in self._dirs:
+            if relative_dir == '':
+                roots.append(relative_dir)
+            elif os.path.dirname(relative_dir) not in self._dirs and os.path.isdir(os.path.join(self._path, relative_dir)):
+                roots.append(relative_dir)
+        return roots
+
+    def _reachable_dirs(self):
+        reachable = {}
+        pending = self._roots()
+        while pending:
+            relative_dir = pending.pop()
+            entry = self._dirs.get(relative_dir)
+            if entry is None or relative_dir in reachable:
+                continue
+            reachable[relative_dir] = entry
+            pending.extend(os.path.join(relative_dir, name) if relative_dir else name for name in entry[2])
+        return reachable
+
+    def save(self):
+        """Writes the cache if it changed, without the directories which are no longer in the tree."""
+        if not self._changed or self._token is None:
+            return
+        tmp_path = self._cache_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as cache_file:
+                json.dump({'token': self._token, 'dirs': self._reachable_dirs()}, cache_file)
+            os.replace(tmp_path, self._cache_path)
+        except OSError:
+            # the next scan is a full one
+            return
+        self._changed = False
+
+
+def _list_dir(dir_path):
+    """Returns the names of the files and of the directories (without the symbolic links to directories) of dir_path."""
+    files = []
+    dirs = []
+    try:
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    files.append(entry.name)
+                elif not entry.is_symlink():
+                    dirs.append(entry.name)
+    except OSError:
+        pass
+    return files, dirs
+
+
+def _read_dir(path, relative_dir, cache):
+    dir_path = os.path.join(path, relative_dir)
+    if cache is None:
+        return _list_dir(dir_path)
+    try:
+        # read before the listing, a change during the listing makes the cached mtime outdated
+        mtime_ns = os.stat(dir_path).st_mtime_ns
+    except OSError:
+        return [], []
+    listing = cache.listing(relative_dir, mtime_ns)
+    if listing is None:
+        listing = _list_dir(dir_path)
+        cache.record(relative_dir, mtime_ns, *listing)
+    return listing
+
+
+def _scan_dir(path, relative_dir, ignore, with_stat, cache=None):
+    file_names, dir_names = _read_dir(path, relative_dir, cache)
+    files = []
+    dirs = []
+    for name in dir_names:
+        relative_path = os.path.join(relative_dir, name) if relative_dir else name
+        if not (ignore and ignore(relative_path, True)):
+            dirs.append(relative_path)
+    for name in file_names:
+        relative_path = os.path.join(relative_dir, name) if relative_dir else name
+        if ignore and ignore(relative_path, False):
+            continue
+        stat = None
+        if with_stat:
+            try:
+                stat = os.stat(os.path.join(path, relative_path))
+            except OSError:
+                # removed while it was scanned
+                continue
+        files.append((relative_path, stat))
+    return files, dirs
+
+
+def _is_ignored_dir(relative_dir, ignore):
+    """Returns whether relative_dir or one of its parents is ignored, as if the tree had been scanned from path."""
+    parts = [part for part in relative_dir.split(os.sep) if part not in ('', os.curdir)]
+    return any(ignore(os.path.join(*parts[:i]), True) for i in range(1, len(parts) + 1))
+
+
+def scan_files(path, subdir='', ignore=None, with_stat=False, max_workers=SCAN_WORKERS, cache=None):
+    """Yields the (relative path, stat) of the files in the tree of subdir in path, in no particular order. The paths
+    are relative to path, and stat is the os.stat of the file if with_stat, None otherwise.
+
+    ignore(relative path, is_dir) is called for each entry: an ignored directory is not scanned, nor subdir if it
+    or one of its parents is ignored.
+    cache is a ScanCache of path, saved once the whole tree has been scanned."""
+    if not os.path.isdir(os.path.join(path, subdir)):
+        return
+    if subdir and ignore and _is_ignored_dir(os.path.normpath(subdir), ignore):
+        return
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        submit = executor.submit
+        pending = {submit(_scan_dir, path, os.path.normpath(subdir) if subdir else '', ignore, with_stat, cache)}
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                files, dirs = future.result()
+                pending.update(submit(_scan_dir, path, relative_dir, ignore, with_stat, cache) for relative_dir in dirs)
+                yield from files
+    if cache is not None:
+        cache.save()
@@ -5,134 +5,255 @@ SPDX-License-Identifier: GPL-2.0-only
 
 from pprint import pformat
 
-from ml_git.utils import yaml_load, yaml_save
+from ml_git.manifest_storage import get_manifest_storage
 
 
 class Manifest(object):
-    def __init__(self, manifest):
+    def __init__(self, manifest, index_format=None, journaled=False):
         self._mfpath = manifest
-        self._manifest = yaml_load(manifest)
+        self._storage = get_manifest_storage(manifest, index_format, journaled)
+        # with a lazy storage, _manifest only holds the keys read or changed so far
+        self._complete = not self._storage.lazy
+        self._manifest = {} if self._storage.lazy else self._storage.load()
+        self._changed_keys = set()
+        self._removed_keys = set()
+        self._all_changed = False
+        # reverse map of the files to the key listing them, built on first use
+        self._file_keys = None
 
-    def add(self, key, file, previous_key=None):
-        mf = self._manifest
+    def _load_all(self):
+        if not self._complete:
+            manifest = self._storage.load()
+            for key in self._removed_keys:
+                manifest.pop(key, None)
+            manifest.update(self._manifest)
+            self._manifest = manifest
+            self._complete = True
+        return self._manifest
+
+    def _lookup(self, key):
+        try:
+            return self._manifest[key]
+        except KeyError:
+            if self._complete or key in self._removed_keys:
+                raise
+        value = self._storage.get(key)
+        self._manifest[key] = value
+        return value
+
+    def _set(self, key, value):
+        self._manifest[key] = value
+        self._changed_keys.add(key)
+        self._removed_keys.discard(key)
+
+    def _files_map(self):
+        if self._file_keys is None:
+            self._file_keys = {}
+            for key, files in self._load_all().items():
+                if isinstance(files, set):
+                    for file in files:
+                        self._map_file(file, key)
+        return self._file_keys
+
+    def _map_file(self, file, key):
+        if self._file_keys is None:
+            return
+        keys = self._file_keys.get(file)
+        # a file is listed by a single key, unless it was added again without its previous key
+        if keys is None or keys == key:
+            self._file_keys[file] = key
+        elif isinstance(keys, set):
+            keys.add(key)
+        else:
+            self._file_keys[file] = {keys, key}
 
+    def _unmap_file(self, file, key):
+        if self._file_keys is None:
+            return
+        keys = self._file_keys.get(file)
+        if isinstance(keys, set):
+            keys.discard(key)
+            if len(keys) == 1:
+                self._file_keys[file] = keys.pop()
+        elif keys == key:
+            del self._file_keys[file]
+
+    def add(self, key, file, previous_key=None):
         if previous_key is not None:
             self.__rm(previous_key)
 
         try:
-            mf[key].add(file)
+            self._lookup(key).add(file)
+            self._changed_keys.add(key)
+            self._map_file(file, key)
         except Exception:
             if type(file) is dict:
-                mf[key] = file
+                self._set(key, file)
             else:
-                mf[key] = {file}
+                self._set(key, {file})
+                self._map_file(file, key)
 
     def merge(self, manifest):
-        mf = yaml_load(manifest)
-        smf = self._manifest
+        mf = Manifest(manifest).get_yaml()
 
         for k in mf:
             try:
-                smf[k] = smf[k].union(mf[k])
+                self._set(k, self._lookup(k).union(mf[k]))
             except Exception:
-                smf[k] = mf[k]
+                self._set(k, mf[k])
+            if isinstance(mf[k], set):
+                for file in mf[k]:
+                    self._map_file(file, k)
 
     def rm(self, key, file):
-        mf = self._manifest
-        if key not in mf:
+        if not self.exists(key):
             return False
         try:
-            files = mf[key]
+            files = self._lookup(key)
             if len(files) == 1:
                 self.__rm(key)
             else:
                 files.remove(file)
-                mf[key] = files
+                self._set(key, files)
+                self._unmap_file(file, key)
         except Exception as e:
             print(e)
             return False
         return True
 
     def rm_file(self, file):
-        mf = self._manifest
-        for key in mf:
-            files = mf[key]
-            if file not in files:
-                continue
-            if len(files) == 1:
-                self.__rm(key)
-            else:
-                files.remove(file)
-                mf[key] = files
-            return True
-        return False
+        keys = self._files_map().get(file)
+        if keys is None:
+            return False
+        key = next(iter(keys)) if isinstance(keys, set) else keys
+        files = self._lookup(key)
+        if len(files) == 1:
+            self.__rm(key)
+        else:
+            files.remove(file)
+            self._set(key, files)
+            self._unmap_file(file, key)
+        return True
+
+    def rm_files(self, files):
+        """Removes each file of files from the key listing it. Returns the number of files removed."""
+        return sum(1 for file in files if self.rm_file(file))
+
+    def files(self):
+        """Returns the files listed by the manifest."""
+        return list(self._files_map())
 
     def __rm(self, key):
-        mf = self._manifest
         try:
-            del(mf[key])
+            files = self._lookup(key)
+            del(self._manifest[key])
         except Exception as e:
             print(e)
             return False
+        self._changed_keys.discard(key)
+        self._removed_keys.add(key)
+        if isinstance(files, set):
+            for file in files:
+                self._unmap_file(file, key)
         return True
 
     def rm_key(self, key):
         self.__rm(key)
 
     def exists(self, key):
-        return key in self._manifest
+        try:
+            self._lookup(key)
+        except KeyError:
+            return False
+        return True
 
     def search(self, file):
-        mf = self._manifest
-        for key in mf:
-            if file in mf[key]:
-                return key
-        return None
+        keys = self._files_map().get(file)
+        if isinstance(keys, set):
+            return next(iter(keys))
+        return keys
 
     def __iter__(self):
-        for key in self._manifest.keys():
+        for key in self._load_all().keys():
             yield key
 
+    def items(self):
+        """Yields the (key, value) of the manifest without tracking them as changed, values must not be changed in
+        place."""
+        for key, value in self._load_all().items():
+            yield key, value
+
     def __getitem__(self, key):
-        return self._manifest[key]
+        value = self._lookup(key)
+        # the value may be changed in place by the caller
+        self._changed_keys.add(key)
+        return value
 
     def get(self, key):
         try:
-            return self._manifest[key]
+            return self[key]
         except Exception:
             return None
 
+    def lookup(self, key):
+        """Returns the value of key without tracking it as changed, it must not be changed in place."""
+        return self._lookup(key)
+
+    def find(self, key):
+        """Returns the value of key as lookup does, or None if key is not in the manifest."""
+        try:
+            return self._lookup(key)
+        except KeyError:
+            return None
+
+    def set(self, key, value):
+        self._set(key, value)
+
     def exists_keyfile(self, key, file):
-        mf = self._manifest
         try:
-            files = mf[key]
+            files = self._lookup(key)
             return file in files
         except Exception:
             pass
         return False
 
     def get_yaml(self):
-        return self._manifest
+        # any value of the returned dict may be changed in place by the caller
+        self._all_changed = True
+        self._file_keys = None
+        return self._load_all()
 
     def __repr__(self):
-        return pformat(self._manifest, indent=4)
+        return pformat(self._load_all(), indent=4)
 
     def save(self):
-        yaml_save(self._manifest, self._mfpath)
+        changed_keys = None if self._all_changed else self._changed_keys
+        self._storage.save(self._manifest, changed_keys, self._removed_keys)
+        self._changed_keys = set()
+        self._removed_keys = set()
+        # a dict returned by get_yaml before this save must be asked again to be changed in place
+        self._all_changed = False
 
     def load(self):
-        return yaml_load(self._mfpath)
+        return self._storage.load()
+
+    def compact(self):
+        """Writes the whole manifest, so that its storage doesn't depend on a journal."""
+        self._storage.save(self._load_all())
+        self._changed_keys = set()
+        self._removed_keys = set()
+        self._all_changed = False
 
     def get_diff(self, manifest_to_compare):
         result = {}
         filenames = set()
         for key in manifest_to_compare:
-            if key not in self._manifest:
+            if not self.exists(key):
                 result[key] = manifest_to_compare[key]
                 filenames.update(manifest_to_compare[key])
             else:
-                if manifest_to_compare[key] != self._manifest[key]:
-                    difference = manifest_to_compare[key].difference(self._manifest[key])
+                if manifest_to_compare[key] != self._lookup(key):
+                    difference = manifest_to_compare[key].difference(self._lookup(key))
                     result[key] = difference
                     filenames.update(difference)
         return result, filenames
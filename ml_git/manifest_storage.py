@@ -0,0 +1,236 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+from ml_git.constants import IndexFormat
+from ml_git.utils import yaml_load, yaml_save
+
+'''Storages of the content of a Manifest.
+
+The yaml storage is the original one: the whole file is loaded when the manifest is opened and written back on each
+save. A journaled yaml storage instead appends the keys changed by a save to a journal next to the file
+(INDEX.yaml -> INDEX.yaml.journal), replayed on load, and only rewrites the file when the journal grows too big or when
+the whole manifest may have changed.
+
+The sqlite storage keeps one row per key, next to the yaml path (INDEX.yaml -> INDEX.db), so keys are read on demand
+and a save only writes the keys which changed.
+
+Values are stored as JSON, tagged with their type, so a manifest can be moved from a storage to the other without
+losing anything (sets of files are not JSON types).'''
+
+SQLITE_EXTENSION = '.db'
+JOURNAL_EXTENSION = '.journal'
+TMP_EXTENSION = '.tmp'
+JOURNAL_MIN_COMPACT_SIZE = 1024 * 1024
+_JOURNAL_SET = 'set'
+_JOURNAL_DEL = 'del'
+_SET = 's'
+_DICT = 'd'
+_VALUE = 'v'
+
+
+def _to_json(value):
+    if isinstance(value, (set, frozenset)):
+        return _SET, sorted(value)
+    if isinstance(value, dict):
+        return _DICT, value
+    return _VALUE, value
+
+
+def _from_json(kind, value):
+    if kind == _SET:
+        return set(value)
+    return value
+
+
+def encode_value(value):
+    kind, json_value = _to_json(value)
+    return kind, json.dumps(json_value, sort_keys=True)
+
+
+def decode_value(kind, raw):
+    return _from_json(kind, json.loads(raw))
+
+
+class YamlManifestStorage(object):
+    lazy = False
+
+    def __init__(self, path, journaled=False):
+        self._path = path
+        self._journal_path = path + JOURNAL_EXTENSION
+        self._journaled = journaled
+
+    def exists(self):
+        return os.path.exists(self._path) or os.path.exists(self._journal_path)
+
+    def load(self):
+        manifest = yaml_load(self._path)
+        self._replay_journal(manifest)
+        return manifest
+
+    def _replay_journal(self, manifest):
+        try:
+            with open(self._journal_path, 'r') as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # record partially written by an interrupted save
+                        continue
+                    if record[0] == _JOURNAL_SET:
+                        manifest[record[1]] = _from_json(record[2], record[3])
+                    else:
+                        manifest.pop(record[1], None)
+        except FileNotFoundError:
+            pass
+
+    def save(self, manifest, changed_keys=None, removed_keys=()):
+        """Journals changed_keys and removed_keys. The whole manifest is written (and the journal discarded) if the
+        storage is not journaled, if changed_keys is None or if the journal is too big."""
+        if not self._journaled or changed_keys is None or self._should_compact():
+            self.compact(manifest)
+            return
+        records = [json.dumps([_JOURNAL_DEL, key]) for key in removed_keys]
+        records.extend(json.dumps([_JOURNAL_SET, key, *_to_json(manifest[key])], sort_keys=True)
+                       for key in changed_keys if key in manifest)
+        if not records:
+            return
+        with open(self._journal_path, 'a') as journal:
+            journal.write('\n'.join(records) + '\n')
+
+    def _should_compact(self):
+        try:
+            journal_size = os.path.getsize(self._journal_path)
+        except FileNotFoundError:
+            return False
+        try:
+            manifest_size = os.path.getsize(self._path)
+        except FileNotFoundError:
+            manifest_size = 0
+        return journal_size > max(JOURNAL_MIN_COMPACT_SIZE, manifest_size // 2)
+
+    def compact(self, manifest):
+        # written aside and renamed, an interrupted save leaves the previous file
+        tmp_path = self._path + TMP_EXTENSION
+        yaml_save(manifest, tmp_path)
+        os.replace(tmp_path, self._path)
+        # replaying the journal over the new file is harmless if the journal can't be removed
+        try:
+            os.unlink(self._journal_path)
+        except FileNotFoundError:
+            pass
+
+    def remove(self):
+        for path in (self._path, self._journal_path):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+class SqliteManifestStorage(object):
+    lazy = True
+
+    def __init__(self, path):
+        self._path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        # hashes of the values read, so that a save skips the keys whose value did not change
+        self._stored = {}
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self._path, timeout=60, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, kind TEXT NOT NULL, '
+                               'value TEXT NOT NULL) WITHOUT ROWID')
+        return self._conn
+
+    def exists(self):
+        return os.path.exists(self._path)
+
+    def get(self, key):
+        """Returns the value of key. Raises KeyError if key is not in the manifest."""
+        with self._lock:
+            row = self._connection().execute('SELECT kind, value FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                raise KeyError(key)
+            self._stored[key] = hash(row[1])
+        return decode_value(*row)
+
+    def load(self):
+        manifest = {}
+        with self._lock:
+            stored = {}
+            for key, kind, raw in self._connection().execute('SELECT key, kind, value FROM entries'):
+                manifest[key] = decode_value(kind, raw)
+                stored[key] = hash(raw)
+            self._stored = stored
+        return manifest
+
+    def save(self, manifest, changed_keys=None, removed_keys=()):
+        """Writes the value of changed_keys (all the keys of manifest if None) and deletes removed_keys."""
+        keys = manifest.keys() if changed_keys is None else changed_keys
+        rows = []
+        for key in keys:
+            if key not in manifest:
+                continue
+            kind, raw = encode_value(manifest[key])
+            if self._stored.get(key) != hash(raw):
+                rows.append((key, kind, raw))
+                self._stored[key] = hash(raw)
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany('DELETE FROM entries WHERE key = ?', ((key,) for key in removed_keys))
+                conn.executemany('INSERT OR REPLACE INTO entries (key, kind, value) VALUES (?, ?, ?)', rows)
+        for key in removed_keys:
+            self._stored.pop(key, None)
+
+    def remove(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._stored = {}
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.unlink(self._path + suffix)
+                except FileNotFoundError:
+                    pass
+
+
+def get_sqlite_path(yaml_path):
+    return os.path.splitext(yaml_path)[0] + SQLITE_EXTENSION
+
+
+def get_manifest_storage(yaml_path, index_format=None, journaled=False):
+    """Returns the storage of the manifest yaml_path.
+
+    Without index_format, the storage already used on disk is returned (yaml if there is none). Otherwise the
+    manifest is migrated to the storage of index_format if it is stored in the other one.
+    journaled only applies to the yaml storage."""
+    yaml_storage = YamlManifestStorage(yaml_path, journaled)
+    sqlite_storage = SqliteManifestStorage(get_sqlite_path(yaml_path))
+    if index_format is None:
+        return sqlite_storage if sqlite_storage.exists() else yaml_storage
+    if index_format == IndexFormat.SQLITE.value:
+        storage, previous_storage = sqlite_storage, yaml_storage
+    else:
+        storage, previous_storage = yaml_storage, sqlite_storage
+    if previous_storage.exists():
+        storage.save(previous_storage.load())
+        previous_storage.remove()
+    return storage
+
+
+def remove_manifest_storage(yaml_path):
+    YamlManifestStorage(yaml_path).remove()
+    SqliteManifestStorage(get_sqlite_path(yaml_path)).remove()
@@ -11,6 +11,7 @@ from halo import Halo
 
 from ml_git import log
 from ml_git._metadata import MetadataManager
+from ml_git.compact_manifest import load_manifest
 from ml_git.config import get_refs_path, get_sample_spec_doc
 from ml_git.constants import METADATA_CLASS_NAME, LOCAL_REPOSITORY_CLASS_NAME, ROOT_FILE_NAME, MutabilityType, \
     SPEC_EXTENSION, MANIFEST_FILE, EntityType, STORAGE_SPEC_KEY, DATASET_SPEC_KEY, LABELS_SPEC_KEY, \
@@ -197,7 +198,7 @@ class Metadata(MetadataManager):
 
     def _get_amount_and_size_of_workspace_files(self, full_metadata_path, ws_path):
         full_path = os.path.join(full_metadata_path, MANIFEST_FILE)
-        metadata_file = yaml_load(full_path)
+        metadata_file = load_manifest(full_path)
         amount = 0
         workspace_size = 0
         for values in metadata_file.values():
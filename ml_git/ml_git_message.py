@@ -55,9 +55,14 @@ output_messages = {
     'DEBUG_UPDATE_LOG_LIST_FILES': 'Update hashfs log with a list of files to keep',
     'DEBUG_UPDATE_LOG_KEY': 'Update log for key [%s]',
     'DEBUG_LOADING_LOG': 'Loading log file',
+    'DEBUG_OBJECTS_INDEX_ERROR': 'Objects index not available: %s',
+    'DEBUG_ADDING_PACKED_CHUNK': 'Add chunk [%s]-[%d] to pack [%s]',
+    'DEBUG_INVALID_PACK': 'Ignoring pack [%s]: invalid header',
+    'DEBUG_CHUNK_COPY_UNSUPPORTED': 'Unable to copy chunks with [%s], using the next copy method: %s',
     'DEBUG_CHUNK_ALREADY_EXISTS': 'Chunk [%s]-[%d] already exists',
     'DEBUG_ADDING_CHUNK': 'Add chunk [%s]-[%d]',
     'DEBUG_GET_CHUNK': 'Get chunk [%s]-[%d]',
+    'DEBUG_REFLINK_CHUNK': 'Reflink chunk [%s] to [%s]',
     'DEBUG_BLOB_ALREADY_COMMITED': 'Blob %s already commited',
     'DEBUG_REMOVING_FILE': 'Removing file [%s]',
     'DEBUG_ADD_FILE': 'Add file [%s] to ml-git index',
@@ -93,6 +98,8 @@ output_messages = {
     'INFO_STARTING_GC': 'Starting the garbage collector for %s',
     'INFO_REMOVED_FILES': 'A total of %s files have been removed from %s',
     'INFO_RECLAIMED_SPACE': 'Total reclaimed space %s.',
+    'INFO_STARTING_REPACK': 'Starting the repack of the objects of %s',
+    'INFO_PACKED_FILES': 'A total of %s loose objects have been moved to packs',
     'INFO_ENTITY_DELETED': 'Entity %s was deleted',
     'INFO_WRONG_ENTITY_TYPE': 'Metrics cannot be added to this entity: [%s].',
     'INFO_PROJECT_UPDATE_SUCCESSFULLY': 'Project updated successfully',
@@ -232,6 +239,7 @@ output_messages = {
     'ERROR_NOT_DISK_SPACE': 'There is not enough space in the disk. Remove some files and try again.',
     'ERROR_WHILE_CREATING_FILES': 'An error occurred while creating the files into workspace: %s \n.',
     'ERROR_INVALID_MUTABILITY_TYPE': 'Invalid mutability type.',
+    'ERROR_INVALID_CHUNKER_TYPE': 'Invalid chunker type [%s]. The supported values are: %s.',
     'ERROR_CHUNK_WRONG_DIRECTORY': 'Chunk found in wrong directory. Expected [%s]. Found [%s]',
     'ERROR_INVALID_VERSION_INCREMENT': 'Invalid version, could not increment.  File:\n     %s',
     'ERROR_INVALID_VERSION_GET': 'Invalid version, could not get.  File:\n     %s',
@@ -256,12 +264,14 @@ output_messages = {
     'ERROR_INVALID_BATCH_SIZE': 'The batch size value is invalid in the config file for the [%s] key',
     'ERROR_INVALID_STORAGE_TYPE': 'Invalid storage type.',
     'ERROR_INVALID_VALUE_IN_CONFIG': 'Invalid value in config file for the [%s] key. This is should be a integer number greater than 0.',
+    'ERROR_INVALID_OPTION_IN_CONFIG': 'Invalid value in config file for the [%s] key. The supported values are: %s.',
     'ERROR_DOWNLOADING_IPLD': 'Error download ipld [%s]',
     'ERROR_DOWNLOAD_BLOG': 'error download blob [%s]',
     'ERROR_PATH_NOT_FOUND': 'Path %s not found',
     'ERROR_BUCKET_NOT_FOUND': 'Bucket [%s] not found.',
     'ERROR_INVALID_URL': 'Invalid url: [%s]',
     'ERROR_INVALID_IPLD': 'Invalid IPLD [%s]',
+    'ERROR_INVALID_COMPACT_DESCRIPTOR': 'Invalid compact descriptor [%s]',
     'ERROR_FILE_DOWNLOAD_FAILED': 'Failed to download file id: [%s]',
     'ERROR_NOT_IN_RESPOSITORY': 'You are not in an initialized ml-git repository.',
     'ERROR_PATH_ALREAD_EXISTS': 'The path [%s] already exists and is not an empty directory.',
@@ -324,5 +334,6 @@ output_messages = {
     'WARN_WORKER_EXCEPTION': 'Worker exception - [%s] -- retry [%d]',
     'WARN_NOT_EXIST_FOR_RELATED_DOWNLOAD': 'Repository: the %s does not exist for related download.',
     'WARN_NOT_FOUND': '[%s] Not found!',
+    'WARN_OBJECTS_INDEX_NOT_UPDATED': 'Objects index could not be updated, it may list objects which were removed: %s',
     'WARN_FILE_EXISTS_IN_REPOSITORY': 'The file %s already exists in the repository. If you commit, the file will be overwritten.'
 }
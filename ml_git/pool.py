@@ -3,34 +3,72 @@
 SPDX-License-Identifier: GPL-2.0-only
 """
 
+import itertools
+import multiprocessing
 import os
-import random
-import time
 from concurrent import futures
 
 from tqdm import tqdm
 
-from ml_git import log
-from ml_git.constants import POOL_CLASS_NAME
+from ml_git import log, pool_process
+from ml_git.constants import POOL_CLASS_NAME, HashingMode
 from ml_git.error_handler import CriticalErrors
 from ml_git.ml_git_message import output_messages
 
+'''Pools of workers running the tasks of a command.
 
-def pool_factory(ctx_factory=None, nworkers=os.cpu_count() * 5, retry=2, pb_elts=None, pb_desc='units', fail_limit=None):
+A WorkerPool runs its tasks in threads, which suits the tasks waiting on the network or on the disk. For CPU bound tasks
+(hashing many small files costs more in Python code than in hashlib, which releases the GIL), it can run them in
+processes instead. The functions and arguments of the tasks must then be picklable, contexts are not supported, and
+the retries of a task are done in the process running it.'''
+
+# tasks seen before the auto hashing mode chooses processes, starting processes does not pay off for fewer tasks
+PROCESS_POOL_MIN_TASKS = 1000
+
+
+def pool_factory(ctx_factory=None, nworkers=os.cpu_count() * 5, retry=2, pb_elts=None, pb_desc='units', fail_limit=None,
+                 processes=False):
     log.debug(output_messages['DEBUG_CREATE_WORKER_POOL'] % (nworkers, retry),
               class_name=POOL_CLASS_NAME)
     ctxs = [ctx_factory() for i in range(nworkers)] if ctx_factory is not None else None
-    return WorkerPool(nworkers=nworkers, pool_ctxs=ctxs, retry=retry, pb_elts=pb_elts, pb_desc=pb_desc, fail_limit=fail_limit)
+    return WorkerPool(nworkers=nworkers, pool_ctxs=ctxs, retry=retry, pb_elts=pb_elts, pb_desc=pb_desc, fail_limit=fail_limit,
+                      processes=processes)
+
+
+def use_process_pool(hashing_mode, tasks):
+    """Tells whether tasks should run in a process pool in hashing_mode. Returns it with an iterator of the tasks,
+    since the auto mode looks ahead up to PROCESS_POOL_MIN_TASKS of them: it only uses processes for at least as many
+    tasks, with more than one CPU."""
+    tasks = iter(tasks)
+    if hashing_mode != HashingMode.AUTO.value:
+        return hashing_mode == HashingMode.PROCESSES.value, tasks
+    if (os.cpu_count() or 1) < 2:
+        return False, tasks
+    first_tasks = list(itertools.islice(tasks, PROCESS_POOL_MIN_TASKS))
+    return len(first_tasks) >= PROCESS_POOL_MIN_TASKS, itertools.chain(first_tasks, tasks)
+
+
+def _process_context():
+    # the parent has other threads running (scanner, progress bar...), forking it could copy a lock held by one of them
+    methods = multiprocessing.get_all_start_methods()
+    if 'forkserver' not in methods:
+        return multiprocessing.get_context('spawn')
+    return multiprocessing.get_context('forkserver')
 
 
 class WorkerPool(object):
-    def __init__(self, nworkers=10, pool_ctxs=None, retry=0, pb_elts=None, pb_desc='units', fail_limit=None):
+    def __init__(self, nworkers=10, pool_ctxs=None, retry=0, pb_elts=None, pb_desc='units', fail_limit=None,
+                 processes=False):
         if pool_ctxs is not None and len(pool_ctxs) != nworkers:
             return None
         self._avail_ctx = pool_ctxs
 
         nwrkrs = nworkers if nworkers > 0 else 1
-        self._pool = futures.ThreadPoolExecutor(max_workers=nwrkrs)
+        self._processes = processes and pool_ctxs is None
+        if self._processes:
+            self._pool = futures.ProcessPoolExecutor(max_workers=nwrkrs, mp_context=_process_context())
+        else:
+            self._pool = futures.ThreadPoolExecutor(max_workers=nwrkrs)
 
         self._futures = []
         self._retry = retry if retry >= 0 else 0
@@ -40,9 +78,7 @@ class WorkerPool(object):
         self.errors_count = 0
 
     def _retry_wait(self, retry):
-        wait = 1 + 2 * random.randint(0, retry)
-        log.debug(output_messages['DEBUG_WAIT_BEFORE_NEXT_ATTEMP'] % wait, class_name=POOL_CLASS_NAME)
-        time.sleep(wait)
+        pool_process.wait_before_retry(retry)
 
     def _submit_fn(self, userfn, *args, **kwds):
         ctx = self._get_ctx()
@@ -79,8 +115,38 @@ class WorkerPool(object):
 
         return result
 
+    def _process_done(self, future):
+        if future.cancelled():
+            return
+        e = future.exception()
+        if e is None:
+            log.debug(output_messages['DEBUG_WORKER_SUCESS'] % 1, class_name=POOL_CLASS_NAME)
+            self._progress()
+            return
+        self.errors_count += 1
+        if self.fail_limit is not None and self.errors_count > self.fail_limit or type(e) in CriticalErrors.to_list():
+            self.cancel()
+        elif self._progress_bar is not None:
+            self._progress_bar.set_postfix({'Failed': self.errors_count})
+        log.debug(output_messages['ERROR_WORKER_FAILURE'] % (e, self._retry), class_name=POOL_CLASS_NAME)
+
+    def _submit(self, userfn, *args, **kwds):
+        if not self._processes:
+            return self._pool.submit(self._submit_fn, userfn, *args, **kwds)
+        future = self._pool.submit(pool_process.run_in_process, self._retry, userfn, *args, **kwds)
+        future.add_done_callback(self._process_done)
+        return future
+
     def submit(self, userfn, *args, **kwds):
-        self._futures.append(self._pool.submit(self._submit_fn, userfn, *args, **kwds))
+        self._futures.append(self._submit(userfn, *args, **kwds))
+
+    def submit_notify(self, callback, userfn, *args, **kwds):
+        """Runs userfn as submit does, but calls callback with its future once it is done instead of keeping the future
+        for wait, so that the results can be consumed as soon as they come."""
+        self._submit(userfn, *args, **kwds).add_done_callback(callback)
+
+    def shutdown(self):
+        self._pool.shutdown()
 
     def _get_ctx(self):
         if self._avail_ctx is not None:
@@ -97,6 +163,9 @@ class WorkerPool(object):
         if self._progress_bar is not None:
             self._progress_bar.update(units)
 
+    def progress_bar_update(self, units):
+        self._progress(units)
+
     def progress_bar_close(self):
         self._progress_bar.close()
 
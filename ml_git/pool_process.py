@@ -0,0 +1,37 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import random
+import time
+
+from ml_git import log
+from ml_git.constants import POOL_CLASS_NAME
+from ml_git.error_handler import CriticalErrors
+from ml_git.ml_git_message import output_messages
+
+'''Entry point of the tasks of a WorkerPool running in processes.
+
+A process imports the module of the function it runs. The modules of ml-git can't be imported starting from
+ml_git.pool, which ml_git.log imports back (through ml_git.utils) before pool_factory is defined, so the tasks are run
+by this module, which imports ml_git.log first.'''
+
+
+def wait_before_retry(retry):
+    wait = 1 + 2 * random.randint(0, retry)
+    log.debug(output_messages['DEBUG_WAIT_BEFORE_NEXT_ATTEMP'] % wait, class_name=POOL_CLASS_NAME)
+    time.sleep(wait)
+
+
+def run_in_process(retry, userfn, *args, **kwds):
+    retry_cnt = 0
+    while True:
+        try:
+            return userfn(*args, **kwds)
+        except Exception as e:
+            if retry_cnt >= retry or type(e) in CriticalErrors.to_list():
+                raise e
+            retry_cnt += 1
+            log.debug(output_messages['WARN_WORKER_EXCEPTION'] % (e, retry_cnt), class_name=POOL_CLASS_NAME)
+            wait_before_retry(retry_cnt)
@@ -17,7 +17,8 @@ from ml_git.admin import remote_add, storage_add, clone_config_repository, init_
 from ml_git.config import get_index_path, get_objects_path, get_cache_path, get_metadata_path, get_refs_path, \
     validate_config_spec_hash, validate_spec_hash, get_sample_config_spec, get_sample_spec_doc, \
     get_index_metadata_path, create_workspace_tree_structure, start_wizard_questions, config_load, \
-    get_global_config_path, save_global_config_in_local
+    get_global_config_path, save_global_config_in_local, get_descriptor_format, get_chunk_verification, \
+    get_objects_index, get_pack_threshold, get_index_format, get_scan_cache, get_hashing_mode
 from ml_git.constants import REPOSITORY_CLASS_NAME, LOCAL_REPOSITORY_CLASS_NAME, HEAD, HEAD_1, MutabilityType, \
     StorageType, \
     RGX_TAG_FORMAT, EntityType, MANIFEST_FILE, SPEC_EXTENSION, MANIFEST_KEY, STATUS_NEW_FILE, STATUS_DELETED_FILE, \
@@ -34,7 +35,7 @@ from ml_git.plugin_interface.data_plugin_constants import COMPARE_SPECS, GET_STA
 from ml_git.plugin_interface.plugin_especialization import PluginCaller
 from ml_git.refs import Refs
 from ml_git.spec import spec_parse, search_spec_file, increment_version_in_spec, get_entity_tag, update_storage_spec, \
-    validate_bucket_name, set_version_in_spec, get_entity_dir, SearchSpecException, get_spec_key
+    validate_bucket_name, set_version_in_spec, get_entity_dir, SearchSpecException, get_spec_key, get_chunker_from_spec
 from ml_git.tag import UsrTag
 from ml_git.utils import yaml_load, ensure_path_exists, get_root_path, \
     RootPathException, change_mask_for_routine, clear, get_yaml_str, unzip_files_in_directory, \
@@ -164,11 +165,18 @@ class Repository(object):
             # adds chunks to ml-git Index
             log.info(output_messages['INFO_ADDING_PATH_TO'] % (repo_type, path), class_name=REPOSITORY_CLASS_NAME)
             with change_mask_for_routine(is_shared_objects):
-                idx = MultihashIndex(spec, index_path, objects_path, mutability, cache_path)
+                idx = MultihashIndex(spec, index_path, objects_path, mutability, cache_path,
+                                     get_descriptor_format(self.__config),
+                                     get_chunker_from_spec(spec_path, repo_type), get_objects_index(self.__config),
+                                     get_pack_threshold(self.__config), get_index_format(self.__config),
+                                     get_scan_cache(self.__config), get_hashing_mode(self.__config))
                 idx.add(path, manifest, file_path)
 
             # create hard links in ml-git Cache
-            self.create_hard_links_in_cache(cache_path, index_path, is_shared_cache, mutability, path, spec)
+            linked_files = self.create_hard_links_in_cache(cache_path, index_path, is_shared_cache, mutability, path,
+                                                           spec, idx.get_index())
+            # linking changed the stat of the files, they are not hashed again by the next status or add
+            idx.get_index_yaml().refresh_stats(path, linked_files)
         except Exception as e:
             log.error(e, class_name=REPOSITORY_CLASS_NAME)
             return None
@@ -223,12 +231,14 @@ class Repository(object):
         return True
 
     @Halo(text='Creating hard links in cache', spinner='dots')
-    def create_hard_links_in_cache(self, cache_path, index_path, is_shared_cache, mutability, path, spec):
-        mf = os.path.join(index_path, 'metadata', spec, MANIFEST_FILE)
+    def create_hard_links_in_cache(self, cache_path, index_path, is_shared_cache, mutability, path, spec, mf=None):
+        if mf is None:
+            mf = os.path.join(index_path, 'metadata', spec, MANIFEST_FILE)
         with change_mask_for_routine(is_shared_cache):
             if mutability in [MutabilityType.STRICT.value, MutabilityType.FLEXIBLE.value]:
                 cache = Cache(cache_path, path, mf)
-                cache.update()
+                return cache.update()
+        return []
 
     def _check_corrupted_files(self, spec, repo):
         try:
@@ -346,7 +356,7 @@ class Repository(object):
 
     @Halo(text='Checking removed files', spinner='dots')
     def _remove_deleted_files(self, idx, index_path, m, manifest, spec, deleted_files):
-        fidx = FullIndex(spec, index_path)
+        fidx = FullIndex(spec, index_path, index_format=get_index_format(self.__config))
         fidx.remove_deleted_files(deleted_files)
         idx.remove_deleted_files_index_manifest(deleted_files)
         m.remove_deleted_files_meta_manifest(manifest, deleted_files)
@@ -395,7 +405,7 @@ class Repository(object):
             return None, None, None
 
         spec_path = os.path.join(path, file)
-        idx = MultihashIndex(spec, index_path, objects_path)
+        idx = MultihashIndex(spec, index_path, objects_path, index_format=get_index_format(self.__config))
 
         if version:
             set_version_in_spec(version, spec_path, self.__repo_type)
@@ -415,7 +425,8 @@ class Repository(object):
 
         log.debug(output_messages['DEBUG_MESSAGE_VALUE'] % (index_path, objects_path), class_name=REPOSITORY_CLASS_NAME)
         # commit objects in index to ml-git objects
-        o = Objects(spec, objects_path)
+        o = Objects(spec, objects_path, descriptor_format=get_descriptor_format(self.__config),
+                    objects_index=get_objects_index(self.__config))
         changed_files, deleted_files = o.commit_index(index_path, path)
 
         bare_mode = os.path.exists(os.path.join(index_path, 'metadata', spec, 'bare'))
@@ -615,8 +626,9 @@ class Repository(object):
             fetch_success = self._fetch(tag, samples, retries)
 
             if not fetch_success:
-                objs = Objects('', objects_path)
-                objs.fsck(remove_corrupted=True)
+                objs = Objects('', objects_path, chunk_verification=get_chunk_verification(self.__config),
+                               objects_index=get_objects_index(self.__config))
+                objs.fsck(remove_corrupted=True, hashing_mode=get_hashing_mode(self.__config))
                 m.checkout()
         except Exception as e:
             log.error(e, class_name=REPOSITORY_CLASS_NAME)
@@ -651,12 +663,14 @@ class Repository(object):
             index_path = get_index_path(self.__config, repo_type)
         except RootPathException:
             return
-        o = Objects('', objects_path)
-        corrupted_files_obj = o.fsck()
+        o = Objects('', objects_path, chunk_verification=get_chunk_verification(self.__config),
+                    objects_index=get_objects_index(self.__config))
+        hashing_mode = get_hashing_mode(self.__config)
+        corrupted_files_obj = o.fsck(hashing_mode=hashing_mode)
         corrupted_files_obj_len = len(corrupted_files_obj)
 
         idx = MultihashIndex('', index_path, objects_path)
-        corrupted_files_idx = idx.fsck()
+        corrupted_files_idx = idx.fsck(hashing_mode)
         corrupted_files_idx_len = len(corrupted_files_idx)
 
         print('[%d] corrupted file(s) in Local Repository: %s' % (corrupted_files_obj_len, corrupted_files_obj))
@@ -831,8 +845,9 @@ class Repository(object):
         dataset_tag, labels_tag = self._get_related_tags(entity_dir, dataset, labels, metadata_path, repo_type, spec_name)
         fetch_success = self._fetch(tag, samples, retries, bare)
         if not fetch_success:
-            objs = Objects('', objects_path)
-            objs.fsck(remove_corrupted=True)
+            objs = Objects('', objects_path, chunk_verification=get_chunk_verification(self.__config),
+                           objects_index=get_objects_index(self.__config))
+            objs.fsck(remove_corrupted=True, hashing_mode=get_hashing_mode(self.__config))
             self._checkout_ref()
             return None, None
 
@@ -898,8 +913,8 @@ class Repository(object):
             object_path = get_objects_path(self.__config, repo_type)
             met = Metadata(spec, metadata_path, self.__config, repo_type)
             ref = Refs(refs_path, spec, repo_type)
-            idx = MultihashIndex(spec, index_path, object_path)
-            fidx = FullIndex(spec, index_path)
+            idx = MultihashIndex(spec, index_path, object_path, index_format=get_index_format(self.__config))
+            fidx = FullIndex(spec, index_path, index_format=get_index_format(self.__config))
         except Exception as e:
             log.error(e, class_name=REPOSITORY_CLASS_NAME)
             return
@@ -1117,7 +1132,7 @@ class Repository(object):
         except Exception as e:
             log.error(e, class_name=REPOSITORY_CLASS_NAME)
             return
-        fidx = FullIndex(spec, index_path)
+        fidx = FullIndex(spec, index_path, index_format=get_index_format(self.__config))
         if stat or fullstat:
             workspace_size = fidx.get_total_size()
 
@@ -1174,7 +1189,7 @@ class Repository(object):
             for spec in dirs:
                 try:
                     self._check_is_valid_entity(repo_type, spec)
-                    idx = MultihashIndex(spec, index_path, objects_path)
+                    idx = MultihashIndex(spec, index_path, objects_path, index_format=get_index_format(self.__config))
                     blobs_hashes.extend(idx.get_hashes_list())
                 except Exception:
                     log.debug(output_messages['INFO_ENTITY_DELETED'] % spec, class_name=REPOSITORY_CLASS_NAME)
@@ -1195,7 +1210,8 @@ class Repository(object):
 
                 cache = Cache(get_cache_path(self.__config, repo_type))
                 count_removed_cache, reclaimed_cache_space = cache.garbage_collector(blobs_hashes)
-                objects = Objects('', objects_path)
+                objects = Objects('', objects_path, descriptor_format=get_descriptor_format(self.__config),
+                                  objects_index=get_objects_index(self.__config))
                 count_removed_objects, reclaimed_objects_space = objects.garbage_collector(blobs_hashes)
 
                 reclaimed_space += reclaimed_objects_space + reclaimed_cache_space
@@ -1209,6 +1225,29 @@ class Repository(object):
         log.info(output_messages['INFO_RECLAIMED_SPACE'] % humanize.naturalsize(reclaimed_space),
                  class_name=REPOSITORY_CLASS_NAME)
 
+    def repack(self):
+        any_metadata = False
+        packed_files = 0
+        reclaimed_space = 0
+        for entity in EntityType:
+            repo_type = entity.value
+            if self.metadata_exists(repo_type):
+                log.info(output_messages['INFO_STARTING_REPACK'] % repo_type, class_name=REPOSITORY_CLASS_NAME)
+                any_metadata = True
+                objects_path = get_objects_path(self.__config, repo_type)
+                objects = Objects('', objects_path, descriptor_format=get_descriptor_format(self.__config),
+                                  objects_index=get_objects_index(self.__config),
+                                  pack_threshold=get_pack_threshold(self.__config))
+                count_packed_objects, reclaimed_packs_space = objects.repack()
+                packed_files += count_packed_objects
+                reclaimed_space += reclaimed_packs_space
+        if not any_metadata:
+            log.error(output_messages['ERROR_UNINITIALIZED_METADATA'], class_name=REPOSITORY_CLASS_NAME)
+            return
+        log.info(output_messages['INFO_PACKED_FILES'] % humanize.intword(packed_files), class_name=REPOSITORY_CLASS_NAME)
+        log.info(output_messages['INFO_RECLAIMED_SPACE'] % humanize.naturalsize(reclaimed_space),
+                 class_name=REPOSITORY_CLASS_NAME)
+
     @staticmethod
     def repo_config_init(remote_url):
         config_repo = MetadataRepo(remote_url, get_root_path(), 'project')
@@ -138,8 +138,8 @@ class SampleValidate:
     @staticmethod
     def __range_sample(start, stop, files, step):
         set_files = {}
+        list_file = list(files)
         for key in range(start, stop, step):
-            list_file = list(files)
             set_files.update({list_file[key]: files.get(list_file[key])})
         return set_files
 
@@ -148,10 +148,10 @@ class SampleValidate:
         random.seed(seed)
         set_files = {}
         count = 0
+        list_file = list(files)
         while count < round(len(files) / parts):
             start = group_size - parts
             for key in random.sample(range(start, group_size - 1), amount):
-                list_file = list(files)
                 set_files.update({list_file[key]: files.get(list_file[key])})
             count = count + 1
             group_size = group_size + parts
@@ -161,8 +161,8 @@ class SampleValidate:
     def __random_sample(amount, frequency, files, seed):
         random.seed(seed)
         set_files = {}
+        list_file = list(files)
         for key in random.sample(range(len(files)), round((amount*len(files)/frequency))):
-            list_file = list(files)
             set_files.update({list_file[key]: files.get(list_file[key])})
         return set_files
 
@@ -8,7 +8,7 @@ import os
 from ml_git import log
 from ml_git import utils
 from ml_git.constants import ML_GIT_PROJECT_NAME, SPEC_EXTENSION, EntityType, STORAGE_SPEC_KEY, STORAGE_CONFIG_KEY, \
-    DATASET_SPEC_KEY, LABELS_SPEC_KEY, MODEL_SPEC_KEY
+    DATASET_SPEC_KEY, LABELS_SPEC_KEY, MODEL_SPEC_KEY, CHUNKER_SPEC_KEY, ChunkerType
 from ml_git.ml_git_message import output_messages
 from ml_git.utils import get_root_path, yaml_load
 
@@ -135,6 +135,15 @@ def get_entity_tag(specpath, repo_type, entity):
     return entity_tag
 
 
+def get_chunker_from_spec(spec_path, repo_type=DATASETS):
+    entity_spec_key = get_spec_key(repo_type)
+    spec_hash = utils.yaml_load(spec_path)
+    chunker = spec_hash[entity_spec_key].get(CHUNKER_SPEC_KEY, ChunkerType.FIXED.value)
+    if chunker not in ChunkerType.to_list():
+        raise RuntimeError(output_messages['ERROR_INVALID_CHUNKER_TYPE'] % (chunker, ChunkerType.to_list()))
+    return chunker
+
+
 def update_storage_spec(repo_type, artifact_name, storage_type, bucket, entity_dir=''):
     path = None
     try:
@@ -3,12 +3,8 @@
 SPDX-License-Identifier: GPL-2.0-only
 """
 
-import hashlib
-
-from cid import CIDv1
-from multihash import multihash
-
 from ml_git import log
+from ml_git.cid_codec import data_to_cid
 from ml_git.constants import MULTI_HASH_STORAGE_NAME
 from ml_git.ml_git_message import output_messages
 
@@ -16,12 +12,7 @@ from ml_git.ml_git_message import output_messages
 class MultihashStorage(object):
 
     def digest(self, data):
-        m = hashlib.sha256()
-        m.update(data)
-        h = m.hexdigest()
-        mh = multihash.encode(bytes.fromhex(h), 'sha2-256')
-        cid = CIDv1('dag-pb', mh)
-        return str(cid)
+        return data_to_cid(data)
 
     def check_integrity(self, cid, ncid):
         if cid == ncid:
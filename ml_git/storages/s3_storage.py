@@ -8,11 +8,10 @@ import os
 from pprint import pprint
 
 import boto3
-import multihash
 from botocore.client import ClientError, Config
-from cid import CIDv1
 
 from ml_git import log
+from ml_git.cid_codec import digest_to_cid
 from ml_git.config import get_key
 from ml_git.constants import STORAGE_FACTORY_CLASS_NAME, S3STORAGE_NAME, S3_MULTI_HASH_STORAGE_NAME, StorageType
 from ml_git.ml_git_message import output_messages
@@ -227,10 +226,7 @@ class S3MultihashStorage(S3Storage, MultihashStorage):
                     break
                 m.update(chunk)
                 f.write(chunk)
-            h = m.hexdigest()
-            mh = multihash.encode(bytes.fromhex(h), 'sha2-256')
-            cid = CIDv1('dag-pb', mh)
-            ncid = str(cid)
+            ncid = digest_to_cid(m.digest())
             if self.check_integrity(key_path, ncid) is False:
                 return False
         c.close()
@@ -8,11 +8,13 @@ import fnmatch
 import itertools
 import json
 import os
+import re
 import shutil
 import stat
 import sys
 import zipfile
 from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path, PurePath, PurePosixPath
 from stat import S_IREAD, S_IRGRP, S_IROTH, S_IWUSR
 
@@ -23,6 +25,7 @@ from ruamel.yaml.compat import StringIO
 from ml_git import log
 from ml_git.constants import SPEC_EXTENSION, CONFIG_FILE, EntityType, ROOT_FILE_NAME, V1_STORAGE_KEY, V1_DATASETS_KEY, \
     V1_MODELS_KEY, STORAGE_SPEC_KEY, STORAGE_CONFIG_KEY, MLGIT_IGNORE_FILE_NAME
+from ml_git.file_system.scanner import scan_files
 from ml_git.ml_git_message import output_messages
 from ml_git.pool import pool_factory
 
@@ -231,15 +234,15 @@ def unzip_files_in_directory(dir_path):
 
 
 def remove_from_workspace(file_names, path, spec_name):
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            if file in [spec_name + SPEC_EXTENSION, 'README.md']:
-                continue
-            for key in file_names:
-                if file in key:
-                    file_path = convert_path(root, file)
-                    set_write_read(file_path)
-                    os.unlink(file_path)
+    for relative_path, _ in scan_files(path):
+        file = os.path.basename(relative_path)
+        if file in [spec_name + SPEC_EXTENSION, 'README.md']:
+            continue
+        for key in file_names:
+            if file in key:
+                file_path = convert_path(path, relative_path)
+                set_write_read(file_path)
+                os.unlink(file_path)
 
 
 def group_files_by_path(files):
@@ -392,13 +395,86 @@ def create_or_update_gitignore():
             file.write(remaining_file + '\n')
 
 
+_IGNORE_SPECIAL_CHARS = re.compile(r'[*?\[]')
+
+
+class IgnoreRules(object):
+    """Rules of a .mlgitignore compiled once for all the paths checked.
+
+    Each rule is a fnmatch pattern matched against the whole path of a file relative to the entity directory, or
+    against the path followed by '/' for a directory (so rules ending with '/' only match directories). Blank lines and
+    lines starting with '#' are skipped, and a rule starting with '!' includes again the paths matched by the previous
+    rules: as in git, the last rule matching a path wins. A leading '#' or '!' is escaped by a backslash.
+
+    Without negated rules, literal rules are looked up in a set, rules like '*.ext' are checked as suffixes and the
+    other rules are compiled in one regular expression per first character. Otherwise, all the rules are compiled in
+    a single regular expression whose first matching alternative is the last rule matching the path."""
+
+    def __init__(self, rules):
+        parsed = []
+        for rule in rules:
+            if not rule or rule.startswith('#'):
+                continue
+            negated = rule.startswith('!')
+            if negated or rule.startswith('\\#') or rule.startswith('\\!'):
+                rule = rule[1:]
+            parsed.append((os.path.normcase(rule), negated))
+        self._has_negation = any(negated for _, negated in parsed)
+        self._literals = set()
+        self._suffixes = ()
+        self._regexes = {}
+        self._negated = {}
+        if self._has_negation:
+            patterns = []
+            for rule, negated in parsed:
+                group = 'r%d' % len(patterns)
+                self._negated[group] = negated
+                patterns.append('(?P<%s>%s)' % (group, fnmatch.translate(rule)))
+            self._regex = re.compile('|'.join(reversed(patterns)))
+            return
+        suffixes = []
+        patterns = {}
+        for rule, _ in parsed:
+            if not _IGNORE_SPECIAL_CHARS.search(rule):
+                self._literals.add(rule)
+            elif rule[0] == '*' and not _IGNORE_SPECIAL_CHARS.search(rule[1:]):
+                suffixes.append(rule[1:])
+            else:
+                first = '' if _IGNORE_SPECIAL_CHARS.match(rule) else rule[0]
+                patterns.setdefault(first, []).append(fnmatch.translate(rule))
+        self._suffixes = tuple(suffixes)
+        self._regexes = {first: re.compile('|'.join(group)) for first, group in patterns.items()}
+        self._regex = self._regexes.pop('', None)
+
+    def ignores(self, path, is_dir=False):
+        path = os.path.normcase(path + '/' if is_dir else path)
+        if self._has_negation:
+            match = self._regex.match(path)
+            return match is not None and not self._negated[match.lastgroup]
+        if path in self._literals or (self._suffixes and path.endswith(self._suffixes)):
+            return True
+        regex = self._regexes.get(path[:1])
+        if regex is not None and regex.match(path):
+            return True
+        return self._regex is not None and self._regex.match(path) is not None
+
+
+def compile_ignore_rules(ignore_rules):
+    return IgnoreRules(ignore_rules) if ignore_rules else None
+
+
+@lru_cache(maxsize=8)
+def _compile_ignore_rules(ignore_rules):
+    return IgnoreRules(ignore_rules)
+
+
 def should_ignore_file(ignore_rules, file_path):
+    """ignore_rules are IgnoreRules or the list of rules given by get_ignore_rules."""
     if not ignore_rules:
         return False
-    for rule in ignore_rules:
-        if fnmatch.fnmatch(file_path, rule):
-            return True
-    return False
+    if not isinstance(ignore_rules, IgnoreRules):
+        ignore_rules = _compile_ignore_rules(tuple(ignore_rules))
+    return ignore_rules.ignores(file_path)
 
 
 def get_ignore_rules(path):
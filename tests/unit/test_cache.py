@@ -9,6 +9,7 @@ import unittest
 import pytest
 
 from ml_git.file_system.cache import Cache
+from ml_git.manifest import Manifest
 from ml_git.utils import yaml_save, set_write_read
 
 
@@ -27,3 +28,22 @@ class CacheTestCases(unittest.TestCase):
         st = os.stat(os.path.join(self.test_dir, data, 'think-hires.jpg'))
         self.assertTrue(st.st_nlink > 1)
         self.assertTrue(c.exists('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u'))
+
+    def test_update_from_manifest(self):
+        data = os.path.join(self.tmp_dir, 'data')
+        os.makedirs(data)
+        manifest = Manifest(os.path.join(self.tmp_dir, 'MANIFEST.yaml'))
+        for i in range(20):
+            with open(os.path.join(data, 'file%d' % i), 'w') as f:
+                f.write(str(i))
+            manifest.add('key%d' % (i % 10), 'file%d' % i)
+        manifest.add('key10', 'removed')
+        c = Cache(os.path.join(self.tmp_dir, 'cache'), data, manifest)
+        c.update()
+        for i in range(10):
+            self.assertTrue(c.exists('key%d' % i))
+            # the second file of a key is linked to the file already in the cache
+            self.assertTrue(os.path.samefile(c.get_keypath('key%d' % i), os.path.join(data, 'file%d' % i)))
+            self.assertTrue(os.path.samefile(c.get_keypath('key%d' % i), os.path.join(data, 'file%d' % (i + 10))))
+        self.assertFalse(c.exists('key10'))
+        self.assertFalse(os.path.exists(manifest._mfpath))
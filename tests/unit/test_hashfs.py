@@ -3,16 +3,25 @@
 SPDX-License-Identifier: GPL-2.0-only
 """
 
+import errno
 import hashlib
 import os
+import threading
 import unittest
+from concurrent import futures
+from unittest import mock
 
+import multihash
 import pytest
+from cid import CIDv1
 
-from ml_git.constants import STORAGE_LOG
+from ml_git.cid_codec import data_to_cid, cid_to_digest, cid_matches
+from ml_git.constants import STORAGE_LOG, DescriptorFormat, ChunkerType, ChunkVerification, HashingMode, \
+    ADDED_LINKS_FILE
 from ml_git.file_system.hashfs import MultihashFS, HashFS
 from ml_git.file_system.index import MultihashIndex
 from ml_git.file_system.objects import Objects
+from ml_git.utils import set_read_only, set_write_read
 
 chunks256 = {
     'zdj7Wena1SoxPakkmaBTq1853qqKFwo1gDMWLB4SJjREsuGTC',
@@ -147,6 +156,18 @@ class MultihashFSTestCases(unittest.TestCase):
         self.assertTrue(len(corrupted_files) == 2)
         self.assertTrue('zdj7WaUNoRAzciw2JJi69s2HjfCyzWt39BHCucCV2CsAX6vSv' in corrupted_files)
 
+    def test_fsck_in_processes(self):
+        hfs = MultihashFS(self.tmp_dir, blocksize=1024 * 1024)
+        original_file = os.path.join(self.tmp_dir, 'file.bin')
+        with open(original_file, 'wb') as f:
+            f.write(os.urandom(1024))
+        chunk_key = hfs.load_links(hfs.put(original_file))[0][0]
+        self.assertEqual(hfs.fsck(hashing_mode=HashingMode.PROCESSES.value), [])
+
+        with open(hfs._get_hashpath(chunk_key), 'wb') as f:
+            f.write(b'blabla')
+        self.assertEqual(hfs.fsck(hashing_mode=HashingMode.PROCESSES.value), [chunk_key])
+
     def test_remove_corrupted_files(self):
         hfs = MultihashFS(self.tmp_dir, blocksize=1024 * 1024)
         corrupted_file_path = os.path.join(self.tmp_dir, 'corrupted_file')
@@ -176,6 +197,450 @@ class MultihashFSTestCases(unittest.TestCase):
         self.assertTrue('zdj7WaUNoRAzciw2JJi69s2HjfCyzWt39BHCucCV2CsAX6vSv' in corrupted_files)
         self.assertFalse(os.path.exists(chunk_in_wrong_dir))
 
+    def test_put_if_changed(self):
+        original_file = os.path.join(self.tmp_dir, 'file.bin')
+        with open(original_file, 'wb') as f:
+            f.write(os.urandom(600 * 1024))
+        hfs = MultihashFS(self.tmp_dir, blocksize=256 * 1024)
+
+        objkey, links = hfs.put_if_changed(original_file)
+        self.assertEqual(objkey, hfs.get_scid(original_file))
+        self.assertEqual(len(links), 3)
+        self.assertEqual(sum(link['Size'] for link in links), 600 * 1024)
+        self.assertTrue(hfs._exists(objkey))
+
+        with mock.patch.object(hfs, '_store_chunk', wraps=hfs._store_chunk) as store_chunk:
+            same_objkey, _ = hfs.put_if_changed(original_file, objkey)
+        self.assertEqual(same_objkey, objkey)
+        self.assertEqual(store_chunk.call_count, len(links))
+        self.assertFalse(any(args[0] == objkey for args, _ in store_chunk.call_args_list))
+
+        with open(original_file, 'ab') as f:
+            f.write(b'new data')
+        new_objkey, new_links = hfs.put_if_changed(original_file, objkey)
+        self.assertNotEqual(new_objkey, objkey)
+        self.assertTrue(hfs._exists(new_objkey))
+        self.assertEqual(new_links[:2], links[:2])
+
+    def test_binary_descriptor_format(self):
+        original_file = os.path.join(self.tmp_dir, 'file.bin')
+        dst_file = os.path.join(self.tmp_dir, 'file.out')
+        with open(original_file, 'wb') as f:
+            f.write(os.urandom(600 * 1024))
+        json_hfs = MultihashFS(os.path.join(self.tmp_dir, 'json'))
+        hfs = MultihashFS(self.tmp_dir, descriptor_format=DescriptorFormat.BINARY.value)
+
+        objkey, links = hfs.put_if_changed(original_file)
+        self.assertEqual(objkey, json_hfs.put(original_file))
+        self.assertEqual(hfs.load(objkey), {'Links': links})
+        compact_path = hfs._get_compact_path(objkey)
+        self.assertTrue(os.path.exists(compact_path))
+        self.assertEqual(os.path.getsize(compact_path), 16 + 40 * len(links))
+
+        with mock.patch.object(hfs, 'load') as load:
+            self.assertEqual(hfs.load_links(objkey), [(link['Hash'], link['Size']) for link in links])
+            self.assertEqual(hfs.get(objkey, dst_file), 600 * 1024)
+        load.assert_not_called()
+        self.assertEqual(self.md5sum(original_file), self.md5sum(dst_file))
+
+    def test_binary_descriptor_from_json(self):
+        original_file = os.path.join(self.tmp_dir, 'file.bin')
+        with open(original_file, 'wb') as f:
+            f.write(os.urandom(300 * 1024))
+        objkey = MultihashFS(self.tmp_dir).put(original_file)
+        hfs = MultihashFS(self.tmp_dir, descriptor_format=DescriptorFormat.BINARY.value)
+        compact_path = hfs._get_compact_path(objkey)
+        self.assertFalse(os.path.exists(compact_path))
+
+        links = hfs.load_links(objkey)
+        self.assertEqual(len(links), 2)
+        self.assertTrue(os.path.exists(compact_path))
+
+        with open(compact_path, 'wb') as f:
+            f.write(b'corrupted')
+        self.assertEqual(hfs.load_links(objkey), links)
+
+    def test_binary_descriptor_verified_by_get(self):
+        original_file = os.path.join(self.tmp_dir, 'file.bin')
+        dst_file = os.path.join(self.tmp_dir, 'file.out')
+        with open(original_file, 'wb') as f:
+            f.write(os.urandom(300 * 1024))
+        objkey = MultihashFS(self.tmp_dir).put(original_file)
+        hfs = MultihashFS(self.tmp_dir, descriptor_format=DescriptorFormat.BINARY.value,
+                          chunk_verification=ChunkVerification.NEVER.value)
+        compact_path = hfs._get_compact_path(objkey)
+
+        self.assertEqual(hfs.get(objkey, dst_file), 300 * 1024)
+        self.assertFalse(os.path.exists(compact_path))
+
+        hfs = MultihashFS(self.tmp_dir, descriptor_format=DescriptorFormat.BINARY.value)
+        self.assertEqual(hfs.get(objkey, dst_file), 300 * 1024)
+        self.assertTrue(os.path.exists(compact_path))
+
+        descriptor_path = hfs._get_hashpath(objkey)
+        set_write_read(descriptor_path)
+        with open(descriptor_path, 'wb') as f:
+            f.write(b'{"Links": []}')
+        self.assertEqual(hfs.get(objkey, dst_file), 0)
+
+    def test_get_corrupted_descriptor(self):
+        original_file = os.path.join(self.tmp_dir, 'file.bin')
+        dst_file = os.path.join(self.tmp_dir, 'file.out')
+        with open(original_file, 'wb') as f:
+            f.write(os.urandom(300 * 1024))
+        objkey = MultihashFS(self.tmp_dir).put(original_file)
+        descriptor_path = MultihashFS(self.tmp_dir)._get_hashpath(objkey)
+        set_write_read(descriptor_path)
+        with open(descriptor_path, 'wb') as f:
+            f.write(b'{"corrupted": 1}')
+
+        for policy in ChunkVerification.to_list():
+            for descriptor_format in DescriptorFormat.to_list():
+                hfs = MultihashFS(self.tmp_dir, descriptor_format=descriptor_format, chunk_verification=policy)
+                self.assertEqual(hfs.get(objkey, dst_file), 0)
+
+    def test_get_missing_descriptor(self):
+        original_file = os.path.join(self.tmp_dir, 'file.bin')
+        dst_file = os.path.join(self.tmp_dir, 'file.out')
+        with open(original_file, 'wb') as f:
+            f.write(os.urandom(300 * 1024))
+        hfs = MultihashFS(self.tmp_dir, descriptor_format=DescriptorFormat.BINARY.value)
+        objkey = hfs.put(original_file)
+        os.unlink(hfs._get_hashpath(objkey))
+
+        self.assertEqual(hfs.get(objkey, dst_file), 0)
+        os.unlink(hfs._get_compact_path(objkey))
+        for policy in ChunkVerification.to_list():
+            hfs = MultihashFS(self.tmp_dir, chunk_verification=policy)
+            self.assertEqual(hfs.get(objkey, dst_file), 0)
+
+    def test_content_defined_chunking(self):
+        original_file = os.path.join(self.tmp_dir, 'file.bin')
+        dst_file = os.path.join(self.tmp_dir, 'file.out')
+        data = os.urandom(2 * 1024 * 1024)
+        with open(original_file, 'wb') as f:
+            f.write(data)
+        hfs = MultihashFS(self.tmp_dir, blocksize=256 * 1024, chunker=ChunkerType.FASTCDC.value)
+
+        objkey, links = hfs.put_if_changed(original_file)
+        self.assertEqual(hfs.load(objkey)['Chunker'], ChunkerType.FASTCDC.value)
+        self.assertTrue(all(link['Size'] <= 256 * 1024 for link in links))
+        self.assertEqual(hfs.get(objkey, dst_file), len(data))
+        self.assertEqual(self.md5sum(original_file), self.md5sum(dst_file))
+        self.assertEqual(MultihashFS(self.tmp_dir).get_scid(original_file, objkey), objkey)
+
+        with open(original_file, 'wb') as f:
+            f.write(b'x' + data)
+        _, shifted_links = hfs.put_if_changed(original_file, objkey)
+        hashes = set(link['Hash'] for link in links)
+        shifted_hashes = set(link['Hash'] for link in shifted_links)
+        self.assertGreaterEqual(len(hashes & shifted_hashes), len(hashes) - 2)
+        self.assertEqual(hfs.fsck(), [])
+
+    def test_chunker_changed_in_spec(self):
+        original_file = os.path.join(self.tmp_dir, 'file.bin')
+        data = os.urandom(1024 * 1024)
+        with open(original_file, 'wb') as f:
+            f.write(data)
+        objkey = MultihashFS(self.tmp_dir, chunker=ChunkerType.FASTCDC.value).put(original_file)
+        hfs = MultihashFS(self.tmp_dir)
+
+        # an unchanged file keeps the chunker it was added with, for add as for status
+        self.assertEqual(hfs.get_scid(original_file, objkey), objkey)
+        self.assertEqual(hfs.put_if_changed(original_file, objkey)[0], objkey)
+
+        with open(original_file, 'wb') as f:
+            f.write(b'x' + data)
+        scid = hfs.get_scid(original_file, objkey)
+        self.assertNotEqual(scid, objkey)
+        new_key, _ = hfs.put_if_changed(original_file, objkey)
+        self.assertNotIn('Chunker', hfs.load(new_key))
+        self.assertEqual(hfs.get_scid(original_file, new_key), new_key)
+
+    def test_content_defined_chunking_max_file_size(self):
+        original_file = os.path.join(self.tmp_dir, 'file.bin')
+        with open(original_file, 'wb') as f:
+            f.write(os.urandom(1024 * 1024))
+        hfs = MultihashFS(self.tmp_dir, chunker=ChunkerType.FASTCDC.value)
+
+        with mock.patch('ml_git.file_system.hashfs.FASTCDC_MAX_FILE_SIZE', 512 * 1024):
+            objkey = hfs.put(original_file)
+            self.assertEqual(hfs.get_scid(original_file, objkey), objkey)
+        self.assertEqual(objkey, MultihashFS(os.path.join(self.tmp_dir, 'fixed')).put(original_file))
+
+    def test_parallel_hashing(self):
+        original_file = os.path.join(self.tmp_dir, 'file.bin')
+        with open(original_file, 'wb') as f:
+            f.write(os.urandom(1024 * 1024 + 100))
+        serial_hfs = MultihashFS(os.path.join(self.tmp_dir, 'serial'), blocksize=256 * 1024)
+        hfs = MultihashFS(self.tmp_dir, blocksize=256 * 1024, parallel_threshold=1024 * 1024)
+
+        with mock.patch('ml_git.file_system.hashfs.PARALLEL_HASHING_TASK_SIZE', 512 * 1024), \
+                mock.patch('os.pread', wraps=os.pread) as pread:
+            objkey, links = hfs.put_if_changed(original_file)
+            self.assertEqual(hfs.get_scid(original_file), objkey)
+        self.assertTrue(pread.called)
+        self.assertEqual((objkey, links), serial_hfs.put_if_changed(original_file))
+        self.assertEqual(len(links), 5)
+        self.assertEqual(hfs.fsck(), [])
+
+        with mock.patch('os.pread') as pread:
+            self.assertEqual(serial_hfs.get_scid(original_file), objkey)
+        pread.assert_not_called()
+
+    def test_parallel_hashing_threads_shared(self):
+        files = []
+        for i in range(4):
+            files.append(os.path.join(self.tmp_dir, 'file%d.bin' % i))
+            with open(files[-1], 'wb') as f:
+                f.write(os.urandom(1024 * 1024))
+        hfs = MultihashFS(self.tmp_dir, blocksize=256 * 1024, parallel_threshold=1024 * 1024)
+        range_threads = set()
+
+        def hash_range(*args):
+            range_threads.add(threading.get_ident())
+            return MultihashFS._hash_range(hfs, *args)
+
+        with mock.patch('ml_git.file_system.hashfs.PARALLEL_HASHING_TASK_SIZE', 256 * 1024), \
+                mock.patch('ml_git.file_system.hashfs.PARALLEL_HASHING_WORKERS', 2), \
+                mock.patch('ml_git.file_system.hashfs._range_executor', None), \
+                mock.patch.object(hfs, '_hash_range', side_effect=hash_range):
+            with futures.ThreadPoolExecutor(max_workers=4) as executor:
+                keys = list(executor.map(hfs.put, files))
+        self.assertEqual(len(range_threads), 2)
+        self.assertEqual(keys, [MultihashFS(os.path.join(self.tmp_dir, 'serial')).put(file) for file in files])
+
+    def test_cid_codec(self):
+        for data in [b'', b'ml-git', os.urandom(256 * 1024)]:
+            digest = hashlib.sha256(data).digest()
+            cid = data_to_cid(data)
+            self.assertEqual(cid, str(CIDv1('dag-pb', multihash.encode(digest, 'sha2-256'))))
+            self.assertEqual(cid_to_digest(cid), digest)
+            self.assertTrue(cid_matches(cid, digest))
+        self.assertFalse(cid_matches('zdj7WaUNoRAzciw2JJi69s2HjfCyzWt39BHCucCV2CsAX6vSv', digest))
+        for invalid_cid in ['', 'think-hires.jpg', 'zdj7WaUNoRAzciw2JJi69s2HjfCyzWt39BHCucCV2CsAX6vS0', 'z' + 'z' * 60]:
+            self.assertFalse(cid_matches(invalid_cid, digest))
+        # a non canonical encoding of a valid CID
+        cid = data_to_cid(b'ml-git')
+        self.assertFalse(cid_matches('z1' + cid[1:], hashlib.sha256(b'ml-git').digest()))
+        with self.assertRaises(ValueError):
+            cid_to_digest('z11' + cid[1:])
+
+    def test_get_chunk_verification(self):
+        original_file = os.path.join(self.tmp_dir, 'file.bin')
+        dst_file = os.path.join(self.tmp_dir, 'file.out')
+        with open(original_file, 'wb') as f:
+            f.write(os.urandom(600 * 1024))
+        objkey, links = MultihashFS(self.tmp_dir).put_if_changed(original_file)
+
+        for policy, expected_checks in [(ChunkVerification.ALWAYS.value, [4, 4]),
+                                        (ChunkVerification.FIRST_TOUCH.value, [4, 0]),
+                                        (ChunkVerification.NEVER.value, [0, 0])]:
+            hfs = MultihashFS(self.tmp_dir, chunk_verification=policy)
+            hfs._verified_chunks.reset([])
+            for expected in expected_checks:
+                with mock.patch('ml_git.file_system.hashfs.cid_matches', wraps=cid_matches) as check:
+                    self.assertEqual(hfs.get(objkey, dst_file), 600 * 1024)
+                self.assertEqual(check.call_count, expected)
+                self.assertEqual(self.md5sum(original_file), self.md5sum(dst_file))
+
+        hfs = MultihashFS(self.tmp_dir, chunk_verification=ChunkVerification.FIRST_TOUCH.value)
+        with open(hfs._get_hashpath(links[0]['Hash']), 'wb') as f:
+            f.write(b'corrupted')
+        self.assertEqual(hfs.fsck(), [links[0]['Hash']])
+        self.assertEqual(hfs.get(objkey, dst_file), 0)
+        self.assertFalse(os.path.exists(dst_file))
+
+    def test_get_without_verification_copies_chunks(self):
+        original_file = os.path.join(self.tmp_dir, 'file.bin')
+        dst_file = os.path.join(self.tmp_dir, 'file.out')
+        with open(original_file, 'wb') as f:
+            f.write(os.urandom(700 * 1024 + 3))
+        hfs = MultihashFS(self.tmp_dir, chunk_verification=ChunkVerification.NEVER.value)
+        objkey = hfs.put(original_file)
+        hfs._verified_chunks.add(objkey)
+
+        self.assertEqual(hfs.get(objkey, dst_file), 700 * 1024 + 3)
+        self.assertEqual(self.md5sum(original_file), self.md5sum(dst_file))
+
+        unsupported = OSError(errno.EXDEV, 'Invalid cross-device link')
+        with mock.patch('fcntl.ioctl', side_effect=unsupported), \
+                mock.patch('os.copy_file_range', side_effect=unsupported), \
+                mock.patch('os.sendfile', side_effect=unsupported):
+            self.assertEqual(hfs.get(objkey, dst_file), 700 * 1024 + 3)
+        self.assertEqual(self.md5sum(original_file), self.md5sum(dst_file))
+
+        hfs = MultihashFS(self.tmp_dir, chunk_verification=ChunkVerification.FIRST_TOUCH.value)
+        hfs._verified_chunks.add(hfs.load_links(objkey)[1][0])
+        self.assertEqual(hfs.get(objkey, dst_file), 700 * 1024 + 3)
+        self.assertEqual(self.md5sum(original_file), self.md5sum(dst_file))
+
+    def test_get_clone_single_chunk(self):
+        small_file = os.path.join(self.tmp_dir, 'small.bin')
+        with open(small_file, 'wb') as f:
+            f.write(os.urandom(100 * 1024))
+        hfs = MultihashFS(self.tmp_dir)
+        objkey, links = hfs.put_if_changed(small_file)
+        chunk_path = hfs._get_hashpath(links[0]['Hash'])
+        chunk_mode = os.stat(chunk_path).st_mode
+
+        def reflink(src_path, dst_file, offset=0, length=None):
+            with open(src_path, 'rb') as src_file:
+                dst_file.write(src_file.read())
+            return True
+
+        # without reflinks, the chunk is verified while copied
+        cloned_file = os.path.join(self.tmp_dir, 'cloned.bin')
+        with mock.patch.object(hfs._chunk_copier, 'reflink', return_value=False), \
+                mock.patch.object(hfs, '_read_blocks', wraps=hfs._read_blocks) as read_blocks:
+            self.assertEqual(hfs.get(objkey, cloned_file, clone_single_chunk=True), 100 * 1024)
+        read_blocks.assert_called_once()
+        self.assertEqual(self.md5sum(small_file), self.md5sum(cloned_file))
+
+        # a reflinked chunk is read once to be verified
+        with mock.patch.object(hfs._chunk_copier, 'reflink', side_effect=reflink), \
+                mock.patch.object(hfs, '_read_blocks', wraps=hfs._read_blocks) as read_blocks:
+            self.assertEqual(hfs.get(objkey, cloned_file, clone_single_chunk=True), 100 * 1024)
+        read_blocks.assert_called_once()
+        self.assertFalse(os.path.samefile(cloned_file, chunk_path))
+        self.assertEqual(self.md5sum(small_file), self.md5sum(cloned_file))
+
+        # the changes of mode of a checkout and of the cleanup of the workspace do not reach the objects
+        set_read_only(cloned_file)
+        self.assertEqual(os.stat(chunk_path).st_mode, chunk_mode)
+        set_write_read(cloned_file)
+        os.unlink(cloned_file)
+        self.assertEqual(os.stat(chunk_path).st_mode, chunk_mode)
+        self.assertEqual(os.stat(chunk_path).st_nlink, 1)
+
+        with open(chunk_path, 'wb') as f:
+            f.write(b'corrupted')
+        corrupted_file = os.path.join(self.tmp_dir, 'corrupted.bin')
+        self.assertEqual(hfs.get(objkey, corrupted_file, clone_single_chunk=True), 0)
+        self.assertFalse(os.path.exists(corrupted_file))
+        with mock.patch.object(hfs._chunk_copier, 'reflink', side_effect=reflink):
+            self.assertEqual(hfs.get(objkey, corrupted_file, clone_single_chunk=True), 0)
+        self.assertFalse(os.path.exists(corrupted_file))
+
+    def test_objects_index(self):
+        original_file = os.path.join(self.tmp_dir, 'file.bin')
+        with open(original_file, 'wb') as f:
+            f.write(os.urandom(600 * 1024))
+        objkey, links = MultihashFS(self.tmp_dir).put_if_changed(original_file)
+        keys = [objkey] + [link['Hash'] for link in links]
+        unknown_key = 'zdj7WaUNoRAzciw2JJi69s2HjfCyzWt39BHCucCV2CsAX6vSv'
+
+        hfs = MultihashFS(self.tmp_dir, objects_index=True)
+        self.assertEqual(hfs.missing(keys + [unknown_key]), [unknown_key])
+        with mock.patch('os.path.exists') as exists:
+            self.assertEqual(hfs.missing(keys), [])
+            self.assertTrue(hfs._exists(objkey))
+        self.assertFalse(any('hashfs' in str(args) for args, _ in exists.call_args_list))
+
+        os.unlink(hfs._get_hashpath(links[0]['Hash']))
+        self.assertEqual(hfs.missing(keys), [])
+        hfs.fsck()
+        self.assertEqual(hfs.missing(keys), [links[0]['Hash']])
+        hfs.put(original_file)
+        self.assertEqual(hfs.missing(keys), [])
+
+        # a key still listed by the index is written again if its file is gone
+        os.unlink(hfs._get_hashpath(links[1]['Hash']))
+        self.assertEqual(hfs.put_if_changed(original_file)[0], objkey)
+        self.assertTrue(os.path.exists(hfs._get_hashpath(links[1]['Hash'])))
+
+    def test_objects_index_pruned_by_gc_when_disabled(self):
+        original_file = os.path.join(self.tmp_dir, 'file.bin')
+        with open(original_file, 'wb') as f:
+            f.write(os.urandom(600 * 1024))
+        objkey = MultihashFS(self.tmp_dir, objects_index=True).put(original_file)
+        Objects('dataset-spec', self.tmp_dir).garbage_collector([])
+        self.assertFalse(os.path.exists(MultihashFS(self.tmp_dir)._get_hashpath(objkey)))
+
+        hfs = MultihashFS(self.tmp_dir, objects_index=True)
+        self.assertEqual(hfs.missing([objkey]), [objkey])
+        self.assertEqual(hfs.put(original_file), objkey)
+        self.assertTrue(os.path.exists(hfs._get_hashpath(objkey)))
+        self.assertEqual(hfs.missing([objkey]), [])
+
+    def test_packfiles(self):
+        original_file = os.path.join(self.tmp_dir, 'file.bin')
+        with open(original_file, 'wb') as f:
+            f.write(os.urandom(600 * 1024))
+        hfs = MultihashFS(self.tmp_dir, pack_threshold=100 * 1024)
+        objkey, links = hfs.put_if_changed(original_file)
+        keys = [objkey] + [link['Hash'] for link in links]
+        packed_keys = [objkey, links[2]['Hash']]
+        for key in keys:
+            self.assertEqual(os.path.exists(hfs._get_hashpath(key)), key not in packed_keys)
+        self.assertEqual(MultihashFS(self.tmp_dir).missing(keys), [])
+        self.assertTrue(hfs._exists(objkey))
+        self.assertEqual(hfs.load_links(objkey), [(link['Hash'], link['Size']) for link in links])
+
+        for chunk_verification in ChunkVerification.to_list():
+            dst_file = os.path.join(self.tmp_dir, 'file.%s' % chunk_verification)
+            hfs = MultihashFS(self.tmp_dir, chunk_verification=chunk_verification)
+            self.assertEqual(hfs.get(objkey, dst_file), 600 * 1024)
+            self.assertEqual(self.md5sum(original_file), self.md5sum(dst_file))
+        with hfs.readable_keypath(links[2]['Hash']) as chunk_path:
+            self.assertEqual(os.path.getsize(chunk_path), links[2]['Size'])
+        self.assertFalse(os.path.exists(chunk_path))
+
+        small_file = os.path.join(self.tmp_dir, 'small.bin')
+        with open(small_file, 'wb') as f:
+            f.write(os.urandom(1024))
+        small_key = hfs.put(small_file)
+        small_chunk = hfs.load_links(small_key)[0][0]
+        hfs = MultihashFS(self.tmp_dir, pack_threshold=100 * 1024)
+        self.assertEqual(hfs.repack(), (2, 0))
+        self.assertFalse(os.path.exists(hfs._get_hashpath(small_key)))
+        self.assertEqual(hfs.get(small_key, os.path.join(self.tmp_dir, 'small.out')), 1024)
+        self.assertEqual(hfs.fsck(), [])
+
+        pack_path, offset, _ = hfs._locate(small_chunk)
+        with open(pack_path, 'r+b') as f:
+            f.seek(offset)
+            f.write(b'corrupted')
+        self.assertEqual(hfs.fsck(remove_corrupted=True), [small_chunk])
+        self.assertEqual(hfs.missing([small_chunk, small_key]), [small_chunk])
+
+        objects = Objects('', self.tmp_dir, pack_threshold=100 * 1024)
+        objects.garbage_collector([objkey])
+        self.assertEqual(objects.missing(keys + [small_key]), [small_key])
+        packed_files, reclaimed_space = objects.repack()
+        self.assertEqual(packed_files, 0)
+        self.assertGreater(reclaimed_space, 0)
+        self.assertEqual(objects.get(objkey, os.path.join(self.tmp_dir, 'file.out')), 600 * 1024)
+
+    def test_packfiles_removed_by_gc_not_restored_by_fsck(self):
+        small_file = os.path.join(self.tmp_dir, 'small.bin')
+        with open(small_file, 'wb') as f:
+            f.write(os.urandom(1024))
+        objects = Objects('', self.tmp_dir, pack_threshold=100 * 1024, objects_index=True)
+        small_key = objects.put(small_file)
+        self.assertTrue(objects._exists(small_key))
+
+        objects.garbage_collector([])
+        self.assertFalse(objects._exists(small_key))
+        self.assertEqual(objects.fsck(), [])
+        self.assertFalse(objects._exists(small_key))
+        self.assertEqual(objects.put(small_file), small_key)
+        self.assertTrue(objects._exists(small_key))
+        self.assertEqual(objects.fsck(), [])
+        self.assertTrue(objects._exists(small_key))
+
+    def test_packfiles_written_by_another_instance(self):
+        small_file = os.path.join(self.tmp_dir, 'small.bin')
+        with open(small_file, 'wb') as f:
+            f.write(os.urandom(1024))
+        reader = MultihashFS(self.tmp_dir, pack_threshold=100 * 1024)
+        small_key = MultihashFS(self.tmp_dir, pack_threshold=100 * 1024).put(small_file)
+        self.assertFalse(os.path.exists(reader._get_hashpath(small_key)))
+
+        self.assertTrue(reader._exists(small_key))
+        self.assertIsNone(reader._packs.put(small_key, b'duplicated'))
+        self.assertEqual(reader.get(small_key, os.path.join(self.tmp_dir, 'small.out')), 1024)
+
 
 hfsfiles = {'think-hires.jpg'}
 
@@ -266,6 +731,30 @@ class HashFSTestCases(unittest.TestCase):
             with open(os.path.join(self.tmp_dir, 'hashfs', 'log', STORAGE_LOG)) as f:
                 self.assertFalse(h in f.read())
 
+    def test_commit_with_added_links(self):
+        data = os.path.join(self.tmp_dir, 'data')
+        os.makedirs(data)
+        for i in range(3):
+            with open(os.path.join(data, 'file%d.bin' % i), 'wb') as f:
+                f.write(os.urandom(300 * 1024))
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir)
+        idx.add(data, '')
+        links_path = os.path.join(self.tmp_dir, 'metadata', 'dataset-spec', ADDED_LINKS_FILE)
+        self.assertTrue(os.path.exists(links_path))
+
+        o = Objects('dataset-spec', self.tmp_dir)
+        with mock.patch.object(o, 'load_links', wraps=o.load_links) as load_links:
+            o.commit_index(self.tmp_dir, data)
+        load_links.assert_not_called()
+        self.assertFalse(os.path.exists(links_path))
+        with open(os.path.join(self.tmp_dir, 'hashfs', 'log', STORAGE_LOG)) as f:
+            logged = f.read().splitlines()
+        expected = []
+        for key in idx.get_index():
+            expected.append(key)
+            expected.extend(chunk for chunk, _ in o.load_links(key))
+        self.assertEqual(sorted(logged), sorted(expected))
+
     def test_link(self):
         hfs = HashFS(self.tmp_dir)
 
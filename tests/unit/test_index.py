@@ -4,11 +4,16 @@ SPDX-License-Identifier: GPL-2.0-only
 """
 
 import os
+import threading
+import time
 import unittest
+from unittest import mock
 
 import pytest
 
-from ml_git.file_system.index import MultihashIndex
+from ml_git.constants import MutabilityType, HashingMode, IndexFormat, INDEX_FILE, MLGIT_IGNORE_FILE_NAME
+from ml_git.file_system.cache import Cache
+from ml_git.file_system.index import MultihashIndex, STAT_KEY, StatChange, compare_stat, stat_fingerprint
 from ml_git.utils import yaml_load, yaml_save
 
 singlefile = {
@@ -121,3 +126,276 @@ class IndexTestCases(unittest.TestCase):
 
         self.assertTrue(mf.exists('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u'))
         self.assertTrue(mf.exists('zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2'))
+
+    def test_add_modified_file_reads_once(self):
+        data_path = os.path.join(self.tmp_dir, 'mutable-data')
+        os.makedirs(data_path)
+        file_path = os.path.join(data_path, 'file.bin')
+        with open(file_path, 'wb') as f:
+            f.write(os.urandom(1024))
+
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir, MutabilityType.MUTABLE.value)
+        idx.add(data_path, '')
+        first_hash = idx.get_index_yaml().get_index()['file.bin']['hash']
+
+        with open(file_path, 'ab') as f:
+            f.write(b'modified')
+        os.utime(file_path, (1, 1))
+
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir, MutabilityType.MUTABLE.value)
+        with mock.patch.object(idx._hfs, 'get_scid') as get_scid, \
+                mock.patch.object(idx._hfs, 'put', wraps=idx._hfs.put) as put:
+            idx.add(data_path, '')
+        get_scid.assert_not_called()
+        put.assert_not_called()
+
+        file_index = idx.get_index_yaml().get_index()['file.bin']
+        self.assertNotEqual(file_index['hash'], first_hash)
+        self.assertEqual(file_index['previous_hash'], first_hash)
+        self.assertTrue(idx.get_index().exists(file_index['hash']))
+
+    def test_add_pipeline(self):
+        data_path = os.path.join(self.tmp_dir, 'pipeline-data')
+        for directory in ('a', os.path.join('a', 'b'), 'c'):
+            os.makedirs(os.path.join(data_path, directory))
+            for i in range(20):
+                with open(os.path.join(data_path, directory, 'file%d.txt' % i), 'w') as f:
+                    f.write('%s %d' % (directory, i))
+
+        with mock.patch('ml_git.file_system.index.ADD_PIPELINE_DEPTH', 4), \
+                mock.patch('ml_git.file_system.index.ADD_CHECKPOINT_INTERVAL', 0):
+            idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir)
+            idx.add(data_path, '')
+        self.assertEqual(len(idx.get_index_yaml().get_index()), 60)
+        self.assertEqual(sum(len(files) for files in idx.get_index().get_yaml().values()), 60)
+
+        with open(os.path.join(data_path, 'bad.txt'), 'w') as f:
+            f.write('bad')
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir)
+        put_if_changed = idx._hfs.put_if_changed
+
+        def failing_put(path, previous_key=None):
+            if path.endswith('bad.txt'):
+                raise OSError('bad file')
+            return put_if_changed(path, previous_key)
+        with mock.patch.object(idx._hfs, 'put_if_changed', side_effect=failing_put), \
+                mock.patch('ml_git.pool.WorkerPool._retry_wait'), mock.patch('ml_git.file_system.index.log') as log:
+            idx.add(data_path, '')
+        self.assertIn('bad file', str(log.error.call_args))
+        self.assertNotIn('bad.txt', MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir).get_index_yaml().get_index())
+
+    def test_add_writer_errors(self):
+        data_path = os.path.join(self.tmp_dir, 'writer-data')
+        os.makedirs(data_path)
+        for i in range(30):
+            with open(os.path.join(data_path, 'file%d.txt' % i), 'w') as f:
+                f.write('file %d' % i)
+
+        def failing_after(function, calls):
+            def failing(*args, **kwargs):
+                failing.calls += 1
+                if failing.calls == calls:
+                    raise OSError('writer failed')
+                return function(*args, **kwargs)
+            failing.calls = 0
+            return failing
+
+        for method, calls in (('update_index', 3), ('_checkpoint', 1)):
+            idx = MultihashIndex('dataset-spec', os.path.join(self.tmp_dir, method), self.tmp_dir)
+            with mock.patch('ml_git.file_system.index.ADD_PIPELINE_DEPTH', 2), \
+                    mock.patch('ml_git.file_system.index.ADD_CHECKPOINT_INTERVAL', 0), \
+                    mock.patch.object(idx, method, side_effect=failing_after(getattr(idx, method), calls)), \
+                    mock.patch('ml_git.file_system.index.log') as log:
+                adding = threading.Thread(target=idx.add, args=(data_path, ''), daemon=True)
+                adding.start()
+                adding.join(60)
+            # the scan is not held back by the results left behind the error
+            self.assertFalse(adding.is_alive())
+            self.assertIn('writer failed', str(log.error.call_args))
+
+    def test_add_single_file_journaled(self):
+        data_path = os.path.join(self.tmp_dir, 'journal-data')
+        os.makedirs(data_path)
+        past = time.time() - 100
+        for i in range(30):
+            with open(os.path.join(data_path, 'file%d.txt' % i), 'w') as f:
+                f.write('file %d' % i)
+            # not racily clean, the files are not hashed again by the next add
+            os.utime(os.path.join(data_path, 'file%d.txt' % i), (past, past))
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir)
+        idx.add(data_path, '')
+        idx.get_index_yaml().get_manifest_index().compact()
+        index_path = os.path.join(self.tmp_dir, 'metadata', 'dataset-spec', INDEX_FILE)
+        with open(index_path) as f:
+            index_content = f.read()
+
+        with open(os.path.join(data_path, 'new.txt'), 'w') as f:
+            f.write('new')
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir)
+        idx.add(data_path, '')
+        with open(index_path) as f:
+            self.assertEqual(f.read(), index_content)
+        with open(index_path + '.journal') as f:
+            self.assertEqual(len(f.readlines()), 1)
+        self.assertIn('new.txt', idx.get_index_yaml().get_index())
+
+    def test_add_nested_files_not_hashed_again(self):
+        data_path = os.path.join(self.tmp_dir, 'nested-data')
+        os.makedirs(os.path.join(data_path, 'a', 'b'))
+        past = time.time() - 100
+        for i in range(10):
+            file_path = os.path.join(data_path, 'a', 'b', 'file%d.txt' % i)
+            with open(file_path, 'w') as f:
+                f.write('file %d' % i)
+            os.utime(file_path, (past, past))
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir)
+        idx.add(data_path, '')
+        full_index = idx.get_index_yaml()
+        file_index = full_index.get_manifest_index().find('a/b/file0.txt')
+        fullpath = os.path.join(data_path, 'a', 'b', 'file0.txt')
+        self.assertIsNone(full_index.check_stat(file_index, 'a/b/file0.txt', fullpath))
+
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir)
+        with mock.patch.object(idx._hfs, 'get_scid') as get_scid, \
+                mock.patch.object(idx._hfs, 'put_if_changed') as put_if_changed:
+            idx.add(data_path, '')
+        get_scid.assert_not_called()
+        put_if_changed.assert_not_called()
+
+    def test_add_ignored_subdir(self):
+        data_path = os.path.join(self.tmp_dir, 'ignore-data')
+        os.makedirs(os.path.join(data_path, 'skip'))
+        os.makedirs(os.path.join(data_path, 'keep'))
+        with open(os.path.join(data_path, MLGIT_IGNORE_FILE_NAME), 'w') as f:
+            f.write('skip/\n')
+        for directory in ('skip', 'keep'):
+            with open(os.path.join(data_path, directory, 'a.txt'), 'w') as f:
+                f.write(directory)
+
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir)
+        idx.add(data_path, '', ['skip', 'keep'])
+        self.assertEqual(list(idx.get_index_yaml().get_index()), ['keep/a.txt'])
+
+    def test_add_sqlite_reads_by_key(self):
+        data_path = os.path.join(self.tmp_dir, 'sqlite-data')
+        os.makedirs(data_path)
+        for i in range(10):
+            with open(os.path.join(data_path, 'file%d.txt' % i), 'w') as f:
+                f.write('file %d' % i)
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir, index_format=IndexFormat.SQLITE.value)
+        idx.add(data_path, '')
+        with open(os.path.join(data_path, 'other.txt'), 'w') as f:
+            f.write('other')
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir, index_format=IndexFormat.SQLITE.value)
+        with mock.patch('ml_git.manifest_storage.SqliteManifestStorage.load') as load:
+            idx.add(data_path, '')
+        load.assert_not_called()
+        self.assertIsNotNone(idx.get_index_yaml().get_manifest_index().find('other.txt'))
+
+    def test_add_cache_links_not_hashed_again(self):
+        data_path = os.path.join(self.tmp_dir, 'cache-data')
+        os.makedirs(data_path)
+        past = time.time() - 100
+        for i in range(50):
+            file_path = os.path.join(data_path, 'file%d.txt' % i)
+            with open(file_path, 'w') as f:
+                f.write('file %d' % i)
+            os.utime(file_path, (past, past))
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir)
+        idx.add(data_path, '')
+
+        cache = Cache(os.path.join(self.tmp_dir, 'cache'), data_path, idx.get_index())
+        linked_files = cache.update()
+        self.assertEqual(len(linked_files), 50)
+        file_index = idx.get_index_yaml().get_manifest_index().find('file0.txt')
+        self.assertEqual(compare_stat(file_index, os.stat(os.path.join(data_path, 'file0.txt'))), StatChange.UNKNOWN)
+        idx.get_index_yaml().refresh_stats(data_path, linked_files)
+        # files already linked are left as they are
+        self.assertEqual(cache.update(), [])
+
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir)
+        with mock.patch.object(idx._hfs, 'get_scid') as get_scid, \
+                mock.patch.object(idx._hfs, 'put_if_changed') as put_if_changed:
+            idx.add(data_path, '')
+        get_scid.assert_not_called()
+        put_if_changed.assert_not_called()
+
+    def test_add_in_processes(self):
+        data_path = os.path.join(self.tmp_dir, 'process-data')
+        os.makedirs(os.path.join(data_path, 'a'))
+        for i in range(10):
+            with open(os.path.join(data_path, 'a', 'file%d.txt' % i), 'w') as f:
+                f.write('file %d' % i)
+
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir, MutabilityType.MUTABLE.value,
+                             hashing_mode=HashingMode.PROCESSES.value)
+        idx.add(data_path, '')
+        full_index = idx.get_index_yaml().get_index()
+        self.assertEqual(len(full_index), 10)
+        self.assertEqual(sum(len(files) for files in idx.get_index().get_yaml().values()), 10)
+
+        changed_file = os.path.join('a', 'file0.txt')
+        previous_hash = full_index[changed_file]['hash']
+        with open(os.path.join(data_path, changed_file), 'w') as f:
+            f.write('changed')
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir, MutabilityType.MUTABLE.value,
+                             hashing_mode=HashingMode.PROCESSES.value)
+        idx.add(data_path, '')
+        changed_index = idx.get_index_yaml().get_index()[changed_file]
+        self.assertNotEqual(changed_index['hash'], previous_hash)
+        self.assertEqual(changed_index['previous_hash'], previous_hash)
+        self.assertIn(changed_file, idx.get_index().get_yaml()[changed_index['hash']])
+
+    def test_add_deep_tree_hashes_each_file_once(self):
+        data_path = os.path.join(self.tmp_dir, 'deep-data')
+        directory = data_path
+        for depth in range(25):
+            directory = os.path.join(directory, 'level%d' % depth)
+            os.makedirs(directory)
+            for i in range(4):
+                with open(os.path.join(directory, 'file%d.txt' % i), 'w') as f:
+                    f.write('%d %d' % (depth, i))
+
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir)
+        with mock.patch.object(idx._hfs, 'put_if_changed', wraps=idx._hfs.put_if_changed) as put:
+            idx.add(data_path, '')
+        self.assertEqual(put.call_count, 100)
+        self.assertEqual(idx.wp._progress_bar.total, 100)
+
+        # the files of a directory given twice, or inside another directory given, are not hashed again
+        level2 = os.path.join('level0', 'level1', 'level2')
+        idx = MultihashIndex('dataset-spec', os.path.join(self.tmp_dir, 'index2'), self.tmp_dir)
+        with mock.patch.object(idx._hfs, 'put_if_changed', wraps=idx._hfs.put_if_changed) as put:
+            idx.add(data_path, '', [level2, 'level0', os.path.join('level0', 'level1', 'file0.txt'), 'level0/'])
+        self.assertEqual(put.call_count, 100)
+        self.assertEqual(idx.wp._progress_bar.total, 100)
+
+    def test_add_touched_file_hashed_once(self):
+        data_path = os.path.join(self.tmp_dir, 'mutable-data')
+        os.makedirs(data_path)
+        file_path = os.path.join(data_path, 'file.bin')
+        with open(file_path, 'wb') as f:
+            f.write(os.urandom(1024))
+        past = time.time() - 100
+        os.utime(file_path, (past, past))
+
+        idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir, MutabilityType.MUTABLE.value)
+        idx.add(data_path, '')
+        file_index = idx.get_index_yaml().get_index()['file.bin']
+        self.assertIsNotNone(file_index[STAT_KEY])
+        self.assertEqual(compare_stat(file_index, os.stat(file_path)), StatChange.UNCHANGED)
+
+        os.utime(file_path, (past + 10, past + 10))
+        self.assertEqual(compare_stat(file_index, os.stat(file_path)), StatChange.UNKNOWN)
+        for expected_calls in (1, 0):
+            idx = MultihashIndex('dataset-spec', self.tmp_dir, self.tmp_dir, MutabilityType.MUTABLE.value)
+            with mock.patch.object(idx._hfs, 'put_if_changed', wraps=idx._hfs.put_if_changed) as put_if_changed:
+                idx.add(data_path, '')
+            self.assertEqual(put_if_changed.call_count, expected_calls)
+        self.assertEqual(idx.get_index_yaml().get_index()['file.bin']['hash'], file_index['hash'])
+
+        with open(file_path, 'ab') as f:
+            f.write(b'modified')
+        self.assertEqual(compare_stat(file_index, os.stat(file_path)), StatChange.MODIFIED)
+        # a file modified while it is indexed is hashed again until it is older than the racy window
+        self.assertIsNone(stat_fingerprint(os.stat(file_path)))
@@ -20,6 +20,7 @@ from ml_git.file_system.hashfs import MultihashFS
 from ml_git.file_system.index import MultihashIndex, Status, FullIndex
 from ml_git.file_system.local import LocalRepository
 from ml_git.file_system.objects import Objects
+from ml_git.manifest import Manifest
 from ml_git.sample import SampleValidate, SampleValidateException
 from ml_git.storages.s3_storage import S3Storage
 from ml_git.utils import yaml_load, yaml_save, ensure_path_exists, set_write_read
@@ -102,7 +103,8 @@ class LocalRepositoryTestCases(unittest.TestCase):
         idx = MultihashIndex(specpath, indexpath, objectpath)
         idx.add('data-test-push/', manifestpath)
 
-        fi = yaml_load(os.path.join(specpath, 'INDEX.yaml'))
+        # the entries of a single add are journaled next to INDEX.yaml
+        fi = Manifest(os.path.join(specpath, 'INDEX.yaml')).load()
         self.assertTrue(len(fi) > 0)
         self.assertTrue(os.path.exists(indexpath))
 
@@ -496,6 +498,32 @@ class LocalRepositoryTestCases(unittest.TestCase):
         self.assertEqual(test_spec_file[MODEL_SPEC_KEY]['metrics'].get('metric_a', ''), 10.0)
         self.assertEqual(test_spec_file[MODEL_SPEC_KEY]['metrics'].get('metric_b', ''), 9.0)
 
+    def test_get_index_files_status(self):
+        ws_path = os.path.join(self.tmp_dir, 'wspace')
+        for file in ['new.jpg', 'corrupted.jpg', 'unchanged.jpg', os.path.join('other', 'file.jpg')]:
+            ensure_path_exists(os.path.dirname(os.path.join(ws_path, file)))
+            with open(os.path.join(ws_path, file), 'w') as f:
+                f.write(file)
+        fidx = FullIndex('dataset-ex', self.tmp_dir)
+        for file, status in [('new.jpg', 'a'), ('corrupted.jpg', 'c'), ('unchanged.jpg', 'u'), ('deleted.jpg', 'u'),
+                             ('other/file.jpg', 'a')]:
+            fidx.get_manifest_index().set(file, {'ctime': 0, 'mtime': 0, 'status': status, 'hash': 'hash', 'size': 0})
+
+        r = LocalRepository(yaml_load('hdata/config.yaml'), os.path.join(self.tmp_dir, 'objectsfs'))
+        new_files, deleted_files, all_files, corrupted_files = r._get_index_files_status(False, fidx.get_manifest_index(),
+                                                                                         ws_path)
+        self.assertEqual(sorted(new_files), ['new.jpg', 'other/file.jpg'])
+        self.assertEqual(deleted_files, ['deleted.jpg'])
+        self.assertEqual(corrupted_files, ['corrupted.jpg'])
+        self.assertEqual(all_files, {'new.jpg', 'corrupted.jpg', 'unchanged.jpg', 'deleted.jpg',
+                                     os.path.join('other', 'file.jpg')})
+
+        new_files, deleted_files, all_files, _ = r._get_index_files_status(False, fidx.get_manifest_index(), ws_path,
+                                                                           status_directory='other')
+        self.assertEqual(new_files, ['other/file.jpg'])
+        self.assertEqual(deleted_files, [])
+        self.assertEqual(len(all_files), 5)
+
     def check_delete(self, s3, testbucketname):
         try:
             s3.Object(testbucketname, 'zdj7WWsMkELZSGQGgpm5VieCWV8NxY5n5XEP73H4E7eeDMA3A').load()
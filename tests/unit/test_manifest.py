@@ -5,10 +5,15 @@ SPDX-License-Identifier: GPL-2.0-only
 
 import os
 import unittest
+from unittest import mock
 
 import pytest
 
+from ml_git.compact_manifest import CompactManifest, ManifestReader, count_manifest, iter_manifest, load_manifest
+from ml_git.constants import IndexFormat
 from ml_git.manifest import Manifest
+from ml_git.manifest_storage import SqliteManifestStorage
+from ml_git.utils import yaml_load, yaml_save
 
 
 @pytest.mark.usefixtures('tmp_dir')
@@ -129,3 +134,125 @@ class ManifestTestCases(unittest.TestCase):
         mf_diff, _ = mf_1.get_diff(mf_2)
 
         self.assertEqual(mf_diff, {'zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u': {'data/think-hires.jpg'}})
+
+    def test_sqlite_index_format(self):
+        mfpath = os.path.join(self.tmp_dir, 'INDEX.yaml')
+
+        mf = Manifest(mfpath, IndexFormat.SQLITE.value)
+        mf.add('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u', 'data/think-hires.jpg')
+        mf.add('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u', 'data/think-hires2.jpg')
+        mf.add('data/image.jpg', {'ctime': 1.5, 'mtime': 1.25, 'status': 'a', 'size': 10})
+        mf.save()
+        self.assertFalse(os.path.exists(mfpath))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, 'INDEX.db')))
+
+        mf = Manifest(mfpath)
+        self.assertTrue(mf.exists_keyfile('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u', 'data/think-hires2.jpg'))
+        mf['data/image.jpg']['status'] = 'u'
+        self.assertTrue(mf.rm('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u', 'data/think-hires2.jpg'))
+        with mock.patch.object(SqliteManifestStorage, 'load') as load:
+            mf.save()
+            mf = Manifest(mfpath)
+            self.assertEqual(mf.get('data/image.jpg')['status'], 'u')
+            self.assertFalse(mf.exists_keyfile('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u', 'data/think-hires2.jpg'))
+        load.assert_not_called()
+        self.assertEqual(len(mf.get_yaml()), 2)
+
+    def test_index_format_migration(self):
+        mfpath = os.path.join(self.tmp_dir, 'INDEX.yaml')
+        index = {'data/image.jpg': {'ctime': 1612274964.5542126, 'mtime': 1612274964.5542126, 'status': 'a',
+                                    'hash': 'zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2', 'size': 10},
+                 'zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u': {'data/think-hires.jpg', 'data/think-hires2.jpg'}}
+        yaml_save(index, mfpath)
+
+        mf = Manifest(mfpath, IndexFormat.SQLITE.value)
+        self.assertFalse(os.path.exists(mfpath))
+        self.assertEqual(mf.get_yaml(), index)
+
+        Manifest(mfpath, IndexFormat.YAML.value)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, 'INDEX.db')))
+        self.assertEqual(yaml_load(mfpath), index)
+
+    def test_journaled_yaml(self):
+        mfpath = os.path.join(self.tmp_dir, 'INDEX.yaml')
+        index = {'data/image.jpg': {'ctime': 1.5, 'mtime': 1.5, 'status': 'a', 'size': 10},
+                 'data/image2.jpg': {'ctime': 2.5, 'mtime': 2.5, 'status': 'a', 'size': 20}}
+        yaml_save(index, mfpath)
+
+        mf = Manifest(mfpath, journaled=True)
+        mf['data/image.jpg']['status'] = 'u'
+        mf.rm_key('data/image2.jpg')
+        mf.add('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u', 'data/think-hires.jpg')
+        mf.save()
+        self.assertEqual(yaml_load(mfpath), index)
+        self.assertTrue(os.path.exists(mfpath + '.journal'))
+
+        expected_index = {'data/image.jpg': {'ctime': 1.5, 'mtime': 1.5, 'status': 'u', 'size': 10},
+                          'zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u': {'data/think-hires.jpg'}}
+        mf = Manifest(mfpath, journaled=True)
+        self.assertEqual(mf.get_yaml(), expected_index)
+        mf.compact()
+        self.assertFalse(os.path.exists(mfpath + '.journal'))
+        self.assertEqual(yaml_load(mfpath), expected_index)
+
+    def test_rm_files(self):
+        mfpath = os.path.join(self.tmp_dir, 'manifest.yaml')
+        merged_mfpath = os.path.join(self.tmp_dir, 'merged_manifest.yaml')
+        yaml_save({'zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2': {'data/image2.jpg'}}, merged_mfpath)
+
+        mf = Manifest(mfpath)
+        mf.add('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u', 'data/think-hires.jpg')
+        mf.add('zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u', 'data/think-hires2.jpg')
+        self.assertEqual(mf.search('data/think-hires.jpg'), 'zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u')
+        mf.add('zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2', 'data/image.jpg')
+        mf.add('zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2', 'data/think-hires2.jpg',
+               previous_key='zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u')
+        mf.merge(merged_mfpath)
+        self.assertIsNone(mf.search('data/think-hires.jpg'))
+        self.assertEqual(sorted(mf.files()), ['data/image.jpg', 'data/image2.jpg', 'data/think-hires2.jpg'])
+
+        self.assertEqual(mf.rm_files(['data/image.jpg', 'data/think-hires.jpg', 'data/image2.jpg']), 2)
+        self.assertEqual(mf.get_yaml(), {'zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2': {'data/think-hires2.jpg'}})
+        self.assertEqual(mf.files(), ['data/think-hires2.jpg'])
+
+    def test_compact_manifest(self):
+        mfpath = os.path.join(self.tmp_dir, 'MANIFEST.yaml')
+        manifest = {'zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u': {'data/think-hires.jpg', 'data/dir/think.jpg'},
+                    'zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2': {'image.jpg', '123', 'a: b', '-c.jpg'},
+                    'zdj7WYXuTkDDPbh8U2mev7fYqEM5ErKw7TUppbr6u4f9PzjDe': set()}
+        yaml_save(manifest, mfpath)
+
+        compact = load_manifest(mfpath)
+        self.assertIsInstance(compact, CompactManifest)
+        self.assertEqual(list(compact), list(yaml_load(mfpath)))
+        self.assertEqual(len(compact), 3)
+        self.assertEqual(compact, manifest)
+        self.assertEqual(set(compact['zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2']),
+                         {'image.jpg', '123', 'a: b', '-c.jpg'})
+        self.assertIn('data/dir/think.jpg', compact['zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u'])
+        self.assertIsNone(compact.get('zdj7WYXuTkDDPbh8U2mev7fYqEM5ErKw7TUppbr6u4f9PzjDa'))
+        self.assertIsNone(compact.get('not-a-key'))
+
+        yaml_save({'not-a-key': {'image.jpg'}}, mfpath)
+        self.assertEqual(load_manifest(mfpath), {'not-a-key': {'image.jpg'}})
+        self.assertEqual(load_manifest(os.path.join(self.tmp_dir, 'missing.yaml')), {})
+
+    def test_manifest_reader(self):
+        mfpath = os.path.join(self.tmp_dir, 'MANIFEST.yaml')
+        manifest = {'zdj7WgHSKJkoJST5GWGgS53ARqV7oqMGYVvWzEWku3MBfnQ9u': {'data/think-hires.jpg', 'data/dir/think.jpg'},
+                    'zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2': {'image.jpg'},
+                    'zdj7WYXuTkDDPbh8U2mev7fYqEM5ErKw7TUppbr6u4f9PzjDe': set()}
+        yaml_save(manifest, mfpath)
+
+        reader = ManifestReader(mfpath)
+        self.assertEqual(len(reader), 3)
+        self.assertEqual(list(reader.keys()), list(yaml_load(mfpath)))
+        self.assertEqual(list(reader.keys()), list(reader.keys()))
+        self.assertEqual({key: set(files) for key, files in reader.items()}, manifest)
+
+        long_name = 'data/' + 'x' * 200
+        manifest['zdj7WemKEtQMVL81UU6PSuYaoxvBQ6CiUMq1fMvoXBhPUsCK2'].add(long_name)
+        yaml_save(manifest, mfpath)
+        self.assertEqual(count_manifest(mfpath), 3)
+        self.assertEqual({key: set(files) for key, files in iter_manifest(mfpath)}, manifest)
+        self.assertEqual(len(ManifestReader(os.path.join(self.tmp_dir, 'missing.yaml'))), 0)
@@ -3,10 +3,12 @@
 SPDX-License-Identifier: GPL-2.0-only
 """
 
+import operator
 import unittest
 
+from ml_git.constants import HashingMode
 from ml_git.ml_git_message import output_messages
-from ml_git.pool import WorkerPool, process_futures
+from ml_git.pool import WorkerPool, process_futures, use_process_pool, PROCESS_POOL_MIN_TASKS
 
 
 class Context(object):
@@ -136,3 +138,27 @@ class PoolTestCases(unittest.TestCase):
 
         with self.assertRaises(Exception):
             process_futures(futs, wp)
+
+    def test_process_pool(self):
+        wp = WorkerPool(nworkers=2, processes=True)
+        for i in range(4):
+            wp.submit(operator.mul, i, 10)
+        futs = wp.wait()
+        self.assertEqual([fut.result() for fut in futs], [0, 10, 20, 30])
+
+        wp.reset_futures()
+        wp.submit(operator.truediv, 1, 0)
+        with self.assertRaises(ZeroDivisionError):
+            process_futures(wp.wait(), wp)
+        self.assertEqual(wp.errors_count, 1)
+        wp.shutdown()
+
+    def test_use_process_pool(self):
+        processes, tasks = use_process_pool(HashingMode.THREADS.value, range(PROCESS_POOL_MIN_TASKS))
+        self.assertFalse(processes)
+        processes, tasks = use_process_pool(HashingMode.PROCESSES.value, range(10))
+        self.assertTrue(processes)
+        self.assertEqual(list(tasks), list(range(10)))
+        processes, tasks = use_process_pool(HashingMode.AUTO.value, range(10))
+        self.assertFalse(processes)
+        self.assertEqual(list(tasks), list(range(10)))
@@ -0,0 +1,106 @@
+"""
+© Copyright 2020 HP Development Company, L.P.
+SPDX-License-Identifier: GPL-2.0-only
+"""
+
+import os
+import unittest
+
+import pytest
+
+from ml_git.file_system.scanner import scan_files, ScanCache
+from ml_git.utils import compile_ignore_rules
+
+
+@pytest.mark.usefixtures('tmp_dir')
+class ScannerTestCases(unittest.TestCase):
+
+    def _write(self, relative_path):
+        file_path = os.path.join(self.tmp_dir, relative_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as f:
+            f.write(relative_path)
+
+    def test_scan_files(self):
+        files = ['root.txt', os.path.join('a', 'a.txt'), os.path.join('a', 'b', 'c', 'c.txt'),
+                 os.path.join('ignored', 'i.txt'), os.path.join('d', 'ignored.txt')]
+        for file in files:
+            self._write(file)
+        os.symlink(os.path.join(self.tmp_dir, 'a'), os.path.join(self.tmp_dir, 'link'))
+
+        scanned = dict(scan_files(str(self.tmp_dir), with_stat=True, max_workers=2))
+        self.assertEqual(sorted(scanned), sorted(files))
+        for file, stat in scanned.items():
+            self.assertEqual(stat.st_size, len(file))
+
+        def ignore(relative_path, is_dir):
+            return relative_path == 'ignored' if is_dir else relative_path.endswith('ignored.txt')
+        scanned = sorted(path for path, stat in scan_files(str(self.tmp_dir), ignore=ignore) if stat is None)
+        self.assertEqual(scanned, sorted(files[:3]))
+
+        self.assertEqual(sorted(path for path, _ in scan_files(str(self.tmp_dir), 'a')), sorted(files[1:3]))
+        self.assertEqual(list(scan_files(str(self.tmp_dir), 'missing')), [])
+
+    def test_scan_ignored_subdir(self):
+        files = [os.path.join('skip', 'a.txt'), os.path.join('skip', 'inner', 'b.txt'), os.path.join('keep', 'c.txt')]
+        for file in files:
+            self._write(file)
+        ignore = compile_ignore_rules(['skip/']).ignores
+
+        self.assertEqual(list(scan_files(str(self.tmp_dir), 'skip', ignore)), [])
+        self.assertEqual(list(scan_files(str(self.tmp_dir), os.path.join('skip', 'inner'), ignore)), [])
+        self.assertEqual([path for path, _ in scan_files(str(self.tmp_dir), 'keep', ignore)], files[2:])
+
+    def test_scan_files_with_cache(self):
+        files = ['root.txt', os.path.join('a', 'a.txt'), os.path.join('a', 'b', 'b.txt')]
+        for file in files:
+            self._write(file)
+        root = str(self.tmp_dir)
+        workspace = os.path.join(root, 'a')
+        cache_path = os.path.join(root, 'SCAN_CACHE.json')
+        old_ns = 10 ** 18
+        for directory in (workspace, os.path.join(workspace, 'b')):
+            os.utime(directory, ns=(old_ns, old_ns))
+
+        scanned = sorted(path for path, _ in scan_files(workspace, cache=ScanCache(cache_path, workspace)))
+        self.assertEqual(scanned, ['a.txt', os.path.join('b', 'b.txt')])
+        self.assertTrue(os.path.exists(cache_path))
+
+        # the listing of a directory whose mtime did not change is taken from the cache
+        self._write(os.path.join('a', 'b', 'new.txt'))
+        os.utime(os.path.join(workspace, 'b'), ns=(old_ns, old_ns))
+        scanned = sorted(path for path, _ in scan_files(workspace, cache=ScanCache(cache_path, workspace)))
+        self.assertEqual(scanned, ['a.txt', os.path.join('b', 'b.txt')])
+
+        os.utime(os.path.join(workspace, 'b'), ns=(old_ns + 1, old_ns + 1))
+        scanned = sorted(path for path, _ in scan_files(workspace, cache=ScanCache(cache_path, workspace)))
+        self.assertEqual(scanned, ['a.txt', os.path.join('b', 'b.txt'), os.path.join('b', 'new.txt')])
+
+        # a cache of another directory is not used
+        scanned = sorted(path for path, _ in scan_files(root, cache=ScanCache(cache_path, root)))
+        self.assertEqual(scanned, sorted(files + [os.path.join('a', 'b', 'new.txt'), 'SCAN_CACHE.json']))
+
+    def test_scan_subdir_with_cache(self):
+        files = ['root.txt', os.path.join('sub', 'a.txt'), os.path.join('sub', 'b', 'b.txt'), os.path.join('other', 'o.txt')]
+        for file in files:
+            self._write(file)
+        root = str(self.tmp_dir)
+        cache_path = os.path.join(root, 'SCAN_CACHE.json')
+        old_ns = 10 ** 18
+        for directory in ('sub', os.path.join('sub', 'b'), 'other'):
+            os.utime(os.path.join(root, directory), ns=(old_ns, old_ns))
+
+        scanned = sorted(path for path, _ in scan_files(root, 'sub', cache=ScanCache(cache_path, root)))
+        self.assertEqual(scanned, sorted(files[1:3]))
+        scanned = sorted(path for path, _ in scan_files(root, 'other', cache=ScanCache(cache_path, root)))
+        self.assertEqual(scanned, files[3:])
+
+        # the listings of both subdirectories were kept
+        self._write(os.path.join('sub', 'b', 'new.txt'))
+        self._write(os.path.join('other', 'new.txt'))
+        for directory in (os.path.join('sub', 'b'), 'other'):
+            os.utime(os.path.join(root, directory), ns=(old_ns, old_ns))
+        scanned = sorted(path for path, _ in scan_files(root, 'sub', cache=ScanCache(cache_path, root)))
+        self.assertEqual(scanned, sorted(files[1:3]))
+        scanned = sorted(path for path, _ in scan_files(root, 'other', cache=ScanCache(cache_path, root)))
+        self.assertEqual(scanned, files[3:])
@@ -20,7 +20,7 @@ from ml_git.utils import json_load, yaml_load, yaml_save, RootPathException, get
     ensure_path_exists, yaml_load_str, get_yaml_str, run_function_per_group, unzip_files_in_directory, \
     remove_from_workspace, group_files_by_path, remove_other_files, remove_unnecessary_files, change_keys_in_config, \
     update_directories_to_plural, validate_config_keys, create_csv_file, create_or_update_gitignore, should_ignore_file, \
-    get_ignore_rules
+    get_ignore_rules, compile_ignore_rules
 from tests.unit.conftest import DATASETS, MODELS, S3H, S3
 
 
@@ -327,6 +327,19 @@ class UtilsTestCases(unittest.TestCase):
         self.assertTrue(should_ignore_file(ignore_rules, 'access.b.log'))
         self.assertFalse(should_ignore_file(ignore_rules, 'access.d.log'))
 
+    def test_compile_ignore_rules(self):
+        ignore_rules = compile_ignore_rules(['# comment', '', 'data/*', '!data/keep-*', 'ignored-folder/', '\\!file.txt',
+                                             '*.tmp', '!*.tmp'])
+        self.assertTrue(ignore_rules.ignores('data/file.png'))
+        self.assertFalse(ignore_rules.ignores('data/keep-file.png'))
+        self.assertTrue(ignore_rules.ignores('ignored-folder', is_dir=True))
+        self.assertFalse(ignore_rules.ignores('ignored-folder'))
+        self.assertTrue(ignore_rules.ignores('!file.txt'))
+        self.assertFalse(ignore_rules.ignores('# comment'))
+        self.assertFalse(ignore_rules.ignores('file.tmp'))
+        self.assertTrue(should_ignore_file(ignore_rules, 'data/file.png'))
+        self.assertIsNone(compile_ignore_rules(None))
+
     def test_get_ignore_rules(self):
         ignore_rules = ['data/*.png\n', 'ignored-folder/']
         file = os.path.join(self.tmp_dir, MLGIT_IGNORE_FILE_NAME)